@@ -0,0 +1,66 @@
+"""add usage access indexes
+
+Revision ID: 7c2e4a9f1b3d
+Revises: 35b9659436ae
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e4a9f1b3d'
+down_revision: Union[str, Sequence[str], None] = '35b9659436ae'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY cannot run inside a transaction; on SQLite the postgresql_* options are ignored
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_usage_logs_user_id_created_at',
+            'usage_logs',
+            ['user_id', 'created_at'],
+            unique=False,
+            postgresql_include=['cost', 'total_tokens', 'provider', 'model', 'latency_ms'],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_api_keys_user_id_provider_is_active',
+            'api_keys',
+            ['user_id', 'provider', 'is_active'],
+            unique=False,
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_daily_usage_summaries_user_id_date',
+            'daily_usage_summaries',
+            ['user_id', 'date'],
+            unique=False,
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_daily_usage_summaries_user_id_date',
+            table_name='daily_usage_summaries',
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_api_keys_user_id_provider_is_active',
+            table_name='api_keys',
+            postgresql_concurrently=True
+        )
+        op.drop_index(
+            'ix_usage_logs_user_id_created_at',
+            table_name='usage_logs',
+            postgresql_concurrently=True
+        )
@@ -0,0 +1,113 @@
+"""partition usage_logs by month
+
+Revision ID: 9d4b1f6e2a8c
+Revises: 7c2e4a9f1b3d
+Create Date: 2026-10-18 11:00:00.000000
+
+Rebuilds usage_logs as a table range-partitioned by month on created_at, with one
+partition per month from the oldest row to PARTITIONS_AHEAD months ahead plus a default
+partition. Rows are copied, so run this in a maintenance window on large tables.
+app/services/partition_manager.py keeps future partitions created afterwards.
+
+PostgreSQL only; on SQLite usage_logs stays a plain table.
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4b1f6e2a8c'
+down_revision: Union[str, Sequence[str], None] = '7c2e4a9f1b3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS_AHEAD = 3
+
+USAGE_LOG_INDEXES = [
+    "CREATE INDEX ix_usage_logs_id ON usage_logs (id)",
+    "CREATE INDEX ix_usage_logs_created_at ON usage_logs (created_at)",
+    "CREATE INDEX ix_usage_logs_user_id_created_at ON usage_logs (user_id, created_at) "
+    "INCLUDE (cost, total_tokens, provider, model, latency_ms)",
+]
+
+
+def _add_months(start: datetime, months: int) -> datetime:
+    index = start.year * 12 + (start.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _rename_old_table() -> None:
+    """Move the current table aside; index and primary key names are schema-wide, so drop or rename them"""
+    op.execute("ALTER TABLE usage_logs RENAME TO usage_logs_old")
+    op.execute("ALTER TABLE usage_logs_old RENAME CONSTRAINT usage_logs_pkey TO usage_logs_old_pkey")
+    for index_name in ("ix_usage_logs_id", "ix_usage_logs_created_at", "ix_usage_logs_user_id_created_at"):
+        op.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+
+def _add_constraints_and_indexes(primary_key: str) -> None:
+    op.execute(f"ALTER TABLE usage_logs ADD CONSTRAINT usage_logs_pkey PRIMARY KEY ({primary_key})")
+    op.execute(
+        "ALTER TABLE usage_logs ADD CONSTRAINT usage_logs_user_id_fkey "
+        "FOREIGN KEY (user_id) REFERENCES users (id)"
+    )
+    op.execute(
+        "ALTER TABLE usage_logs ADD CONSTRAINT usage_logs_api_key_id_fkey "
+        "FOREIGN KEY (api_key_id) REFERENCES api_keys (id)"
+    )
+    for statement in USAGE_LOG_INDEXES:
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    _rename_old_table()
+
+    # The partition key must be part of the primary key and cannot be NULL
+    op.execute("UPDATE usage_logs_old SET created_at = now() WHERE created_at IS NULL")
+    op.execute(
+        "CREATE TABLE usage_logs (LIKE usage_logs_old INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (created_at)"
+    )
+    op.execute("ALTER TABLE usage_logs ALTER COLUMN created_at SET NOT NULL")
+
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM usage_logs_old")).scalar()
+    now = datetime.utcnow()
+    start = datetime((oldest or now).year, (oldest or now).month, 1)
+    last = _add_months(datetime(now.year, now.month, 1), PARTITIONS_AHEAD)
+    while start <= last:
+        end = _add_months(start, 1)
+        op.execute(
+            f"CREATE TABLE usage_logs_y{start.year:04d}m{start.month:02d} PARTITION OF usage_logs "
+            f"FOR VALUES FROM ('{start.isoformat()}+00') TO ('{end.isoformat()}+00')"
+        )
+        start = end
+    op.execute("CREATE TABLE usage_logs_default PARTITION OF usage_logs DEFAULT")
+
+    op.execute("INSERT INTO usage_logs SELECT * FROM usage_logs_old")
+    op.execute("DROP TABLE usage_logs_old")
+
+    _add_constraints_and_indexes("id, created_at")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+
+    _rename_old_table()
+
+    op.execute("CREATE TABLE usage_logs (LIKE usage_logs_old INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE usage_logs ALTER COLUMN created_at DROP NOT NULL")
+    op.execute("INSERT INTO usage_logs SELECT * FROM usage_logs_old")
+    # Dropping the parent drops every partition with it
+    op.execute("DROP TABLE usage_logs_old")
+
+    _add_constraints_and_indexes("id")
@@ -0,0 +1,49 @@
+"""unique daily usage summaries per user and day
+
+Revision ID: b5e8c2d7f4a1
+Revises: 9d4b1f6e2a8c
+Create Date: 2026-10-18 13:00:00.000000
+
+Rollups are upserted on (user_id, date), which needs a unique constraint. Duplicate
+summaries left by concurrent rollups are removed first, keeping one per user and day.
+The constraint's index replaces ix_daily_usage_summaries_user_id_date.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5e8c2d7f4a1'
+down_revision: Union[str, Sequence[str], None] = '9d4b1f6e2a8c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        op.execute(
+            "DELETE FROM daily_usage_summaries a USING daily_usage_summaries b "
+            "WHERE a.user_id = b.user_id AND a.date = b.date "
+            "AND a.id::text < b.id::text"
+        )
+    else:
+        op.execute(
+            "DELETE FROM daily_usage_summaries WHERE rowid NOT IN "
+            "(SELECT MAX(rowid) FROM daily_usage_summaries GROUP BY user_id, date)"
+        )
+
+    # Batch mode rebuilds the table on SQLite, which can't add constraints in place
+    with op.batch_alter_table('daily_usage_summaries') as batch_op:
+        batch_op.create_unique_constraint('uq_daily_usage_summaries_user_id_date', ['user_id', 'date'])
+        batch_op.drop_index('ix_daily_usage_summaries_user_id_date')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('daily_usage_summaries') as batch_op:
+        batch_op.create_index('ix_daily_usage_summaries_user_id_date', ['user_id', 'date'], unique=False)
+        batch_op.drop_constraint('uq_daily_usage_summaries_user_id_date', type_='unique')
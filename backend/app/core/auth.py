@@ -1,14 +1,20 @@
 import os
+import time
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Dict, Set, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 
-from app.core.database import get_db
+from app.core.database import get_db, get_async_db
 from app.models.user import User
 from app.schemas.user import TokenData
 
@@ -25,6 +31,81 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 # Security scheme
 security = HTTPBearer()
 
+# Seconds a verified token's principal is reused (never past the token's exp)
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Session-independent identity for hot paths that don't need the full user row"""
+    id: object
+    email: str
+    is_active: bool
+    plan: str
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, email=user.email, is_active=user.is_active, plan=user.plan)
+
+
+# token fingerprint -> (expires_at, Principal), least recently used first
+_principal_cache: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+# user_id -> fingerprints cached for that user, so one user's entries can be dropped
+_principal_fingerprints: Dict[object, Set[str]] = {}
+
+
+def token_fingerprint(token: str) -> str:
+    """Cache key for a token; the raw token is never stored"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _drop_principal(fingerprint: str):
+    entry = _principal_cache.pop(fingerprint, None)
+    if entry is None:
+        return
+    fingerprints = _principal_fingerprints.get(entry[1].id)
+    if fingerprints is not None:
+        fingerprints.discard(fingerprint)
+        if not fingerprints:
+            del _principal_fingerprints[entry[1].id]
+
+
+def get_cached_principal(token: str) -> Optional[Principal]:
+    fingerprint = token_fingerprint(token)
+    entry = _principal_cache.get(fingerprint)
+    if entry is None:
+        return None
+    if time.time() >= entry[0]:
+        _drop_principal(fingerprint)
+        return None
+    _principal_cache.move_to_end(fingerprint)
+    return entry[1]
+
+
+def cache_principal(token: str, principal: Principal, token_expires_at: Optional[float] = None):
+    fingerprint = token_fingerprint(token)
+    expires_at = time.time() + PRINCIPAL_CACHE_TTL
+    if token_expires_at is not None:
+        expires_at = min(expires_at, token_expires_at)
+
+    _drop_principal(fingerprint)
+    _principal_cache[fingerprint] = (expires_at, principal)
+    _principal_fingerprints.setdefault(principal.id, set()).add(fingerprint)
+
+    while len(_principal_cache) > PRINCIPAL_CACHE_SIZE:
+        _drop_principal(next(iter(_principal_cache)))
+
+
+def invalidate_principal(user_id=None):
+    """Forget cached principals for one user (e.g. after deactivation or a plan change), or all"""
+    if user_id is None:
+        _principal_cache.clear()
+        _principal_fingerprints.clear()
+        return
+    for fingerprint in list(_principal_fingerprints.get(user_id, ())):
+        _drop_principal(fingerprint)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
@@ -49,17 +130,23 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def verify_token(token: str) -> Optional[TokenData]:
-    """Verify and decode a JWT token"""
+def decode_token(token: str) -> Optional[dict]:
+    """Verify a JWT token and return its claims"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-        token_data = TokenData(email=email)
-        return token_data
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+    return payload
+
+
+def verify_token(token: str) -> Optional[TokenData]:
+    """Verify and decode a JWT token"""
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    return TokenData(email=payload["sub"])
 
 
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
@@ -67,6 +154,12 @@ def get_user_by_email(db: Session, email: str) -> Optional[User]:
     return db.query(User).filter(User.email == email).first()
 
 
+async def get_user_by_email_async(db: AsyncSession, email: str) -> Optional[User]:
+    """Get user by email without blocking the event loop"""
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+
 def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
     """Authenticate user with email and password"""
     user = get_user_by_email(db, email)
@@ -106,6 +199,74 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     return current_user
 
 
+async def get_current_user_async(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """Get current authenticated user from JWT token using the async session"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    
+    token_data = verify_token(credentials.credentials)
+    if token_data is None:
+        raise credentials_exception
+    
+    user = await get_user_by_email_async(db, email=token_data.email)
+    if user is None:
+        raise credentials_exception
+    
+    return user
+
+
+async def get_current_active_user_async(current_user: User = Depends(get_current_user_async)) -> User:
+    """Get current active user using the async session"""
+    if not current_user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return current_user
+
+
+async def get_principal_from_token(token: str, db: AsyncSession) -> Optional[Principal]:
+    """Resolve an app or Supabase JWT to a principal, reading users only when the token isn't cached"""
+    principal = get_cached_principal(token)
+    if principal is not None:
+        return principal
+    
+    payload = decode_token(token)
+    if payload is None:
+        # Not one of ours; /auth/login hands out Supabase access tokens
+        from app.core.supabase_auth import get_supabase_auth_service
+        return await get_supabase_auth_service().get_principal_by_token(token)
+    
+    user = await get_user_by_email_async(db, email=payload["sub"])
+    if user is None:
+        return None
+    
+    principal = Principal.from_user(user)
+    cache_principal(token, principal, payload.get("exp"))
+    return principal
+
+
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    """Get the current active principal from a JWT token, cached per token"""
+    principal = await get_principal_from_token(credentials.credentials, db)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    if not principal.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return principal
+
+
 def check_user_plan_access(user: User, required_plan: str) -> bool:
     """Check if user's plan allows access to a feature"""
     plan_hierarchy = ["free", "basic", "premium", "enterprise"]
@@ -1,9 +1,16 @@
 import os
-from sqlalchemy import create_engine
+import time
+import uuid
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from dotenv import load_dotenv
 
+from app.core.metrics import get_latency_recorder
+
 load_dotenv()
 
 # Database URL configuration with Supabase support
@@ -30,32 +37,119 @@ def get_supabase_config():
         "service_role_key": os.getenv("SUPABASE_SERVICE_ROLE_KEY")
     }
 
+def get_async_database_url(database_url: str) -> str:
+    """Map a sync database URL onto its async driver (asyncpg for Postgres, aiosqlite for SQLite)"""
+    url = make_url(database_url)
+    if url.get_backend_name() == "postgresql":
+        query = dict(url.query)
+        # asyncpg takes "ssl" rather than libpq's "sslmode"
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        url = url.set(drivername="postgresql+asyncpg", query=query)
+    elif url.get_backend_name() == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url.render_as_string(hide_password=False)
+
 DATABASE_URL = get_database_url()
+ASYNC_DATABASE_URL = get_async_database_url(DATABASE_URL)
+
+# "auto" detects the Supabase transaction pooler (port 6543 or a pooler host),
+# "pgbouncer" forces the pooler profile and "direct" forces client-side pooling
+DATABASE_POOL_MODE = os.getenv("DATABASE_POOL_MODE", "auto")
+# Connections each engine keeps open behind PgBouncer; 0 opens one per checkout (NullPool)
+PGBOUNCER_POOL_SIZE = int(os.getenv("PGBOUNCER_POOL_SIZE", "0"))
+
+def uses_transaction_pooler(database_url: str) -> bool:
+    """Whether connections go through a transaction-mode pooler such as PgBouncer"""
+    if DATABASE_POOL_MODE in ("pgbouncer", "direct"):
+        return DATABASE_POOL_MODE == "pgbouncer"
+    url = make_url(database_url)
+    if url.get_backend_name() != "postgresql":
+        return False
+    return url.port == 6543 or "pooler" in (url.host or "")
+
+def get_engine_options(database_url: str, is_async: bool = False) -> dict:
+    """Engine keyword arguments for the configured connection profile"""
+    if not database_url.startswith("postgresql"):
+        # SQLite configuration for local development
+        if is_async or "sqlite" not in database_url:
+            return {}
+        return {"connect_args": {"check_same_thread": False}}
+
+    if not uses_transaction_pooler(database_url):
+        # Supabase/PostgreSQL direct connection with client-side pooling
+        return {
+            "pool_pre_ping": True,
+            "pool_recycle": 300,
+            "pool_size": 10,
+            "max_overflow": 20
+        }
+
+    # PgBouncer already pools server connections, so don't stack a large pool on top
+    if PGBOUNCER_POOL_SIZE > 0:
+        options = {"pool_size": PGBOUNCER_POOL_SIZE, "max_overflow": 0, "pool_recycle": 300}
+    else:
+        options = {"poolclass": NullPool}
+
+    if is_async:
+        # Consecutive transactions may land on different server connections, so
+        # asyncpg must not cache prepared statements or reuse their names
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__"
+        }
+    return options
 
-# Configure engine with proper settings for Supabase
-if DATABASE_URL.startswith("postgresql"):
-    # Supabase/PostgreSQL configuration
-    engine = create_engine(
-        DATABASE_URL,
-        pool_pre_ping=True,
-        pool_recycle=300,
-        pool_size=10,
-        max_overflow=20
-    )
-else:
-    # SQLite configuration for local development
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-    )
+def get_database_profile() -> dict:
+    """Connection profile and pool state, for the health endpoint"""
+    if not DATABASE_URL.startswith("postgresql"):
+        mode = "sqlite"
+    elif uses_transaction_pooler(DATABASE_URL):
+        mode = "pgbouncer"
+    else:
+        mode = "direct"
+    return {
+        "mode": mode,
+        "pool": engine.pool.status(),
+        "async_pool": async_engine.pool.status()
+    }
+
+engine = create_engine(DATABASE_URL, **get_engine_options(DATABASE_URL))
+
+# Async engine for request paths that must not block the event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **get_engine_options(DATABASE_URL, is_async=True))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 Base = declarative_base()
 
+# Sessions check out a connection only when their first query runs, so acquire latency
+# (pool or pooler wait plus connect) is timed from that query to the transaction starting
+@event.listens_for(Session, "do_orm_execute")
+def _start_acquire_timer(orm_execute_state):
+    session = orm_execute_state.session
+    if not session.in_transaction():
+        session.info["acquire_started"] = time.perf_counter()
+
+@event.listens_for(Session, "after_begin")
+def _record_acquire_time(session, transaction, connection):
+    started = session.info.pop("acquire_started", None)
+    if started is not None:
+        kind = "async" if connection.engine is async_engine.sync_engine else "sync"
+        get_latency_recorder(f"db.acquire.{kind}").record(time.perf_counter() - started)
+
 def get_db():
     """Dependency to get database session"""
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """Dependency to get an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
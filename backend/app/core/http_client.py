@@ -0,0 +1,100 @@
+import os
+from typing import Dict, Any
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Connection pool limits shared by every provider client
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30.0"))
+POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "10.0"))
+
+# One long-lived client per provider
+_clients: Dict[str, httpx.AsyncClient] = {}
+_request_counts: Dict[str, int] = {}
+
+
+def _build_client(provider: str, provider_config: Dict[str, Any]) -> httpx.AsyncClient:
+    """Create a pooled client using the provider's timeouts and protocol settings"""
+    timeout = httpx.Timeout(
+        provider_config.get("read_timeout", 300.0),
+        connect=provider_config.get("connect_timeout", 10.0),
+        pool=POOL_TIMEOUT
+    )
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+    async def count_request(request: httpx.Request):
+        _request_counts[provider] = _request_counts.get(provider, 0) + 1
+
+    return httpx.AsyncClient(
+        timeout=timeout,
+        limits=limits,
+        http2=bool(provider_config.get("http2")) and HTTP2_AVAILABLE,
+        event_hooks={"request": [count_request]}
+    )
+
+
+def get_upstream_client(provider: str, provider_config: Dict[str, Any]) -> httpx.AsyncClient:
+    """Get the shared client for a provider, creating it on first use"""
+    client = _clients.get(provider)
+    if client is None or client.is_closed:
+        client = _build_client(provider, provider_config)
+        _clients[provider] = client
+    return client
+
+
+def open_upstream_clients(provider_configs: Dict[str, Dict[str, Any]]):
+    """Create clients for all configured providers (called on app startup)"""
+    for provider, provider_config in provider_configs.items():
+        get_upstream_client(provider, provider_config)
+
+
+async def close_upstream_clients():
+    """Close all provider clients and their pooled connections (called on app shutdown)"""
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Get connection pool usage for each provider client"""
+    stats = {}
+
+    for provider, client in _clients.items():
+        # httpx does not expose pool state publicly, so read it defensively
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", None) or [])
+        pending = list(getattr(pool, "_requests", None) or [])
+
+        idle_connections = sum(1 for connection in connections if connection.is_idle())
+        http2_connections = sum(
+            1 for connection in connections
+            if "HTTP/2" in connection.info()
+        )
+
+        stats[provider] = {
+            "is_closed": client.is_closed,
+            "max_connections": MAX_CONNECTIONS,
+            "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+            "open_connections": len(connections),
+            "active_connections": len(connections) - idle_connections,
+            "idle_connections": idle_connections,
+            "http2_connections": http2_connections,
+            "queued_requests": sum(1 for request in pending if request.is_queued()),
+            "total_requests": _request_counts.get(provider, 0)
+        }
+
+    return stats
@@ -0,0 +1,94 @@
+import time
+from collections import deque
+from typing import Dict, Any
+
+# Samples kept per recorder; percentiles describe this recent window
+LATENCY_WINDOW_SIZE = 1024
+
+
+class LatencyRecorder:
+    """Rolling window of latency samples with count and percentile summaries"""
+
+    def __init__(self, window_size: int = LATENCY_WINDOW_SIZE):
+        self._samples = deque(maxlen=window_size)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def record(self, seconds: float):
+        ms = seconds * 1000
+        self._samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+
+    def time(self) -> "_Timer":
+        """Context manager that records the time spent inside it"""
+        return _Timer(self)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self._samples)
+        if not ordered:
+            return {"count": self.count, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+        def at(fraction: float) -> float:
+            return round(ordered[min(int(fraction * len(ordered)), len(ordered) - 1)], 3)
+
+        return {
+            "count": self.count,
+            "p50_ms": at(0.50),
+            "p95_ms": at(0.95),
+            "p99_ms": at(0.99),
+            "max_ms": round(ordered[-1], 3)
+        }
+
+
+class _Timer:
+    def __init__(self, recorder: LatencyRecorder):
+        self.recorder = recorder
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(time.perf_counter() - self.start)
+        return False
+
+
+_latency_recorders: Dict[str, LatencyRecorder] = {}
+
+
+def get_latency_recorder(name: str) -> LatencyRecorder:
+    """Get the process-wide recorder for a metric name, creating it on first use"""
+    recorder = _latency_recorders.get(name)
+    if recorder is None:
+        recorder = _latency_recorders[name] = LatencyRecorder()
+    return recorder
+
+
+def get_latency_snapshots(prefix: str = "") -> Dict[str, Dict[str, Any]]:
+    """Snapshots of every recorder whose name starts with prefix"""
+    return {
+        name: recorder.snapshot()
+        for name, recorder in sorted(_latency_recorders.items())
+        if name.startswith(prefix)
+    }
+
+
+_counters: Dict[str, int] = {}
+_gauges: Dict[str, float] = {}
+
+
+def increment_counter(name: str, amount: int = 1):
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name: str, value: float):
+    _gauges[name] = value
+
+
+def get_metric_values(prefix: str = "") -> Dict[str, Dict[str, float]]:
+    """Current counters and gauges whose names start with prefix"""
+    return {
+        "counters": {name: value for name, value in sorted(_counters.items()) if name.startswith(prefix)},
+        "gauges": {name: value for name, value in sorted(_gauges.items()) if name.startswith(prefix)}
+    }
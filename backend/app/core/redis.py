@@ -0,0 +1,50 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Redis is optional; without REDIS_URL every feature falls back to process-local state
+try:
+    import redis.asyncio as redis_asyncio
+    from redis.exceptions import RedisError
+except ImportError:
+    redis_asyncio = None
+    RedisError = OSError
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.25"))
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "modev")
+
+_redis_client = None
+
+
+def get_redis_client():
+    """Get the shared async Redis client, or None when Redis is not configured"""
+    global _redis_client
+    if _redis_client is None and REDIS_URL and redis_asyncio is not None:
+        _redis_client = redis_asyncio.from_url(
+            REDIS_URL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            decode_responses=True
+        )
+    return _redis_client
+
+
+def set_redis_client(client):
+    """Use a specific client, e.g. a local test server or fakeredis.aioredis.FakeRedis"""
+    global _redis_client
+    _redis_client = client
+
+
+def redis_key(*parts) -> str:
+    """Build a namespaced Redis key"""
+    return ":".join([REDIS_KEY_PREFIX, *(str(part) for part in parts)])
+
+
+async def close_redis_client():
+    """Close the shared client's connections (called on app shutdown)"""
+    global _redis_client
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
@@ -0,0 +1,63 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Requested lifetimes are rounded up to a multiple of this, so nearby expires_in values share a URL
+SIGNED_URL_EXPIRY_STEP = int(os.getenv("STORAGE_SIGNED_URL_EXPIRY_STEP", "300"))
+# A cached URL is re-signed once it has less than this many seconds left
+SIGNED_URL_REFRESH_MARGIN = int(os.getenv("STORAGE_SIGNED_URL_REFRESH_MARGIN", "60"))
+SIGNED_URL_CACHE_SIZE = int(os.getenv("STORAGE_SIGNED_URL_CACHE_SIZE", "10000"))
+
+
+def expiry_bucket(expires_in: int) -> int:
+    """The lifetime a URL is actually signed for: expires_in rounded up to SIGNED_URL_EXPIRY_STEP"""
+    return max(SIGNED_URL_EXPIRY_STEP, math.ceil(expires_in / SIGNED_URL_EXPIRY_STEP) * SIGNED_URL_EXPIRY_STEP)
+
+
+class SignedURLCache:
+    """Size-bounded cache of signed URLs per (bucket, path, expiry bucket)"""
+
+    def __init__(self, max_size: int = SIGNED_URL_CACHE_SIZE):
+        self.max_size = max_size
+        # (bucket, path, expiry bucket) -> (expires_at, url), least recently used first
+        self._entries: "OrderedDict[Tuple[str, str, int], Tuple[float, str]]" = OrderedDict()
+
+    def get(self, bucket: str, path: str, expires_in: int) -> Optional[Tuple[str, int]]:
+        """A cached URL and its remaining lifetime in seconds, unless it is about to expire"""
+        key = (bucket, path, expiry_bucket(expires_in))
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        remaining = int(entry[0] - time.time())
+        if remaining <= SIGNED_URL_REFRESH_MARGIN:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1], remaining
+
+    def put(self, bucket: str, path: str, expires_in: int, url: str, signed_at: float):
+        key = (bucket, path, expiry_bucket(expires_in))
+        self._entries.pop(key, None)
+        self._entries[key] = (signed_at + key[2], url)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, bucket: str, path: str):
+        """Forget every URL for a path (after it is deleted or moved)"""
+        for key in [key for key in self._entries if key[0] == bucket and key[1] == path]:
+            del self._entries[key]
+
+
+# Global instance - lazy initialization
+_signed_url_cache = None
+
+def get_signed_url_cache() -> SignedURLCache:
+    global _signed_url_cache
+    if _signed_url_cache is None:
+        _signed_url_cache = SignedURLCache()
+    return _signed_url_cache
@@ -0,0 +1,158 @@
+import base64
+import os
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import quote, urljoin
+import httpx
+from fastapi import HTTPException, status, UploadFile
+from dotenv import load_dotenv
+
+from .database import get_supabase_config
+
+load_dotenv()
+
+# Largest object accepted by the upload endpoints, checked as bytes arrive
+STORAGE_MAX_UPLOAD_BYTES = int(os.getenv("STORAGE_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+STORAGE_MAX_AVATAR_BYTES = int(os.getenv("STORAGE_MAX_AVATAR_BYTES", str(5 * 1024 * 1024)))
+# Supabase's resumable endpoint requires 6 MB chunks (only the last may be shorter); objects
+# that fit in one chunk go through a single plain upload instead
+UPLOAD_CHUNK_SIZE = 6 * 1024 * 1024
+# Concurrent relocations run by a batch move/copy
+STORAGE_BATCH_CONCURRENCY = int(os.getenv("STORAGE_BATCH_CONCURRENCY", "8"))
+# Times a failed chunk is resumed from the server's offset before the upload is abandoned
+UPLOAD_CHUNK_RETRIES = int(os.getenv("STORAGE_UPLOAD_CHUNK_RETRIES", "3"))
+UPLOAD_TIMEOUT = float(os.getenv("STORAGE_UPLOAD_TIMEOUT", "60"))
+
+TUS_VERSION = "1.0.0"
+
+
+def storage_headers() -> Dict[str, str]:
+    """Auth headers for direct Storage API calls, using the same key as the SDK client"""
+    config = get_supabase_config()
+    return {"apikey": config["anon_key"], "Authorization": f"Bearer {config['anon_key']}"}
+
+
+def storage_api_url() -> str:
+    return f"{get_supabase_config()['url']}/storage/v1"
+
+
+def storage_object_url(bucket: str, file_path: str) -> str:
+    return f"{storage_api_url()}/object/{bucket}/{quote(file_path)}"
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Read an UploadFile's spool in fixed-size pieces instead of all at once"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def iter_upload_chunks(
+    chunks: AsyncIterator[bytes],
+    max_bytes: int,
+    size: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """Re-slice a byte stream into UPLOAD_CHUNK_SIZE chunks, rejecting it once it passes max_bytes"""
+    if size is not None and size > max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the {max_bytes} byte upload limit"
+        )
+
+    received = 0
+    buffer = bytearray()
+    async for piece in chunks:
+        received += len(piece)
+        if received > max_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File exceeds the {max_bytes} byte upload limit"
+            )
+        buffer.extend(piece)
+        while len(buffer) >= UPLOAD_CHUNK_SIZE:
+            yield bytes(buffer[:UPLOAD_CHUNK_SIZE])
+            del buffer[:UPLOAD_CHUNK_SIZE]
+
+    if size is not None and received != size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Upload ended after {received} of {size} bytes"
+        )
+    if buffer or received == 0:
+        yield bytes(buffer)
+
+
+class ResumableUpload:
+    """One object uploaded over Supabase Storage's TUS endpoint, chunk by chunk.
+
+    A chunk that fails mid-flight is resumed from the offset the server reports, so a
+    dropped connection only re-sends the unacknowledged tail of that chunk.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, bucket: str, file_path: str, content_type: str, size: int):
+        self.client = client
+        self.endpoint = f"{storage_api_url()}/upload/resumable"
+        self.headers = {**storage_headers(), "Tus-Resumable": TUS_VERSION}
+        self.bucket = bucket
+        self.file_path = file_path
+        self.content_type = content_type
+        self.size = size
+        self.offset = 0
+        self.url: Optional[str] = None
+
+    async def create(self):
+        metadata = {
+            "bucketName": self.bucket,
+            "objectName": self.file_path,
+            "contentType": self.content_type
+        }
+        response = await self.client.post(self.endpoint, headers={
+            **self.headers,
+            "Upload-Length": str(self.size),
+            "Upload-Metadata": ",".join(
+                f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in metadata.items()
+            ),
+            "x-upsert": "false"
+        })
+        response.raise_for_status()
+        self.url = urljoin(self.endpoint, response.headers["Location"])
+
+    async def send(self, chunk: bytes):
+        """Append a chunk, resuming from the server's offset if the request fails"""
+        chunk_start = self.offset
+        for attempt in range(UPLOAD_CHUNK_RETRIES + 1):
+            try:
+                response = await self.client.patch(
+                    self.url,
+                    content=chunk[self.offset - chunk_start:],
+                    headers={
+                        **self.headers,
+                        "Upload-Offset": str(self.offset),
+                        "Content-Type": "application/offset+octet-stream"
+                    }
+                )
+                response.raise_for_status()
+                self.offset = int(response.headers["Upload-Offset"])
+                return
+            except httpx.HTTPError:
+                if attempt == UPLOAD_CHUNK_RETRIES:
+                    raise
+                self.offset = await self._server_offset()
+                if self.offset >= chunk_start + len(chunk):
+                    return
+
+    async def abort(self):
+        """Tell the server to discard the partial upload"""
+        if self.url is None:
+            return
+        try:
+            await self.client.delete(self.url, headers=self.headers)
+        except httpx.HTTPError as e:
+            print(f"Warning: Failed to abort resumable upload {self.file_path}: {e}")
+
+    async def _server_offset(self) -> int:
+        response = await self.client.head(self.url, headers=self.headers)
+        response.raise_for_status()
+        return int(response.headers["Upload-Offset"])
+
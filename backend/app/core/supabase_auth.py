@@ -1,25 +1,177 @@
 import os
+import time
+from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
+import httpx
 from fastapi import HTTPException, status
+from jose import JWTError, jwt
 from supabase import Client
+from sqlalchemy import select
+from dotenv import load_dotenv
 from .supabase import get_supabase_auth_client, get_supabase_admin_client
-from .database import get_db
+from .supabase_executor import run_supabase_call
+from .database import get_db, get_supabase_config, AsyncSessionLocal
+from .auth import Principal, get_cached_principal, cache_principal
 from sqlalchemy.orm import Session
 from ..models.user import User
 import uuid
 
+load_dotenv()
+
+# Project JWT secret (Settings > API > JWT Secret) for HS256-signed access tokens
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+# Signing keys for asymmetric (RS256/ES256) access tokens
+SUPABASE_JWKS_URL = os.getenv(
+    "SUPABASE_JWKS_URL", f"{get_supabase_config()['url']}/auth/v1/.well-known/jwks.json"
+)
+SUPABASE_JWKS_CACHE_TTL = float(os.getenv("SUPABASE_JWKS_CACHE_TTL", "600"))
+# An unknown kid forces a refetch (key rotation), but no more often than this
+SUPABASE_JWKS_MIN_REFRESH_SECONDS = float(os.getenv("SUPABASE_JWKS_MIN_REFRESH_SECONDS", "30"))
+# Offline mode verifies with SUPABASE_JWT_SECRET only and never calls Supabase to check tokens
+SUPABASE_AUTH_OFFLINE = os.getenv("SUPABASE_AUTH_OFFLINE", "false").lower() == "true"
+
+HMAC_ALGORITHMS = ["HS256"]
+ASYMMETRIC_ALGORITHMS = ["RS256", "ES256"]
+
+
+def check_jwt_config():
+    """Called on startup; offline mode has nothing to check HS256 tokens against without the secret"""
+    if SUPABASE_JWT_SECRET:
+        return
+    if SUPABASE_AUTH_OFFLINE:
+        raise RuntimeError("SUPABASE_AUTH_OFFLINE requires SUPABASE_JWT_SECRET")
+    print("Warning: SUPABASE_JWT_SECRET is not set; HS256 access tokens are checked with Supabase Auth")
+
+
+class SupabaseJWTVerifier:
+    """Verifies Supabase access tokens locally against the project secret or the cached JWKS"""
+
+    def __init__(
+        self,
+        jwt_secret: Optional[str] = SUPABASE_JWT_SECRET,
+        jwks_url: Optional[str] = SUPABASE_JWKS_URL,
+        offline: bool = SUPABASE_AUTH_OFFLINE
+    ):
+        self.jwt_secret = jwt_secret
+        self.offline = offline
+        self.jwks_url = None if offline else jwks_url
+        self.issuer = f"{get_supabase_config()['url']}/auth/v1"
+        # kid -> JWK
+        self._keys: Dict[str, Dict[str, Any]] = {}
+        self._keys_fetched_at = 0.0
+    
+    def needs_remote_check(self, token: str) -> bool:
+        """HS256 tokens can't be verified locally without the secret; online, Supabase Auth checks them"""
+        if self.jwt_secret is not None or self.offline:
+            return False
+        try:
+            return jwt.get_unverified_header(token).get("alg") in HMAC_ALGORITHMS
+        except JWTError:
+            return False
+    
+    async def verify(self, token: str) -> Optional[Dict[str, Any]]:
+        """Return the token's claims if its signature, expiry, audience and issuer check out"""
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError:
+            return None
+        
+        algorithm = header.get("alg")
+        if algorithm in HMAC_ALGORITHMS:
+            key = self.jwt_secret
+        elif algorithm in ASYMMETRIC_ALGORITHMS:
+            key = await self._get_signing_key(header.get("kid"))
+        else:
+            return None
+        if key is None:
+            return None
+        
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[algorithm],
+                audience=SUPABASE_JWT_AUDIENCE,
+                issuer=self.issuer
+            )
+        except JWTError:
+            return None
+        if claims.get("sub") is None:
+            return None
+        return claims
+    
+    async def _get_signing_key(self, kid: Optional[str]) -> Optional[Dict[str, Any]]:
+        if self.jwks_url is None or kid is None:
+            return None
+        
+        age = time.monotonic() - self._keys_fetched_at
+        if age >= SUPABASE_JWKS_CACHE_TTL or (kid not in self._keys and age >= SUPABASE_JWKS_MIN_REFRESH_SECONDS):
+            await self._refresh_keys()
+        return self._keys.get(kid)
+    
+    async def _refresh_keys(self):
+        # Stamp first so a failing endpoint is retried at most every SUPABASE_JWKS_MIN_REFRESH_SECONDS
+        self._keys_fetched_at = time.monotonic()
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                response = await client.get(self.jwks_url)
+                response.raise_for_status()
+            # Replace the whole set so keys rotated out stop verifying
+            self._keys = {key["kid"]: key for key in response.json().get("keys", []) if key.get("kid")}
+        except Exception as e:
+            # Keep the previous keys; tokens they signed stay valid until the next refresh
+            print(f"Warning: Failed to refresh Supabase JWKS: {e}")
+
+
+def mint_access_token(
+    user_id: str,
+    email: str,
+    expires_delta: timedelta = timedelta(hours=1),
+    jwt_secret: Optional[str] = None
+) -> str:
+    """Sign a Supabase-shaped access token with the project secret (offline mode and local testing)"""
+    secret = jwt_secret or SUPABASE_JWT_SECRET
+    if not secret:
+        raise ValueError("SUPABASE_JWT_SECRET is required to mint access tokens")
+    now = datetime.utcnow()
+    return jwt.encode({
+        "sub": str(user_id),
+        "email": email,
+        "aud": SUPABASE_JWT_AUDIENCE,
+        "role": "authenticated",
+        "iss": f"{get_supabase_config()['url']}/auth/v1",
+        "iat": now,
+        "exp": now + expires_delta
+    }, secret, algorithm="HS256")
+
+
 class SupabaseAuthService:
     """Service for handling Supabase authentication"""
     
     def __init__(self):
-        self.auth_client = get_supabase_auth_client()
-        self.admin_client = get_supabase_admin_client()
+        self._auth_client = None
+        self._admin_client = None
+        self.verifier = SupabaseJWTVerifier()
+    
+    @property
+    def auth_client(self) -> Client:
+        # Created on first use so token verification works without Supabase credentials
+        if self._auth_client is None:
+            self._auth_client = get_supabase_auth_client()
+        return self._auth_client
+    
+    @property
+    def admin_client(self) -> Client:
+        if self._admin_client is None:
+            self._admin_client = get_supabase_admin_client()
+        return self._admin_client
     
     async def sign_up(self, email: str, password: str, full_name: str = None) -> Dict[str, Any]:
         """Sign up a new user with Supabase Auth"""
         try:
             # Create user in Supabase Auth
-            auth_response = self.auth_client.auth.sign_up({
+            auth_response = await run_supabase_call("auth.sign_up", self.auth_client.auth.sign_up, {
                 "email": email,
                 "password": password,
                 "options": {
@@ -56,7 +208,11 @@ class SupabaseAuthService:
                     db.rollback()
                     # Delete the auth user if database creation fails
                     if auth_response.user:
-                        self.admin_client.auth.admin.delete_user(auth_response.user.id)
+                        await run_supabase_call(
+                            "auth.admin.delete_user",
+                            self.admin_client.auth.admin.delete_user,
+                            auth_response.user.id
+                        )
                     raise HTTPException(
                         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                         detail=f"Failed to create user record: {str(e)}"
@@ -83,10 +239,11 @@ class SupabaseAuthService:
     async def sign_in(self, email: str, password: str) -> Dict[str, Any]:
         """Sign in user with Supabase Auth"""
         try:
-            auth_response = self.auth_client.auth.sign_in_with_password({
-                "email": email,
-                "password": password
-            })
+            auth_response = await run_supabase_call(
+                "auth.sign_in_with_password",
+                self.auth_client.auth.sign_in_with_password,
+                {"email": email, "password": password}
+            )
             
             if auth_response.user and auth_response.session:
                 # Get user from our database
@@ -127,7 +284,7 @@ class SupabaseAuthService:
     async def sign_out(self, access_token: str) -> Dict[str, str]:
         """Sign out user"""
         try:
-            self.auth_client.auth.sign_out()
+            await run_supabase_call("auth.sign_out", self.auth_client.auth.sign_out)
             return {"message": "Successfully signed out"}
         except Exception as e:
             raise HTTPException(
@@ -135,32 +292,64 @@ class SupabaseAuthService:
                 detail=f"Sign out error: {str(e)}"
             )
     
-    async def get_user_by_token(self, access_token: str) -> Optional[User]:
-        """Get user from access token"""
+    async def _get_user_for_claims(self, claims: Dict[str, Any]) -> Optional[User]:
         try:
-            # Set the session with the access token
-            self.auth_client.auth.set_session(access_token, None)
-            
-            # Get the current user
-            user_response = self.auth_client.auth.get_user()
-            
-            if user_response.user:
-                # Get user from our database
-                db = next(get_db())
-                try:
-                    user = db.query(User).filter(User.id == uuid.UUID(user_response.user.id)).first()
-                    return user
-                finally:
-                    db.close()
+            user_id = uuid.UUID(claims["sub"])
+        except ValueError:
             return None
-            
-        except Exception as e:
+        
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(User).where(User.id == user_id))
+            return result.scalars().first()
+    
+    async def _get_claims(self, access_token: str) -> Optional[Dict[str, Any]]:
+        if not self.verifier.needs_remote_check(access_token):
+            return await self.verifier.verify(access_token)
+        
+        try:
+            user_response = await run_supabase_call(
+                "auth.get_user", self.auth_client.auth.get_user, access_token
+            )
+        except Exception:
+            return None
+        if not user_response or not user_response.user:
             return None
+        # Supabase Auth vouched for the token, so its exp can be trusted for caching
+        return {"sub": user_response.user.id, "exp": jwt.get_unverified_claims(access_token).get("exp")}
+    
+    async def get_user_by_token(self, access_token: str) -> Optional[User]:
+        """Get user from access token, verified locally where possible"""
+        claims = await self._get_claims(access_token)
+        if claims is None:
+            return None
+        return await self._get_user_for_claims(claims)
+    
+    async def get_principal_by_token(self, access_token: str) -> Optional[Principal]:
+        """Get the principal for an access token, reading users only when the token isn't cached"""
+        principal = get_cached_principal(access_token)
+        if principal is not None:
+            return principal
+        
+        claims = await self._get_claims(access_token)
+        if claims is None:
+            return None
+        
+        user = await self._get_user_for_claims(claims)
+        if user is None:
+            return None
+        
+        principal = Principal.from_user(user)
+        cache_principal(access_token, principal, claims.get("exp"))
+        return principal
     
     async def refresh_token(self, refresh_token: str) -> Dict[str, Any]:
         """Refresh access token"""
         try:
-            auth_response = self.auth_client.auth.refresh_session(refresh_token)
+            auth_response = await run_supabase_call(
+                "auth.refresh_session",
+                self.auth_client.auth.refresh_session,
+                refresh_token
+            )
             
             if auth_response.session:
                 return {
@@ -182,7 +371,7 @@ class SupabaseAuthService:
     async def reset_password(self, email: str) -> Dict[str, str]:
         """Send password reset email"""
         try:
-            self.auth_client.auth.reset_password_email(email)
+            await run_supabase_call("auth.reset_password_email", self.auth_client.auth.reset_password_email, email)
             return {"message": "Password reset email sent"}
         except Exception as e:
             raise HTTPException(
@@ -194,7 +383,9 @@ class SupabaseAuthService:
         """Update user profile"""
         try:
             # Update in Supabase Auth
-            self.admin_client.auth.admin.update_user_by_id(
+            await run_supabase_call(
+                "auth.admin.update_user_by_id",
+                self.admin_client.auth.admin.update_user_by_id,
                 user_id,
                 {"user_metadata": updates}
             )
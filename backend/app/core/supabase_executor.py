@@ -0,0 +1,74 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+
+from app.core.metrics import get_latency_recorder, get_latency_snapshots
+
+load_dotenv()
+
+# Threads running blocking supabase-py calls; the event loop never waits on Supabase itself
+SUPABASE_EXECUTOR_WORKERS = int(os.getenv("SUPABASE_EXECUTOR_WORKERS", "16"))
+# In-flight calls allowed per operation, so one slow operation can't take every thread
+SUPABASE_OPERATION_CONCURRENCY = int(os.getenv("SUPABASE_OPERATION_CONCURRENCY", "8"))
+# Uploads and downloads hold a thread for the whole transfer
+SUPABASE_TRANSFER_CONCURRENCY = int(os.getenv("SUPABASE_TRANSFER_CONCURRENCY", "4"))
+
+TRANSFER_OPERATIONS = {"storage.upload", "storage.download"}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+_in_flight: Dict[str, int] = {}
+
+
+def get_supabase_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=SUPABASE_EXECUTOR_WORKERS,
+            thread_name_prefix="supabase"
+        )
+    return _executor
+
+
+def _get_semaphore(operation: str) -> asyncio.Semaphore:
+    semaphore = _semaphores.get(operation)
+    if semaphore is None:
+        limit = SUPABASE_TRANSFER_CONCURRENCY if operation in TRANSFER_OPERATIONS else SUPABASE_OPERATION_CONCURRENCY
+        semaphore = _semaphores[operation] = asyncio.Semaphore(limit)
+    return semaphore
+
+
+async def run_supabase_call(operation: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking supabase-py call on the executor, bounded and timed per operation.
+
+    Usage: await run_supabase_call("storage.list", bucket.list, folder_path)
+    """
+    async with _get_semaphore(operation):
+        _in_flight[operation] = _in_flight.get(operation, 0) + 1
+        try:
+            with get_latency_recorder(f"supabase.{operation}").time():
+                return await asyncio.get_running_loop().run_in_executor(
+                    get_supabase_executor(), partial(func, *args, **kwargs)
+                )
+        finally:
+            _in_flight[operation] -= 1
+
+
+def get_supabase_call_stats() -> Dict[str, Any]:
+    """Latency and in-flight calls per Supabase operation"""
+    return {
+        "workers": SUPABASE_EXECUTOR_WORKERS,
+        "in_flight": {operation: count for operation, count in sorted(_in_flight.items()) if count},
+        "latency": get_latency_snapshots("supabase.")
+    }
+
+
+def shutdown_supabase_executor():
+    """Stop the executor threads (called on app shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -1,8 +1,17 @@
+import asyncio
 import os
-from typing import Optional, List, Dict, Any
+import time
+from typing import Optional, List, Dict, Any, AsyncIterator
+import httpx
 from fastapi import HTTPException, status, UploadFile
 from supabase import Client
 from .supabase import get_supabase_client, get_supabase_admin_client
+from .supabase_executor import run_supabase_call
+from .signed_url_cache import get_signed_url_cache, expiry_bucket
+from .storage_uploads import (
+    STORAGE_MAX_UPLOAD_BYTES, STORAGE_MAX_AVATAR_BYTES, STORAGE_BATCH_CONCURRENCY, UPLOAD_CHUNK_SIZE,
+    UPLOAD_TIMEOUT, ResumableUpload, iter_upload_file, iter_upload_chunks, storage_api_url, storage_headers, storage_object_url
+)
 import uuid
 from datetime import datetime
 
@@ -17,7 +26,9 @@ class SupabaseStorageService:
     async def create_bucket(self, bucket_name: str, public: bool = False) -> Dict[str, Any]:
         """Create a new storage bucket"""
         try:
-            response = self.admin_client.storage.create_bucket(
+            response = await run_supabase_call(
+                "storage.create_bucket",
+                self.admin_client.storage.create_bucket,
                 bucket_name,
                 {"public": public}
             )
@@ -33,14 +44,38 @@ class SupabaseStorageService:
         file: UploadFile, 
         bucket_name: str = None,
         folder_path: str = "",
-        user_id: str = None
+        user_id: str = None,
+        max_bytes: int = STORAGE_MAX_UPLOAD_BYTES
     ) -> Dict[str, Any]:
         """Upload a file to Supabase Storage"""
+        return await self.upload_stream(
+            iter_upload_file(file),
+            file_name=file.filename,
+            content_type=file.content_type,
+            size=file.size,
+            bucket_name=bucket_name,
+            folder_path=folder_path,
+            user_id=user_id,
+            max_bytes=max_bytes
+        )
+    
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        file_name: Optional[str],
+        content_type: str,
+        size: Optional[int] = None,
+        bucket_name: str = None,
+        folder_path: str = "",
+        user_id: str = None,
+        max_bytes: int = STORAGE_MAX_UPLOAD_BYTES
+    ) -> Dict[str, Any]:
+        """Upload a byte stream to Supabase Storage without holding more than one chunk in memory"""
         try:
             bucket = bucket_name or self.default_bucket
             
             # Generate unique filename
-            file_extension = os.path.splitext(file.filename)[1] if file.filename else ""
+            file_extension = os.path.splitext(file_name)[1] if file_name else ""
             unique_filename = f"{uuid.uuid4()}{file_extension}"
             
             # Create file path
@@ -50,10 +85,12 @@ class SupabaseStorageService:
                 file_path = f"{folder_path}/{unique_filename}".lstrip("/")
             
             # Upload file
-            response = self.client.storage.from_(bucket).upload(
+            uploaded = await self._upload_chunks(
+                iter_upload_chunks(chunks, max_bytes, size),
+                bucket,
                 file_path,
-                file.file.read(),
-                {"content-type": file.content_type}
+                content_type,
+                size
             )
             
             # Get public URL
@@ -62,23 +99,67 @@ class SupabaseStorageService:
             return {
                 "file_path": file_path,
                 "public_url": public_url,
-                "file_name": file.filename,
-                "content_type": file.content_type,
-                "size": file.size,
+                "file_name": file_name,
+                "content_type": content_type,
+                "size": uploaded,
                 "uploaded_at": datetime.utcnow().isoformat()
             }
             
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to upload file: {str(e)}"
             )
     
+    async def _upload_chunks(
+        self,
+        chunks: AsyncIterator[bytes],
+        bucket: str,
+        file_path: str,
+        content_type: str,
+        size: Optional[int]
+    ) -> int:
+        """Send one plain upload for single-chunk objects, a resumable upload otherwise"""
+        if size is None or size <= UPLOAD_CHUNK_SIZE:
+            body = None
+            async for chunk in chunks:
+                if body is not None:
+                    raise HTTPException(
+                        status_code=status.HTTP_411_LENGTH_REQUIRED,
+                        detail=f"Content-Length is required for uploads over {UPLOAD_CHUNK_SIZE} bytes"
+                    )
+                body = chunk
+            await run_supabase_call(
+                "storage.upload",
+                self.client.storage.from_(bucket).upload,
+                file_path,
+                body,
+                {"content-type": content_type}
+            )
+            return len(body)
+        
+        async with httpx.AsyncClient(timeout=UPLOAD_TIMEOUT) as client:
+            upload = ResumableUpload(client, bucket, file_path, content_type, size)
+            await upload.create()
+            try:
+                async for chunk in chunks:
+                    await upload.send(chunk)
+            except Exception:
+                await upload.abort()
+                raise
+        return upload.offset
+    
     async def download_file(self, file_path: str, bucket_name: str = None) -> bytes:
         """Download a file from Supabase Storage"""
         try:
             bucket = bucket_name or self.default_bucket
-            response = self.client.storage.from_(bucket).download(file_path)
+            response = await run_supabase_call(
+                "storage.download",
+                self.client.storage.from_(bucket).download,
+                file_path
+            )
             return response
         except Exception as e:
             raise HTTPException(
@@ -88,18 +169,78 @@ class SupabaseStorageService:
     
     async def get_file_url(self, file_path: str, bucket_name: str = None, expires_in: int = 3600) -> str:
         """Get a signed URL for file access"""
+        return (await self.get_signed_url(file_path, bucket_name, expires_in))["url"]
+    
+    async def get_signed_url(self, file_path: str, bucket_name: str = None, expires_in: int = 3600) -> Dict[str, Any]:
+        """Get a signed URL and its remaining lifetime, reusing a cached one until shortly before it expires"""
+        bucket = bucket_name or self.default_bucket
+        cached = get_signed_url_cache().get(bucket, file_path, expires_in)
+        if cached is not None:
+            return {"url": cached[0], "expires_in": cached[1]}
+        
         try:
-            bucket = bucket_name or self.default_bucket
-            response = self.client.storage.from_(bucket).create_signed_url(
+            signed_at = time.time()
+            response = await run_supabase_call(
+                "storage.create_signed_url",
+                self.client.storage.from_(bucket).create_signed_url,
                 file_path,
-                expires_in
+                expiry_bucket(expires_in)
             )
-            return response.signed_url
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to generate signed URL: {str(e)}"
             )
+        
+        get_signed_url_cache().put(bucket, file_path, expires_in, response["signedURL"], signed_at)
+        return {"url": response["signedURL"], "expires_in": expiry_bucket(expires_in)}
+    
+    async def get_signed_urls(
+        self,
+        file_paths: List[str],
+        bucket_name: str = None,
+        expires_in: int = 3600
+    ) -> List[Dict[str, Any]]:
+        """Sign many paths at once: cached URLs are reused and the rest are signed in one request"""
+        bucket = bucket_name or self.default_bucket
+        signed_url_cache = get_signed_url_cache()
+        
+        results: Dict[str, Dict[str, Any]] = {}
+        for file_path in file_paths:
+            cached = signed_url_cache.get(bucket, file_path, expires_in)
+            if cached is not None:
+                results[file_path] = {"path": file_path, "url": cached[0], "expires_in": cached[1]}
+        
+        missing = [file_path for file_path in dict.fromkeys(file_paths) if file_path not in results]
+        if missing:
+            # Called directly: storage3's create_signed_urls fails the whole batch when one path can't be signed
+            try:
+                signed_at = time.time()
+                async with httpx.AsyncClient(timeout=UPLOAD_TIMEOUT) as client:
+                    response = await client.post(
+                        f"{storage_api_url()}/object/sign/{bucket}",
+                        json={"paths": missing, "expiresIn": expiry_bucket(expires_in)},
+                        headers=storage_headers()
+                    )
+                    response.raise_for_status()
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to generate signed URLs: {str(e)}"
+                )
+            
+            for item in response.json():
+                if item.get("error") or not item.get("signedURL"):
+                    results[item["path"]] = {"path": item["path"], "url": None, "error": item.get("error")}
+                    continue
+                url = f"{storage_api_url()}{item['signedURL']}"
+                signed_url_cache.put(bucket, item["path"], expires_in, url, signed_at)
+                results[item["path"]] = {"path": item["path"], "url": url, "expires_in": expiry_bucket(expires_in)}
+        
+        return [
+            results.get(file_path, {"path": file_path, "url": None, "error": "Not signed"})
+            for file_path in file_paths
+        ]
     
     async def list_files(
         self, 
@@ -111,7 +252,9 @@ class SupabaseStorageService:
         """List files in a bucket or folder"""
         try:
             bucket = bucket_name or self.default_bucket
-            response = self.client.storage.from_(bucket).list(
+            response = await run_supabase_call(
+                "storage.list",
+                self.client.storage.from_(bucket).list,
                 folder_path,
                 {"limit": limit, "offset": offset}
             )
@@ -140,7 +283,12 @@ class SupabaseStorageService:
         """Delete a file from Supabase Storage"""
         try:
             bucket = bucket_name or self.default_bucket
-            response = self.client.storage.from_(bucket).remove([file_path])
+            response = await run_supabase_call(
+                "storage.remove",
+                self.client.storage.from_(bucket).remove,
+                [file_path]
+            )
+            get_signed_url_cache().invalidate(bucket, file_path)
             return {"message": f"File {file_path} deleted successfully"}
         except Exception as e:
             raise HTTPException(
@@ -152,37 +300,115 @@ class SupabaseStorageService:
         self, 
         from_path: str, 
         to_path: str, 
-        bucket_name: str = None
+        bucket_name: str = None,
+        destination_bucket: str = None
     ) -> Dict[str, str]:
-        """Move a file within the same bucket"""
+        """Move a file, server-side within a bucket or streamed across buckets"""
         try:
-            bucket = bucket_name or self.default_bucket
-            
-            # Download the file
-            file_content = await self.download_file(from_path, bucket)
-            
-            # Upload to new location
-            response = self.client.storage.from_(bucket).upload(
-                to_path,
-                file_content
-            )
-            
-            # Delete from old location
-            await self.delete_file(from_path, bucket)
-            
+            await self._relocate("move", from_path, to_path, bucket_name, destination_bucket)
             return {"message": f"File moved from {from_path} to {to_path}"}
-            
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to move file: {str(e)}"
             )
     
+    async def copy_file(
+        self,
+        from_path: str,
+        to_path: str,
+        bucket_name: str = None,
+        destination_bucket: str = None
+    ) -> Dict[str, str]:
+        """Copy a file, server-side within a bucket or streamed across buckets"""
+        try:
+            await self._relocate("copy", from_path, to_path, bucket_name, destination_bucket)
+            return {"message": f"File copied from {from_path} to {to_path}"}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to copy file: {str(e)}"
+            )
+    
+    async def relocate_files(
+        self,
+        operation: str,
+        files: List[Dict[str, str]],
+        bucket_name: str = None,
+        destination_bucket: str = None
+    ) -> List[Dict[str, Any]]:
+        """Move or copy many files concurrently, at most STORAGE_BATCH_CONCURRENCY at a time"""
+        semaphore = asyncio.Semaphore(STORAGE_BATCH_CONCURRENCY)
+        
+        async def relocate(item: Dict[str, str]) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    await self._relocate(operation, item["from_path"], item["to_path"], bucket_name, destination_bucket)
+                    return {**item, "success": True}
+                except Exception as e:
+                    # One failed path shouldn't fail the rest of the batch
+                    return {**item, "success": False, "error": str(e)}
+        
+        return await asyncio.gather(*(relocate(item) for item in files))
+    
+    async def _relocate(
+        self,
+        operation: str,
+        from_path: str,
+        to_path: str,
+        bucket_name: Optional[str],
+        destination_bucket: Optional[str]
+    ):
+        bucket = bucket_name or self.default_bucket
+        target_bucket = destination_bucket or bucket
+        
+        if target_bucket == bucket:
+            # The Storage API moves and copies inside a bucket without the bytes leaving the server
+            storage_bucket = self.client.storage.from_(bucket)
+            action = storage_bucket.move if operation == "move" else storage_bucket.copy
+            await run_supabase_call(f"storage.{operation}", action, from_path, to_path)
+        else:
+            await self._stream_copy(bucket, from_path, target_bucket, to_path)
+            if operation == "move":
+                await run_supabase_call("storage.remove", self.client.storage.from_(bucket).remove, [from_path])
+        
+        if operation == "move":
+            get_signed_url_cache().invalidate(bucket, from_path)
+    
+    async def _stream_copy(self, bucket: str, from_path: str, target_bucket: str, to_path: str):
+        """Pipe an object from one bucket into another a chunk at a time"""
+        async with httpx.AsyncClient(timeout=UPLOAD_TIMEOUT) as client:
+            async with client.stream("GET", storage_object_url(bucket, from_path), headers=storage_headers()) as response:
+                if response.status_code == 404:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail=f"File not found: {from_path}"
+                    )
+                response.raise_for_status()
+                
+                content_length = response.headers.get("content-length")
+                size = int(content_length) if content_length else None
+                await self._upload_chunks(
+                    iter_upload_chunks(response.aiter_bytes(), size or STORAGE_MAX_UPLOAD_BYTES, size),
+                    target_bucket,
+                    to_path,
+                    response.headers.get("content-type", "application/octet-stream"),
+                    size
+                )
+    
     async def get_bucket_info(self, bucket_name: str = None) -> Dict[str, Any]:
         """Get information about a bucket"""
         try:
             bucket = bucket_name or self.default_bucket
-            response = self.admin_client.storage.get_bucket(bucket)
+            response = await run_supabase_call(
+                "storage.get_bucket",
+                self.admin_client.storage.get_bucket,
+                bucket
+            )
             return {
                 "name": response.name,
                 "id": response.id,
@@ -215,7 +441,8 @@ class SupabaseStorageService:
                 file=file,
                 bucket_name="user-avatars",
                 folder_path="",
-                user_id=user_id
+                user_id=user_id,
+                max_bytes=STORAGE_MAX_AVATAR_BYTES
             )
             
             return result
@@ -0,0 +1,60 @@
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+
+from sqlalchemy import select
+
+from app.core.database import AsyncSessionLocal
+from app.core.http_client import open_upstream_clients, close_upstream_clients
+from app.core.redis import close_redis_client
+from app.core.supabase_auth import check_jwt_config
+from app.core.supabase_executor import shutdown_supabase_executor
+from app.models.usage import BudgetSetting
+from app.routers.proxy import PROVIDER_CONFIGS
+from app.services.usage_logger import get_usage_log_queue
+from app.services.spend_counters import get_spend_counters
+from app.services.usage_rollup import run_rollup_job
+from app.services.partition_manager import run_partition_job
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared resources on startup and release them on shutdown.
+
+    Usage: FastAPI(lifespan=lifespan)
+    """
+    check_jwt_config()
+    open_upstream_clients(PROVIDER_CONFIGS)
+    get_usage_log_queue().start()
+    try:
+        await rebuild_spend_counters()
+    except Exception as e:
+        # Counters still seed lazily on the first budget check
+        print(f"Warning: Failed to rebuild spend counters: {e}")
+    background_tasks = [
+        asyncio.create_task(run_rollup_job()),
+        asyncio.create_task(run_partition_job())
+    ]
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        # Drain buffered usage logs before anything they depend on goes away
+        try:
+            await get_usage_log_queue().drain()
+        except Exception as e:
+            print(f"Warning: Failed to drain usage logs on shutdown: {e}")
+        await close_upstream_clients()
+        await close_redis_client()
+        shutdown_supabase_executor()
+
+
+async def rebuild_spend_counters():
+    """Seed budget spend counters for users with an active budget"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(BudgetSetting.user_id).where(BudgetSetting.is_active == True).distinct()
+        )
+        user_ids = list(result.scalars().all())
+        await get_spend_counters().rebuild(db, user_ids)
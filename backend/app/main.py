@@ -1,6 +1,11 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+
+from app.lifespan import lifespan
+from app.routers import admin, analytics, auth, health, proxy, storage
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -18,4 +23,23 @@ class handler(BaseHTTPRequestHandler):
         }
         
         self.wfile.write(json.dumps(response).encode())
-        return 
\ No newline at end of file
+        return
+
+
+# The Vercel function serves `handler` above; uvicorn (app/server.py) serves this app
+app = FastAPI(title=os.getenv("APP_NAME", "Modev"), lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=json.loads(os.getenv("CORS_ORIGINS", '["http://localhost:5173"]')),
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"]
+)
+
+app.include_router(auth.router, prefix="/auth", tags=["auth"])
+app.include_router(admin.router, prefix="/admin", tags=["admin"])
+app.include_router(analytics.router, prefix="/analytics", tags=["analytics"])
+app.include_router(proxy.router, prefix="/proxy", tags=["proxy"])
+app.include_router(storage.router)
+app.include_router(health.router)
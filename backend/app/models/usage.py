@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, Float, JSON
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, Float, JSON, Index, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -8,6 +8,15 @@ import uuid
 
 class UsageLog(Base):
     __tablename__ = "usage_logs"
+    __table_args__ = (
+        # Almost every read filters by user and a created_at range; the INCLUDE columns
+        # let spend and analytics aggregates run as index-only scans on PostgreSQL
+        Index(
+            "ix_usage_logs_user_id_created_at",
+            "user_id", "created_at",
+            postgresql_include=["cost", "total_tokens", "provider", "model", "latency_ms"]
+        ),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -78,6 +87,10 @@ class BudgetSetting(Base):
 class DailyUsageSummary(Base):
     """Pre-aggregated daily usage for faster dashboard queries"""
     __tablename__ = "daily_usage_summaries"
+    __table_args__ = (
+        # One summary per user and day, so rollups can be upserted
+        UniqueConstraint("user_id", "date", name="uq_daily_usage_summaries_user_id_date"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -1,12 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
 from typing import List
 
-from app.core.database import get_db
-from app.core.auth import get_current_active_user, require_plan
+from app.core.database import get_db, get_async_db
+from app.core.auth import (
+    get_current_active_user, get_current_active_user_async, require_plan, invalidate_principal
+)
 from app.models.user import User
 from app.models.usage import BudgetSetting
 from app.models.pricing import ModelPricing
+from app.services.budget_checker import invalidate_budget_state, invalidate_spend
+from app.services.cost_calculator import CostCalculator, invalidate_pricing_cache, to_naive_utc
+from app.services.usage_rollup import get_usage_totals
 from app.schemas.usage import (
     BudgetSettingCreate, BudgetSettingUpdate, BudgetSetting as BudgetSettingSchema,
     ModelPricingCreate, ModelPricingUpdate, ModelPricing as ModelPricingSchema
@@ -51,6 +58,7 @@ async def create_budget_setting(
     db.add(budget_setting)
     db.commit()
     db.refresh(budget_setting)
+    await invalidate_budget_state(current_user.id)
     
     return budget_setting
 
@@ -93,6 +101,7 @@ async def update_budget_setting(
     
     db.commit()
     db.refresh(budget_setting)
+    await invalidate_budget_state(current_user.id)
     
     return budget_setting
 
@@ -115,6 +124,7 @@ async def delete_budget_setting(
     
     db.delete(budget_setting)
     db.commit()
+    await invalidate_budget_state(current_user.id)
     
     return {"message": "Budget setting deleted successfully"}
 
@@ -132,14 +142,20 @@ async def create_model_pricing(
     existing_pricing = db.query(ModelPricing).filter(
         ModelPricing.provider == pricing_data.provider,
         ModelPricing.model_name == pricing_data.model_name,
-        ModelPricing.is_active == True
-    ).first()
+        ModelPricing.is_active == True,
+        ModelPricing.deprecated_date.is_(None)
+    ).order_by(ModelPricing.effective_date.desc()).first()
     
     if existing_pricing:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Pricing for {pricing_data.provider}/{pricing_data.model_name} already exists"
-        )
+        # A later effective date adds a new price version and retires the current one
+        new_start = to_naive_utc(pricing_data.effective_date)
+        current_start = to_naive_utc(existing_pricing.effective_date)
+        if new_start is None or (current_start is not None and new_start <= current_start):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Pricing for {pricing_data.provider}/{pricing_data.model_name} already exists"
+            )
+        existing_pricing.deprecated_date = pricing_data.effective_date
     
     model_pricing = ModelPricing(
         provider=pricing_data.provider,
@@ -158,6 +174,7 @@ async def create_model_pricing(
     db.add(model_pricing)
     db.commit()
     db.refresh(model_pricing)
+    invalidate_pricing_cache()
     
     return model_pricing
 
@@ -206,6 +223,7 @@ async def update_model_pricing(
     
     db.commit()
     db.refresh(model_pricing)
+    invalidate_pricing_cache()
     
     return model_pricing
 
@@ -227,61 +245,93 @@ async def delete_model_pricing(
     
     db.delete(model_pricing)
     db.commit()
+    invalidate_pricing_cache()
     
     return {"message": "Model pricing deleted successfully"}
 
 
+@router.get("/model-pricing/history")
+async def get_model_pricing_history(
+    provider: str = Query(..., description="AI provider"),
+    model: str = Query(..., description="Model name"),
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get every pricing version for a model, oldest first"""
+    
+    calculator = CostCalculator(db)
+    return {
+        "provider": provider,
+        "model": model,
+        "versions": await calculator.get_pricing_history(provider, model)
+    }
+
+
+@router.post("/usage/recalculate-costs")
+async def recalculate_usage_costs(
+    start_date: datetime = Query(..., description="Start of the window (inclusive)"),
+    end_date: datetime = Query(..., description="End of the window (exclusive)"),
+    current_user: User = Depends(require_plan("premium")),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Reprice your usage in a window at the prices in force when each request was made (Premium feature)"""
+    
+    start_date, end_date = to_naive_utc(start_date), to_naive_utc(end_date)
+    if start_date >= end_date:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date")
+    
+    calculator = CostCalculator(db)
+    changed_days = await calculator.recalculate_usage_costs(start_date, end_date, current_user.id)
+    
+    # Spend counters and cutoff flags were built from the old costs
+    for user_id in changed_days:
+        await invalidate_spend(user_id)
+    
+    days = changed_days.get(current_user.id, [])
+    return {
+        "message": "Usage costs recalculated",
+        "updated_days": [day.isoformat() for day in days]
+    }
+
+
 # User Account Management
 @router.get("/account/usage-stats")
 async def get_account_usage_stats(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get account usage statistics"""
     
-    from app.models.usage import UsageLog
-    from sqlalchemy import func
-    from datetime import datetime, timedelta
+    from sqlalchemy import select, func
+    from datetime import datetime
     
     # Current month stats
     now = datetime.utcnow()
     month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     
-    current_month_stats = db.query(
-        func.count(UsageLog.id).label('requests'),
-        func.sum(UsageLog.total_tokens).label('tokens'),
-        func.sum(UsageLog.cost).label('cost')
-    ).filter(
-        UsageLog.user_id == current_user.id,
-        UsageLog.created_at >= month_start
-    ).first()
-    
-    # All time stats
-    all_time_stats = db.query(
-        func.count(UsageLog.id).label('requests'),
-        func.sum(UsageLog.total_tokens).label('tokens'),
-        func.sum(UsageLog.cost).label('cost')
-    ).filter(
-        UsageLog.user_id == current_user.id
-    ).first()
+    # Rollups for closed days plus a live query for today
+    current_month_stats = await get_usage_totals(db, current_user.id, month_start, now)
+    all_time_stats = await get_usage_totals(db, current_user.id, None, now)
     
     # Active API keys count
     from app.models.user import APIKey
-    active_api_keys = db.query(func.count(APIKey.id)).filter(
-        APIKey.user_id == current_user.id,
-        APIKey.is_active == True
-    ).scalar()
+    active_api_keys = await db.scalar(
+        select(func.count(APIKey.id)).where(
+            APIKey.user_id == current_user.id,
+            APIKey.is_active == True
+        )
+    )
     
     return {
         "current_month": {
-            "requests": current_month_stats.requests or 0,
-            "tokens": current_month_stats.tokens or 0,
-            "cost": float(current_month_stats.cost or 0)
+            "requests": current_month_stats["requests"],
+            "tokens": current_month_stats["tokens"],
+            "cost": float(current_month_stats["cost"])
         },
         "all_time": {
-            "requests": all_time_stats.requests or 0,
-            "tokens": all_time_stats.tokens or 0,
-            "cost": float(all_time_stats.cost or 0)
+            "requests": all_time_stats["requests"],
+            "tokens": all_time_stats["tokens"],
+            "cost": float(all_time_stats["cost"])
         },
         "active_api_keys": active_api_keys or 0,
         "plan": current_user.plan,
@@ -317,6 +367,7 @@ async def upgrade_plan(
     # For now, we'll just update the plan directly
     current_user.plan = target_plan
     db.commit()
+    invalidate_principal(current_user.id)
     
     return {
         "message": f"Plan upgraded to {target_plan}",
@@ -1,60 +1,94 @@
+import os
+import time
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from datetime import datetime, timedelta
 
-from app.core.database import get_db
-from app.core.auth import get_current_active_user
+from app.core.database import get_async_db
+from app.core.auth import get_current_active_user_async
 from app.models.user import User
 from app.models.usage import UsageLog, BudgetSetting
 from app.services.budget_checker import BudgetChecker
 from app.services.cost_calculator import CostCalculator
+from app.services.usage_rollup import get_usage_groups, get_daily_stats
+from app.services.response_cache import get_cache_stats
+from app.services.upstream_retry import get_retry_stats
 from app.schemas.usage import (
     AnalyticsResponse, UsageSummary, ModelBreakdown, ProviderBreakdown,
-    DailyUsage, BudgetStatus, RecommendationsResponse, Recommendation
+    DailyUsage, BudgetStatus, RecommendationsResponse, Recommendation, CacheStats, RetryStats
 )
 
 router = APIRouter()
 
+# Seconds a user's usage summary is served from memory before it is recomputed
+USAGE_SUMMARY_CACHE_TTL = float(os.getenv("USAGE_SUMMARY_CACHE_TTL", "30"))
+USAGE_SUMMARY_CACHE_SIZE = 1000
+
+# (user_id, period_days) -> (computed_at, AnalyticsResponse)
+_usage_summary_cache = {}
+
 
 @router.get("/usage-summary", response_model=AnalyticsResponse)
 async def get_usage_analytics(
     period_days: int = Query(30, description="Number of days to analyze"),
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get comprehensive usage analytics for the dashboard"""
     
+    cache_key = (current_user.id, period_days)
+    cached = _usage_summary_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < USAGE_SUMMARY_CACHE_TTL:
+        return cached[1]
+    
     # Calculate date range
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=period_days)
     
-    # Get usage logs for the period
-    usage_logs = db.query(UsageLog).filter(
-        UsageLog.user_id == current_user.id,
-        UsageLog.created_at >= start_date,
-        UsageLog.created_at <= end_date
-    ).all()
+    # Finalized daily rollups for closed days plus a live query for the open one;
+    # every breakdown is a roll-up of these (day, provider, model) groups
+    usage_groups = await get_usage_groups(db, current_user.id, start_date, end_date)
     
-    if not usage_logs:
-        return AnalyticsResponse(
-            summary=UsageSummary(
-                total_requests=0,
-                total_tokens=0,
-                total_cost=0.0,
-                period_start=start_date,
-                period_end=end_date
-            ),
-            daily_usage=[],
-            model_breakdown=[],
-            provider_breakdown=[]
-        )
+    response = build_analytics_response(usage_groups, start_date, end_date)
     
-    # Calculate summary statistics
-    total_requests = len(usage_logs)
-    total_tokens = sum(log.total_tokens for log in usage_logs)
-    total_cost = sum(log.cost for log in usage_logs)
+    if len(_usage_summary_cache) >= USAGE_SUMMARY_CACHE_SIZE:
+        _usage_summary_cache.clear()
+    _usage_summary_cache[cache_key] = (time.monotonic(), response)
+    return response
+
+
+def build_analytics_response(usage_groups, start_date: datetime, end_date: datetime) -> AnalyticsResponse:
+    """Roll (date, provider, model, requests, tokens, cost) groups up into the dashboard response"""
+    daily_usage_dict = {}
+    model_stats = {}
+    provider_stats = {}
+    
+    for group in usage_groups:
+        # func.date() returns a date on PostgreSQL and a string on SQLite
+        date_key = group.date.isoformat() if hasattr(group.date, "isoformat") else str(group.date)
+        tokens = group.tokens or 0
+        cost = float(group.cost or 0.0)
+        
+        for stats in (
+            daily_usage_dict.setdefault(date_key, {"requests": 0, "tokens": 0, "cost": 0.0}),
+            model_stats.setdefault(f"{group.provider}:{group.model}", {
+                "provider": group.provider,
+                "model": group.model,
+                "requests": 0,
+                "tokens": 0,
+                "cost": 0.0
+            }),
+            provider_stats.setdefault(group.provider, {"requests": 0, "tokens": 0, "cost": 0.0})
+        ):
+            stats["requests"] += group.requests
+            stats["tokens"] += tokens
+            stats["cost"] += cost
+    
+    total_requests = sum(stats["requests"] for stats in provider_stats.values())
+    total_tokens = sum(stats["tokens"] for stats in provider_stats.values())
+    total_cost = sum(stats["cost"] for stats in provider_stats.values())
     
     summary = UsageSummary(
         total_requests=total_requests,
@@ -64,20 +98,6 @@ async def get_usage_analytics(
         period_end=end_date
     )
     
-    # Calculate daily usage
-    daily_usage_dict = {}
-    for log in usage_logs:
-        date_key = log.created_at.date().isoformat()
-        if date_key not in daily_usage_dict:
-            daily_usage_dict[date_key] = {
-                "requests": 0,
-                "tokens": 0,
-                "cost": 0.0
-            }
-        daily_usage_dict[date_key]["requests"] += 1
-        daily_usage_dict[date_key]["tokens"] += log.total_tokens
-        daily_usage_dict[date_key]["cost"] += log.cost
-    
     daily_usage = [
         DailyUsage(
             date=date_str,
@@ -88,22 +108,6 @@ async def get_usage_analytics(
         for date_str, data in sorted(daily_usage_dict.items())
     ]
     
-    # Calculate model breakdown
-    model_stats = {}
-    for log in usage_logs:
-        model_key = f"{log.provider}:{log.model}"
-        if model_key not in model_stats:
-            model_stats[model_key] = {
-                "provider": log.provider,
-                "model": log.model,
-                "requests": 0,
-                "tokens": 0,
-                "cost": 0.0
-            }
-        model_stats[model_key]["requests"] += 1
-        model_stats[model_key]["tokens"] += log.total_tokens
-        model_stats[model_key]["cost"] += log.cost
-    
     model_breakdown = [
         ModelBreakdown(
             model=stats["model"],
@@ -116,20 +120,6 @@ async def get_usage_analytics(
         for stats in sorted(model_stats.values(), key=lambda x: x["cost"], reverse=True)
     ]
     
-    # Calculate provider breakdown
-    provider_stats = {}
-    for log in usage_logs:
-        provider = log.provider
-        if provider not in provider_stats:
-            provider_stats[provider] = {
-                "requests": 0,
-                "tokens": 0,
-                "cost": 0.0
-            }
-        provider_stats[provider]["requests"] += 1
-        provider_stats[provider]["tokens"] += log.total_tokens
-        provider_stats[provider]["cost"] += log.cost
-    
     provider_breakdown = [
         ProviderBreakdown(
             provider=provider,
@@ -151,8 +141,8 @@ async def get_usage_analytics(
 
 @router.get("/budget-status", response_model=List[BudgetStatus])
 async def get_budget_status(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current budget status for all user's budget settings"""
     
@@ -181,8 +171,8 @@ async def get_budget_status(
 
 @router.get("/recommendations", response_model=RecommendationsResponse)
 async def get_recommendations(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get cost optimization recommendations"""
     
@@ -190,10 +180,14 @@ async def get_recommendations(
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=30)
     
-    usage_logs = db.query(UsageLog).filter(
-        UsageLog.user_id == current_user.id,
-        UsageLog.created_at >= start_date
-    ).all()
+    result = await db.execute(
+        select(UsageLog).where(
+            UsageLog.user_id == current_user.id,
+            UsageLog.created_at >= start_date,
+            UsageLog.created_at <= end_date
+        )
+    )
+    usage_logs = result.scalars().all()
     
     recommendations = []
     total_potential_savings = 0.0
@@ -255,10 +249,13 @@ async def get_recommendations(
             total_potential_savings += potential_savings
     
     # Recommendation 2: Budget setup
-    budget_settings = db.query(BudgetSetting).filter(
-        BudgetSetting.user_id == current_user.id,
-        BudgetSetting.is_active == True
-    ).first()
+    result = await db.execute(
+        select(BudgetSetting).where(
+            BudgetSetting.user_id == current_user.id,
+            BudgetSetting.is_active == True
+        )
+    )
+    budget_settings = result.scalars().first()
     
     if not budget_settings and total_cost > 10:  # If spending more than $10 and no budget
         recommendations.append(Recommendation(
@@ -328,8 +325,8 @@ async def get_cost_comparison(
     prompt_tokens: int = Query(..., description="Number of prompt tokens"),
     completion_tokens: int = Query(..., description="Number of completion tokens"),
     providers: Optional[str] = Query(None, description="Comma-separated list of providers"),
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Compare costs across different models and providers"""
     
@@ -350,37 +347,24 @@ async def get_cost_comparison(
 @router.get("/usage-trends")
 async def get_usage_trends(
     days: int = Query(30, description="Number of days to analyze"),
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get usage trends and patterns"""
     
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    # Group usage by day and calculate metrics
-    daily_stats = db.query(
-        func.date(UsageLog.created_at).label('date'),
-        func.count(UsageLog.id).label('requests'),
-        func.sum(UsageLog.total_tokens).label('tokens'),
-        func.sum(UsageLog.cost).label('cost'),
-        func.avg(UsageLog.latency_ms).label('avg_latency')
-    ).filter(
-        UsageLog.user_id == current_user.id,
-        UsageLog.created_at >= start_date
-    ).group_by(
-        func.date(UsageLog.created_at)
-    ).order_by('date').all()
-    
-    trends = []
-    for stat in daily_stats:
-        trends.append({
+    trends = [
+        {
             "date": stat.date.isoformat(),
             "requests": stat.requests,
             "tokens": stat.tokens or 0,
             "cost": float(stat.cost or 0),
             "avg_latency_ms": float(stat.avg_latency or 0)
-        })
+        }
+        for stat in await get_daily_stats(db, current_user.id, start_date, end_date)
+    ]
     
     # Calculate trend metrics
     if len(trends) >= 7:
@@ -403,4 +387,34 @@ async def get_usage_trends(
             "cost_change_percent": round(cost_change_percent, 2),
             "total_days": len(trends)
         }
-    } 
\ No newline at end of file
+    } 
+
+
+@router.get("/cache-stats", response_model=CacheStats)
+async def get_response_cache_stats(
+    period_days: int = Query(30, description="Number of days to analyze"),
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get the response cache hit ratio, coalesced requests and the provider spend they saved"""
+    
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=period_days)
+    
+    stats = await get_cache_stats(db, current_user.id, start_date, end_date)
+    return CacheStats(**stats, period_start=start_date, period_end=end_date)
+
+
+@router.get("/retry-stats", response_model=RetryStats)
+async def get_upstream_retry_stats(
+    period_days: int = Query(30, description="Number of days to analyze"),
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get how often upstream calls were retried or hedged and the time spent backing off"""
+    
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=period_days)
+    
+    stats = await get_retry_stats(db, current_user.id, start_date, end_date)
+    return RetryStats(**stats, period_start=start_date, period_end=end_date)
@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List
 
 from app.core.database import get_db
-from app.core.auth import get_current_active_user
+from app.core.auth import get_current_active_user, invalidate_principal
 from app.core.supabase_auth import get_supabase_auth_service
 from app.models.user import User as UserModel
 from app.schemas.user import (
@@ -94,6 +94,9 @@ async def update_current_user_profile(
     db.commit()
     db.refresh(current_user)
     
+    # Cached principals may carry the old is_active, plan or email
+    invalidate_principal(current_user.id)
+    
     return current_user
 
 
@@ -0,0 +1,49 @@
+from fastapi import APIRouter
+
+from app.core.database import get_database_profile
+from app.core.http_client import get_pool_stats
+from app.core.metrics import get_latency_snapshots, get_metric_values
+from app.core.supabase_executor import get_supabase_call_stats
+from app.services.circuit_breaker import get_circuit_breaker_stats
+from app.services.upstream_scheduler import get_upstream_scheduler
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+
+@router.get("/upstream")
+async def get_upstream_health():
+    """Get connection pool usage and scheduler queues for the provider clients"""
+    return {
+        "providers": get_pool_stats(),
+        "scheduler": get_upstream_scheduler().stats()
+    }
+
+
+@router.get("/database")
+async def get_database_health():
+    """Get the connection profile, pool state and connection acquire latency"""
+    return {
+        **get_database_profile(),
+        "acquire_latency": get_latency_snapshots("db.acquire.")
+    }
+
+
+@router.get("/supabase")
+async def get_supabase_health():
+    """Get executor usage and per-operation latency for Supabase SDK calls"""
+    return get_supabase_call_stats()
+
+
+@router.get("/circuit-breakers")
+async def get_circuit_breaker_health():
+    """Get each provider's circuit breaker state and its rolling error and slow-call rates"""
+    return {"providers": get_circuit_breaker_stats()}
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Get every latency recorder, counter and gauge in this process"""
+    return {
+        "latency": get_latency_snapshots(),
+        **get_metric_values()
+    }
@@ -1,19 +1,37 @@
+import asyncio
 import time
 import json
 import os
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import httpx
-from typing import Dict, Any
+from typing import Dict, Any, Set
 
-from app.core.database import get_db
-from app.core.auth import get_current_active_user
-from app.models.user import User
-from app.models.usage import UsageLog
+from app.core.database import get_async_db, AsyncSessionLocal
+from app.core.auth import Principal, get_current_principal, get_principal_from_token
+from app.core.http_client import get_upstream_client
 from app.models.user import APIKey as APIKeyModel
 from app.services.cost_calculator import CostCalculator
-from app.services.budget_checker import BudgetChecker
+from app.services.budget_checker import BudgetChecker, record_spend
+from app.services.stream_usage import StreamUsageTracker
+from app.services.usage_logger import get_usage_log_queue
+from app.services.provider_key_cache import ProviderCredential, get_provider_key_cache
+from app.services.response_cache import (
+    RESPONSE_CACHE_ENABLED, CACHE_CONTROL_HEADER, CachedResponse,
+    get_response_cache, response_cache_key, is_deterministic, cache_mode
+)
+from app.services.singleflight import REQUEST_COALESCING_ENABLED, get_request_coalescer
+from app.services.upstream_scheduler import (
+    QUEUE_DEADLINE_HEADER, get_upstream_scheduler, estimate_request_tokens, queue_deadline
+)
+from app.services.circuit_breaker import get_circuit_breaker, is_failure_status
+from app.services.upstream_retry import (
+    HEDGE_HEADER, IDEMPOTENT_METHODS, hedge_requested, retry_summary, send_with_retries,
+    upstream_latency_recorder
+)
 
 router = APIRouter()
 
@@ -21,29 +39,83 @@ router = APIRouter()
 PROVIDER_CONFIGS = {
     "openai": {
         "base_url": "https://api.openai.com",
-        "headers": lambda api_key: {"Authorization": f"Bearer {api_key}"}
+        "headers": lambda api_key: {"Authorization": f"Bearer {api_key}"},
+        "http2": True,
+        "connect_timeout": float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10.0")),
+        "read_timeout": float(os.getenv("OPENAI_READ_TIMEOUT", "300.0")),
+        # Per API key; 0 disables the RPM/TPM buckets
+        "max_concurrency": int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")),
+        "rpm_limit": int(os.getenv("OPENAI_RPM_LIMIT", "0")),
+        "tpm_limit": int(os.getenv("OPENAI_TPM_LIMIT", "0"))
     },
     "anthropic": {
         "base_url": "https://api.anthropic.com",
         "headers": lambda api_key: {
             "x-api-key": api_key,
             "anthropic-version": "2023-06-01"
-        }
+        },
+        "http2": True,
+        "connect_timeout": float(os.getenv("ANTHROPIC_CONNECT_TIMEOUT", "10.0")),
+        "read_timeout": float(os.getenv("ANTHROPIC_READ_TIMEOUT", "300.0")),
+        "max_concurrency": int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "16")),
+        "rpm_limit": int(os.getenv("ANTHROPIC_RPM_LIMIT", "0")),
+        "tpm_limit": int(os.getenv("ANTHROPIC_TPM_LIMIT", "0"))
     }
 }
 
+# Request headers that are never forwarded upstream. Hop-by-hop headers are
+# connection-specific and are rejected outright on HTTP/2 connections, and
+# content-length is recomputed because the body may be rewritten.
+EXCLUDED_FORWARD_HEADERS = {
+    "host", "authorization", "x-api-key", "content-length",
+    "connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade", "te",
+    CACHE_CONTROL_HEADER, QUEUE_DEADLINE_HEADER, HEDGE_HEADER
+}
+
+# Provider response headers that are not passed back to the caller
+EXCLUDED_RESPONSE_HEADERS = {
+    "content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"
+}
+
+# Ask OpenAI to append a usage chunk to streams so they can be billed
+STREAM_INCLUDE_USAGE = os.getenv("PROXY_STREAM_INCLUDE_USAGE", "true").lower() == "true"
+
+# Billing work that has to finish after the client goes away, referenced here until done
+_detached_tasks: Set[asyncio.Task] = set()
+
+
+def _forget_detached(task: asyncio.Task):
+    _detached_tasks.discard(task)
+    error = None if task.cancelled() else task.exception()
+    # Upstream and scheduler errors are answered by the request; anything else would go unseen
+    if error is not None and not isinstance(error, (HTTPException, httpx.HTTPError)):
+        print(f"Warning: Background billing task failed: {error}")
+
+
+def run_detached(coro) -> asyncio.Task:
+    """Run a coroutine in its own task so cancelling the caller doesn't cancel it"""
+    task = asyncio.ensure_future(coro)
+    _detached_tasks.add(task)
+    task.add_done_callback(_forget_detached)
+    return task
+
+
 # Helper functions
-async def get_user_api_key(
-    provider: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-) -> APIKeyModel:
-    """Get user's API key for the specified provider"""
-    api_key = db.query(APIKeyModel).filter(
-        APIKeyModel.user_id == current_user.id,
-        APIKeyModel.provider == provider,
-        APIKeyModel.is_active == True
-    ).first()
+async def resolve_provider_key(user_id, provider: str, db: AsyncSession) -> ProviderCredential:
+    """Get the user's decrypted key for a provider, from the cache or api_keys"""
+    provider_key_cache = get_provider_key_cache()
+    credential = provider_key_cache.get(user_id, provider)
+    if credential is not None:
+        return credential
+    
+    result = await db.execute(
+        select(APIKeyModel).where(
+            APIKeyModel.user_id == user_id,
+            APIKeyModel.provider == provider,
+            APIKeyModel.is_active == True
+        )
+    )
+    api_key = result.scalars().first()
     
     if not api_key:
         raise HTTPException(
@@ -51,27 +123,25 @@ async def get_user_api_key(
             detail=f"No active API key found for {provider}. Please add your API key first."
         )
     
-    return api_key
+    return provider_key_cache.put(
+        user_id, provider, api_key.id, decrypt_api_key(api_key.encrypted_key)
+    )
+
+async def get_user_api_key(
+    provider: str,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+) -> ProviderCredential:
+    """Get user's API key for the specified provider"""
+    return await resolve_provider_key(current_user.id, provider, db)
 
 async def get_user_api_key_direct(
     provider: str,
-    current_user: User,
-    db: Session
-) -> APIKeyModel:
+    current_user: Principal,
+    db: AsyncSession
+) -> ProviderCredential:
     """Get user's API key for the specified provider (direct function without dependencies)"""
-    api_key = db.query(APIKeyModel).filter(
-        APIKeyModel.user_id == current_user.id,
-        APIKeyModel.provider == provider,
-        APIKeyModel.is_active == True
-    ).first()
-    
-    if not api_key:
-        raise HTTPException(
-            status_code=404,
-            detail=f"No active API key found for {provider}. Please add your API key first."
-        )
-    
-    return api_key
+    return await resolve_provider_key(current_user.id, provider, db)
 
 def decrypt_api_key(encrypted_key: str) -> str:
     """Decrypt the stored API key"""
@@ -84,7 +154,6 @@ def decrypt_api_key(encrypted_key: str) -> str:
         raise HTTPException(status_code=500, detail="Invalid API key format")
 
 async def log_usage(
-    db: Session,
     user_id: int,
     api_key_id: int,
     provider: str,
@@ -99,50 +168,53 @@ async def log_usage(
     response_size: int = None,
     extra_data: Dict[str, Any] = None
 ):
-    """Log API usage to database"""
-    usage_log = UsageLog(
-        user_id=user_id,
-        api_key_id=api_key_id,
-        provider=provider,
-        model=model,
-        endpoint=endpoint,
-        prompt_tokens=prompt_tokens,
-        completion_tokens=completion_tokens,
-        total_tokens=prompt_tokens + completion_tokens,
-        cost=cost,
-        latency_ms=latency_ms,
-        status_code=status_code,
-        request_size_bytes=request_size,
-        response_size_bytes=response_size,
-        extra_data=extra_data
-    )
-    
-    db.add(usage_log)
-    db.commit()
+    """Queue API usage for the next batched write (also updates the key's last_used_at)"""
+    created_at = datetime.utcnow()
+    
+    # Keep the budget spend counters in step with what will be written
+    await record_spend(user_id, cost, created_at)
+    
+    await get_usage_log_queue().enqueue({
+        "user_id": user_id,
+        "api_key_id": api_key_id,
+        "provider": provider,
+        "model": model,
+        "endpoint": endpoint,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cost": cost,
+        "latency_ms": latency_ms,
+        "status_code": status_code,
+        "request_size_bytes": request_size,
+        "response_size_bytes": response_size,
+        "extra_data": extra_data,
+        "created_at": created_at
+    })
 
 # Token validation function for URL-based authentication
-async def get_user_from_token(token: str, db: Session) -> User:
-    """Get user from JWT token for URL-based authentication"""
-    from app.core.auth import verify_token
+async def get_user_from_token(token: str, db: AsyncSession) -> Principal:
+    """Get user from JWT token for URL-based authentication (cached per token)"""
     try:
-        token_data = verify_token(token)
-        if token_data is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = db.query(User).filter(User.email == token_data.email).first()
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        return user
+        principal = await get_principal_from_token(token, db)
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+    
+    if principal is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    
+    # Cached principals keep is_active, so a deactivated account is refused without a query
+    if not principal.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    
+    return principal
 
 # API Key management endpoints (Must be defined BEFORE the catch-all proxy route)
 @router.post("/api-keys")
 async def add_api_key(
     api_key_data: dict,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Add a new API key for a provider"""
     import base64
@@ -161,17 +233,21 @@ async def add_api_key(
         )
     
     # Check if user already has an API key for this provider
-    existing_key = db.query(APIKeyModel).filter(
-        APIKeyModel.user_id == current_user.id,
-        APIKeyModel.provider == api_key_data["provider"]
-    ).first()
+    result = await db.execute(
+        select(APIKeyModel).where(
+            APIKeyModel.user_id == current_user.id,
+            APIKeyModel.provider == api_key_data["provider"]
+        )
+    )
+    existing_key = result.scalars().first()
     
     if existing_key:
         # Update existing key
         existing_key.name = api_key_data["name"]
         existing_key.encrypted_key = base64.b64encode(api_key_data["api_key"].encode()).decode()
         existing_key.is_active = True
-        db.commit()
+        await db.commit()
+        get_provider_key_cache().invalidate(current_user.id, existing_key.provider)
         return {"message": "API key updated successfully"}
     else:
         # Create new key
@@ -186,19 +262,21 @@ async def add_api_key(
         )
         
         db.add(new_api_key)
-        db.commit()
+        await db.commit()
+        get_provider_key_cache().invalidate(current_user.id, new_api_key.provider)
         
         return {"message": "API key added successfully"}
 
 @router.get("/api-keys")
 async def list_api_keys(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List user's API keys (without exposing the actual keys)"""
-    api_keys = db.query(APIKeyModel).filter(
-        APIKeyModel.user_id == current_user.id
-    ).all()
+    result = await db.execute(
+        select(APIKeyModel).where(APIKeyModel.user_id == current_user.id)
+    )
+    api_keys = result.scalars().all()
     
     return [
         {
@@ -215,20 +293,24 @@ async def list_api_keys(
 @router.delete("/api-keys/{api_key_id}")
 async def delete_api_key(
     api_key_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete an API key"""
-    api_key = db.query(APIKeyModel).filter(
-        APIKeyModel.id == api_key_id,
-        APIKeyModel.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(APIKeyModel).where(
+            APIKeyModel.id == api_key_id,
+            APIKeyModel.user_id == current_user.id
+        )
+    )
+    api_key = result.scalars().first()
     
     if not api_key:
         raise HTTPException(status_code=404, detail="API key not found")
     
-    db.delete(api_key)
-    db.commit()
+    await db.delete(api_key)
+    await db.commit()
+    get_provider_key_cache().invalidate(current_user.id, api_key.provider)
     
     return {"message": "API key deleted successfully"}
 
@@ -242,7 +324,7 @@ async def simplified_proxy_request(
     provider: str,
     path: str,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Simplified proxy for one-line integration - token in URL path.
@@ -261,7 +343,64 @@ async def simplified_proxy_request(
     
     # Get user's API key for this provider
     user_api_key = await get_user_api_key_direct(provider, current_user, db)
-    actual_api_key = decrypt_api_key(user_api_key.encrypted_key)
+    
+    return await forward_to_provider(request, provider, path, current_user, user_api_key, db)
+
+# NOTE: More specific routes must come BEFORE catch-all routes
+# This catch-all route must be LAST to avoid intercepting specific routes
+@router.api_route(
+    "/{provider}/{path:path}",
+    methods=["GET", "POST", "PUT", "DELETE", "PATCH"]
+)
+async def proxy_request(
+    provider: str,
+    path: str,
+    request: Request,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Proxy requests to AI providers with usage logging"""
+    
+    # Validate provider
+    if provider not in PROVIDER_CONFIGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported provider: {provider}. Supported: {list(PROVIDER_CONFIGS.keys())}"
+        )
+    
+    # Get user's API key for this provider
+    user_api_key = await get_user_api_key(provider, current_user, db)
+    
+    return await forward_to_provider(request, provider, path, current_user, user_api_key, db)
+
+# Shared forwarding logic for both proxy routes
+def extract_usage(provider: str, response_json: Dict[str, Any]) -> tuple[int, int]:
+    """Extract (prompt_tokens, completion_tokens) from a provider response body"""
+    usage = response_json.get("usage", {}) or {}
+    if provider == "openai":
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    elif provider == "anthropic":
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    return 0, 0
+
+def get_response_headers(response: httpx.Response) -> Dict[str, str]:
+    """Provider response headers that are safe to pass back to the caller"""
+    # httpx has already decoded the body, so encoding/length headers no longer apply
+    return {
+        key: value for key, value in response.headers.items()
+        if key.lower() not in EXCLUDED_RESPONSE_HEADERS
+    }
+
+async def forward_to_provider(
+    request: Request,
+    provider: str,
+    path: str,
+    current_user: Principal,
+    user_api_key: ProviderCredential,
+    db: AsyncSession
+) -> Response:
+    """Forward a request to the provider, log its usage and return the provider's response"""
+    actual_api_key = user_api_key.api_key
     
     # Check budget before making the request
     budget_checker = BudgetChecker(db)
@@ -274,7 +413,6 @@ async def simplified_proxy_request(
     
     # Get request body
     body = await request.body()
-    request_size = len(body) if body else 0
     
     # Parse request body for token counting
     request_data = {}
@@ -283,102 +421,282 @@ async def simplified_proxy_request(
             request_data = json.loads(body)
         except json.JSONDecodeError:
             pass
+    if not isinstance(request_data, dict):
+        request_data = {}
     
     # Extract model from request
     model = request_data.get("model", "unknown")
+    is_streaming = request_data.get("stream") is True
+    
+    # OpenAI only reports usage on streams when asked to
+    if (
+        is_streaming
+        and provider == "openai"
+        and STREAM_INCLUDE_USAGE
+        and "stream_options" not in request_data
+    ):
+        request_data["stream_options"] = {"include_usage": True}
+        body = json.dumps(request_data).encode()
+    
+    request_size = len(body) if body else 0
     
     # Prepare headers for forwarding
     forward_headers = {}
     for key, value in request.headers.items():
-        if key.lower() not in ["host", "authorization", "x-api-key"]:
+        if key.lower() not in EXCLUDED_FORWARD_HEADERS:
             forward_headers[key] = value
     
     # Add provider-specific headers
     forward_headers.update(headers)
     
+    # Deterministic requests can be answered from the response cache
+    cache_key = None
+    cache_read = cache_write = False
+    if RESPONSE_CACHE_ENABLED and not is_streaming and is_deterministic(path, request_data):
+        cache_read, cache_write = cache_mode(request.headers)
+        cache_key = response_cache_key(
+            current_user.id, provider, request.method, path, request.query_params, forward_headers, request_data
+        )
+        if cache_read:
+            cached, cache_tier = await get_response_cache().get(cache_key)
+            if cached is not None:
+                return await serve_cached_response(
+                    request, provider, path, current_user, user_api_key, db,
+                    cached, cache_tier, request_size
+                )
+    
+    # Identical deterministic requests already in flight for this user share one upstream call
+    coalesce_key = None
+    if (
+        REQUEST_COALESCING_ENABLED
+        and not is_streaming
+        and is_deterministic(path, request_data)
+        and cache_mode(request.headers)[1]
+    ):
+        coalesce_key = cache_key or response_cache_key(
+            current_user.id, provider, request.method, path, request.query_params, forward_headers, request_data
+        )
+    
+    # Requests wait for a per-(api key, provider) slot under the provider's RPM/TPM limits
+    estimated_tokens = estimate_request_tokens(body, request_data)
+    
+    # Idempotent and deterministic requests may be repeated after failures that reached the provider
+    repeatable = request.method in IDEMPOTENT_METHODS or is_deterministic(path, request_data)
+    
+    if is_streaming:
+        return await stream_from_provider(
+            request, provider, path, current_user, user_api_key, db,
+            target_url, forward_headers, body, model, request_size, estimated_tokens, repeatable
+        )
+    
     # Start timing
     start_time = time.time()
     
+    # Read up front: a shared upstream call can outlive the request that started it
+    user_id = current_user.id
+    api_key_id = user_api_key.id
+    method = request.method
+    query_params = dict(request.query_params)
+    
     try:
         # Make the request to the AI provider
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                headers=forward_headers,
-                content=body,
-                params=request.query_params
-            )
+        client = get_upstream_client(provider, provider_config)
+        deadline = queue_deadline(request.headers)
         
-        # Calculate latency
-        latency_ms = int((time.time() - start_time) * 1000)
+        # A hedge sends the request twice, so only requests that are safe to repeat are hedged
+        hedge = repeatable and hedge_requested(request.headers)
+        # What the losing hedge attempt used, billed along with the winning one
+        hedge_losses = []
         
-        # Get response content
-        response_content = response.content
-        response_size = len(response_content)
+        async def discard_attempt(result):
+            if result is None:
+                # Cancelled after it may have reached the provider: bill the prompt it was sent
+                prompt_tokens, completion_tokens, estimated = request_size // 4, 0, True
+            else:
+                response, ticket = result
+                prompt_tokens = completion_tokens = 0
+                estimated = False
+                if response.status_code == 200:
+                    try:
+                        prompt_tokens, completion_tokens = extract_usage(provider, json.loads(response.content))
+                    except (json.JSONDecodeError, KeyError, AttributeError):
+                        pass
+                    ticket.settle(prompt_tokens + completion_tokens)
+                await response.aclose()
+            if prompt_tokens or completion_tokens:
+                hedge_losses.append({
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "estimated": estimated
+                })
         
-        # Parse response for token counting and cost calculation
-        prompt_tokens = 0
-        completion_tokens = 0
-        cost = 0.0
+        async def send_attempt():
+            # Fails fast with a 503 while the provider's breaker is open
+            breaker = get_circuit_breaker(provider)
+            probe = breaker.allow()
+            ticket = None
+            try:
+                ticket = await get_upstream_scheduler().acquire(
+                    api_key_id, provider, provider_config, user_id, estimated_tokens, deadline
+                )
+                attempt_start = time.perf_counter()
+                response = await client.request(
+                    method=method,
+                    url=target_url,
+                    headers=forward_headers,
+                    content=body,
+                    params=query_params
+                )
+            except httpx.TransportError:
+                breaker.record(probe, True, time.perf_counter() - attempt_start)
+                raise
+            except BaseException:
+                breaker.abandon(probe)
+                raise
+            finally:
+                if ticket is not None:
+                    ticket.release()
+            attempt_seconds = time.perf_counter() - attempt_start
+            upstream_latency_recorder(provider).record(attempt_seconds)
+            breaker.record(probe, is_failure_status(response.status_code), attempt_seconds)
+            if response.status_code != 200:
+                # Rejected and failed attempts don't count against the TPM budget
+                ticket.settle(0)
+            return response, ticket
         
-        try:
-            if response.status_code == 200:
-                response_json = json.loads(response_content)
+        async def send_request():
+            """Make the upstream call and bill it to this request, even if it disconnects first"""
+            (response, ticket), attempts = await send_with_retries(
+                send_attempt, provider, repeatable, hedge, discard_attempt
+            )
+            
+            # Calculate latency
+            latency_ms = int((time.time() - start_time) * 1000)
+            
+            # Parse response for token counting and cost calculation
+            prompt_tokens = 0
+            completion_tokens = 0
+            cost = 0.0
+            
+            # The request's session may be closed by the time a shared call finishes
+            async with AsyncSessionLocal() as call_db:
+                cost_calculator = CostCalculator(call_db)
+                try:
+                    if response.status_code == 200:
+                        response_json = json.loads(response.content)
+                        
+                        # Extract usage information based on provider
+                        prompt_tokens, completion_tokens = extract_usage(provider, response_json)
+                        
+                        # Calculate cost
+                        cost = await cost_calculator.calculate_cost(
+                            provider, model, prompt_tokens, completion_tokens
+                        )
                 
-                # Extract usage information based on provider
-                if provider == "openai":
-                    usage = response_json.get("usage", {})
-                    prompt_tokens = usage.get("prompt_tokens", 0)
-                    completion_tokens = usage.get("completion_tokens", 0)
-                elif provider == "anthropic":
-                    usage = response_json.get("usage", {})
-                    prompt_tokens = usage.get("input_tokens", 0)
-                    completion_tokens = usage.get("output_tokens", 0)
+                except (json.JSONDecodeError, KeyError, AttributeError):
+                    # If we can't parse the response, log with 0 tokens
+                    pass
                 
-                # Calculate cost
-                cost_calculator = CostCalculator(db)
-                cost = await cost_calculator.calculate_cost(
-                    provider, model, prompt_tokens, completion_tokens
-                )
+                for loss in hedge_losses:
+                    loss["cost"] = await cost_calculator.calculate_cost(
+                        provider, model, loss["prompt_tokens"], loss["completion_tokens"]
+                    )
+            
+            ticket.settle(prompt_tokens + completion_tokens)
+            extra_data = {
+                "method": method,
+                "query_params": query_params
+            }
+            if ticket.wait_ms:
+                extra_data["queue_wait_ms"] = ticket.wait_ms
+            extra_data.update(retry_summary(attempts))
+            if hedge_losses:
+                extra_data["hedge_losses"] = hedge_losses
+            if cache_key is not None:
+                if cache_read:
+                    # Counted as a miss so analytics can report the hit ratio of cacheable requests
+                    extra_data["cached"] = False
+                if cache_write and response.status_code == 200:
+                    await get_response_cache().put(cache_key, CachedResponse(
+                        content=response.content,
+                        status_code=response.status_code,
+                        media_type=response.headers.get("content-type"),
+                        model=model,
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens
+                    ))
+            
+            # Log the usage; the provider billed the losing hedge attempt as well
+            await log_usage(
+                user_id=user_id,
+                api_key_id=api_key_id,
+                provider=provider,
+                model=model,
+                endpoint=f"/{path}",
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                cost=cost + sum(loss["cost"] for loss in hedge_losses),
+                latency_ms=latency_ms,
+                status_code=response.status_code,
+                request_size=request_size,
+                response_size=len(response.content),
+                extra_data=extra_data
+            )
+            return response, prompt_tokens, completion_tokens, cost
         
-        except (json.JSONDecodeError, KeyError):
-            # If we can't parse the response, log with 0 tokens
-            pass
+        if coalesce_key is not None:
+            (response, prompt_tokens, completion_tokens, cost), coalesced = await get_request_coalescer().do(
+                coalesce_key, send_request
+            )
+        else:
+            # Detached like a shared call, so a disconnect doesn't cancel the billing
+            (response, prompt_tokens, completion_tokens, cost), coalesced = (
+                await asyncio.shield(run_detached(send_request())), False
+            )
         
-        # Log the usage
-        await log_usage(
-            db=db,
-            user_id=current_user.id,
-            api_key_id=user_api_key.id,
-            provider=provider,
-            model=model,
-            endpoint=f"/{path}",
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            cost=cost,
-            latency_ms=latency_ms,
-            status_code=response.status_code,
-            request_size=request_size,
-            response_size=response_size,
-            extra_data={
-                "method": request.method,
-                "query_params": dict(request.query_params)
-            }
-        )
+        response_headers = get_response_headers(response)
+        if cache_key is not None:
+            response_headers[CACHE_CONTROL_HEADER] = "miss" if cache_read else "bypass"
         
-        # Update API key last used timestamp
-        user_api_key.last_used_at = db.query(UsageLog).order_by(UsageLog.created_at.desc()).first().created_at
-        db.commit()
+        if coalesced:
+            # The request that made the upstream call was billed for it; this one rode along
+            extra_data = {
+                "method": method,
+                "query_params": query_params,
+                "coalesced": True,
+                "saved_cost": cost,
+                "saved_tokens": prompt_tokens + completion_tokens
+            }
+            if cache_key is not None and cache_read:
+                extra_data["cached"] = False
+            response_headers[CACHE_CONTROL_HEADER] = "coalesced"
+            await log_usage(
+                user_id=user_id,
+                api_key_id=api_key_id,
+                provider=provider,
+                model=model,
+                endpoint=f"/{path}",
+                prompt_tokens=0,
+                completion_tokens=0,
+                cost=0.0,
+                latency_ms=int((time.time() - start_time) * 1000),
+                status_code=response.status_code,
+                request_size=request_size,
+                response_size=len(response.content),
+                extra_data=extra_data
+            )
         
         # Return the response from the AI provider
         return Response(
-            content=response_content,
+            content=response.content,
             status_code=response.status_code,
-            headers=dict(response.headers),
+            headers=response_headers,
             media_type=response.headers.get("content-type")
         )
         
+    except HTTPException:
+        # Shed by the upstream scheduler before reaching the provider
+        raise
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Request to AI provider timed out")
     except httpx.RequestError as e:
@@ -386,9 +704,8 @@ async def simplified_proxy_request(
     except Exception as e:
         # Log error usage
         await log_usage(
-            db=db,
-            user_id=current_user.id,
-            api_key_id=user_api_key.id,
+            user_id=user_id,
+            api_key_id=api_key_id,
             provider=provider,
             model=model,
             endpoint=f"/{path}",
@@ -402,170 +719,236 @@ async def simplified_proxy_request(
         )
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-# NOTE: More specific routes must come BEFORE catch-all routes
-# This catch-all route must be LAST to avoid intercepting specific routes
-@router.api_route(
-    "/{provider}/{path:path}",
-    methods=["GET", "POST", "PUT", "DELETE", "PATCH"]
-)
-async def proxy_request(
+async def serve_cached_response(
+    request: Request,
     provider: str,
     path: str,
-    request: Request,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
-    """Proxy requests to AI providers with usage logging"""
-    
-    # Validate provider
-    if provider not in PROVIDER_CONFIGS:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported provider: {provider}. Supported: {list(PROVIDER_CONFIGS.keys())}"
-        )
+    current_user: Principal,
+    user_api_key: ProviderCredential,
+    db: AsyncSession,
+    cached: CachedResponse,
+    cache_tier: str,
+    request_size: int
+) -> Response:
+    """Return a cached provider response, logged at zero cost with what it would have cost"""
+    start_time = time.time()
     
-    # Get user's API key for this provider
-    user_api_key = await get_user_api_key(provider, current_user, db)
-    actual_api_key = decrypt_api_key(user_api_key.encrypted_key)
+    cost_calculator = CostCalculator(db)
+    saved_cost = await cost_calculator.calculate_cost(
+        provider, cached.model, cached.prompt_tokens, cached.completion_tokens
+    )
     
-    # Check budget before making the request
-    budget_checker = BudgetChecker(db)
-    await budget_checker.check_budget_limits(current_user.id)
+    await log_usage(
+        user_id=current_user.id,
+        api_key_id=user_api_key.id,
+        provider=provider,
+        model=cached.model,
+        endpoint=f"/{path}",
+        prompt_tokens=0,
+        completion_tokens=0,
+        cost=0.0,
+        latency_ms=int((time.time() - start_time) * 1000),
+        status_code=cached.status_code,
+        request_size=request_size,
+        response_size=len(cached.content),
+        extra_data={
+            "method": request.method,
+            "query_params": dict(request.query_params),
+            "cached": True,
+            "cache_tier": cache_tier,
+            "saved_cost": saved_cost,
+            "saved_tokens": cached.prompt_tokens + cached.completion_tokens
+        }
+    )
     
-    # Prepare request details
+    return Response(
+        content=cached.content,
+        status_code=cached.status_code,
+        headers={CACHE_CONTROL_HEADER: "hit"},
+        media_type=cached.media_type
+    )
+
+async def stream_from_provider(
+    request: Request,
+    provider: str,
+    path: str,
+    current_user: Principal,
+    user_api_key: ProviderCredential,
+    db: AsyncSession,
+    target_url: str,
+    forward_headers: Dict[str, str],
+    body: bytes,
+    model: str,
+    request_size: int,
+    estimated_tokens: int,
+    repeatable: bool
+) -> Response:
+    """Pass a streaming (SSE) response through chunk by chunk and log its usage once it closes"""
     provider_config = PROVIDER_CONFIGS[provider]
-    target_url = f"{provider_config['base_url']}/{path}"
-    headers = provider_config["headers"](actual_api_key)
-    
-    # Get request body
-    body = await request.body()
-    request_size = len(body) if body else 0
-    
-    # Parse request body for token counting
-    request_data = {}
-    if body:
-        try:
-            request_data = json.loads(body)
-        except json.JSONDecodeError:
-            pass
-    
-    # Extract model from request
-    model = request_data.get("model", "unknown")
-    
-    # Prepare headers for forwarding
-    forward_headers = {}
-    for key, value in request.headers.items():
-        if key.lower() not in ["host", "authorization", "x-api-key"]:
-            forward_headers[key] = value
-    
-    # Add provider-specific headers
-    forward_headers.update(headers)
+    client = get_upstream_client(provider, provider_config)
     
     # Start timing
     start_time = time.time()
     
-    try:
-        # Make the request to the AI provider
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.request(
+    deadline = queue_deadline(request.headers)
+    
+    async def send_attempt():
+        breaker = get_circuit_breaker(provider)
+        probe = breaker.allow()
+        try:
+            # The slot is held until the stream closes
+            ticket = await get_upstream_scheduler().acquire(
+                user_api_key.id, provider, provider_config, current_user.id, estimated_tokens, deadline
+            )
+        except BaseException:
+            breaker.abandon(probe)
+            raise
+        try:
+            attempt_start = time.perf_counter()
+            upstream_request = client.build_request(
                 method=request.method,
                 url=target_url,
                 headers=forward_headers,
                 content=body,
                 params=request.query_params
             )
+            response = await client.send(upstream_request, stream=True)
+        except httpx.TransportError:
+            ticket.release()
+            breaker.record(probe, True, time.perf_counter() - attempt_start)
+            raise
+        except BaseException:
+            ticket.release()
+            breaker.abandon(probe)
+            raise
+        # Streams are judged on time to headers, since their length depends on the output
+        breaker.record(probe, is_failure_status(response.status_code), time.perf_counter() - attempt_start)
         
-        # Calculate latency
-        latency_ms = int((time.time() - start_time) * 1000)
-        
-        # Get response content
+        # Non-success responses are small JSON errors, so read them and free the slot
+        if response.status_code != 200:
+            try:
+                await response.aread()
+            finally:
+                ticket.settle(0)
+                ticket.release()
+                await response.aclose()
+        return response, ticket
+    
+    # Retries only happen before the stream starts, so callers never see a partial body twice
+    try:
+        (response, ticket), attempts = await send_with_retries(send_attempt, provider, repeatable)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Request to AI provider timed out")
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Error connecting to {provider}: {str(e)}")
+    
+    if response.status_code != 200:
         response_content = response.content
-        response_size = len(response_content)
         
-        # Parse response for token counting and cost calculation
-        prompt_tokens = 0
-        completion_tokens = 0
-        cost = 0.0
-        
-        try:
-            if response.status_code == 200:
-                response_json = json.loads(response_content)
-                
-                # Extract usage information based on provider
-                if provider == "openai":
-                    usage = response_json.get("usage", {})
-                    prompt_tokens = usage.get("prompt_tokens", 0)
-                    completion_tokens = usage.get("completion_tokens", 0)
-                elif provider == "anthropic":
-                    usage = response_json.get("usage", {})
-                    prompt_tokens = usage.get("input_tokens", 0)
-                    completion_tokens = usage.get("output_tokens", 0)
-                
-                # Calculate cost
-                cost_calculator = CostCalculator(db)
-                cost = await cost_calculator.calculate_cost(
-                    provider, model, prompt_tokens, completion_tokens
-                )
-        
-        except (json.JSONDecodeError, KeyError):
-            # If we can't parse the response, log with 0 tokens
-            pass
-        
-        # Log the usage
         await log_usage(
-            db=db,
             user_id=current_user.id,
             api_key_id=user_api_key.id,
             provider=provider,
             model=model,
             endpoint=f"/{path}",
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            cost=cost,
-            latency_ms=latency_ms,
+            prompt_tokens=0,
+            completion_tokens=0,
+            cost=0.0,
+            latency_ms=int((time.time() - start_time) * 1000),
             status_code=response.status_code,
             request_size=request_size,
-            response_size=response_size,
+            response_size=len(response_content),
             extra_data={
                 "method": request.method,
-                "query_params": dict(request.query_params)
+                "query_params": dict(request.query_params),
+                "stream": True,
+                **retry_summary(attempts)
             }
         )
         
-        # Update API key last used timestamp
-        user_api_key.last_used_at = db.query(UsageLog).order_by(UsageLog.created_at.desc()).first().created_at
-        db.commit()
-        
-        # Return the response from the AI provider
         return Response(
             content=response_content,
             status_code=response.status_code,
-            headers=dict(response.headers),
+            headers=get_response_headers(response),
             media_type=response.headers.get("content-type")
         )
+    
+    first_chunk_ms = None
+    tracker = StreamUsageTracker(provider)
+    user_id = current_user.id
+    api_key_id = user_api_key.id
+    method = request.method
+    query_params = dict(request.query_params)
+    
+    async def finish_stream(response_size: int, error):
+        try:
+            await response.aclose()
+        except Exception as e:
+            print(f"Warning: Failed to close {provider} stream: {e}")
+        
+        # The request's session is closed once the response starts, so price with a fresh one
+        async with AsyncSessionLocal() as log_db:
+            cost_calculator = CostCalculator(log_db)
+            usage_model = model if model != "unknown" else (tracker.model or model)
+            cost = await cost_calculator.calculate_cost(
+                provider, usage_model, tracker.prompt_tokens, tracker.completion_tokens
+            )
+        
+        extra_data = {
+            "method": method,
+            "query_params": query_params,
+            "stream": True,
+            "time_to_first_chunk_ms": first_chunk_ms
+        }
+        if error:
+            extra_data["error"] = error
+        extra_data.update(retry_summary(attempts))
         
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=504, detail="Request to AI provider timed out")
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Error connecting to {provider}: {str(e)}")
-    except Exception as e:
-        # Log error usage
         await log_usage(
-            db=db,
-            user_id=current_user.id,
-            api_key_id=user_api_key.id,
+            user_id=user_id,
+            api_key_id=api_key_id,
             provider=provider,
-            model=model,
+            model=usage_model,
             endpoint=f"/{path}",
-            prompt_tokens=0,
-            completion_tokens=0,
-            cost=0.0,
+            prompt_tokens=tracker.prompt_tokens,
+            completion_tokens=tracker.completion_tokens,
+            cost=cost,
             latency_ms=int((time.time() - start_time) * 1000),
-            status_code=500,
+            status_code=response.status_code,
             request_size=request_size,
-            extra_data={"error": str(e)}
+            response_size=response_size,
+            extra_data=extra_data
         )
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
-
- 
\ No newline at end of file
+    
+    async def stream_body():
+        nonlocal first_chunk_ms
+        response_size = 0
+        error = None
+        
+        try:
+            async for chunk in response.aiter_bytes():
+                if first_chunk_ms is None:
+                    first_chunk_ms = int((time.time() - start_time) * 1000)
+                response_size += len(chunk)
+                tracker.feed(chunk)
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            error = "Client disconnected"
+            raise
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            # Free the slot without awaiting: on a disconnect this runs in a cancelled scope
+            tracker.close()
+            ticket.settle(tracker.prompt_tokens + tracker.completion_tokens)
+            ticket.release()
+            # The provider billed whatever it streamed, so close and log outside that scope
+            await asyncio.shield(run_detached(finish_stream(response_size, error)))
+    
+    return StreamingResponse(
+        stream_body(),
+        status_code=response.status_code,
+        headers=get_response_headers(response),
+        media_type=response.headers.get("content-type")
+    )
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Request
 from typing import List, Optional
 from ..core.supabase_storage import get_supabase_storage_service
 from ..core.auth import get_current_active_user
 from ..models.user import User
 from ..schemas.user import User as UserSchema
+from ..schemas.storage import BatchRelocationRequest, SignURLsRequest
 
 router = APIRouter(prefix="/storage", tags=["storage"])
 
@@ -33,6 +34,36 @@ async def upload_file(
         )
 
 
+@router.put("/upload/stream/{file_name}")
+async def upload_file_stream(
+    file_name: str,
+    request: Request,
+    bucket_name: Optional[str] = None,
+    folder_path: str = "",
+    current_user: User = Depends(get_current_active_user)
+):
+    """Upload a raw request body to Supabase Storage as it arrives, without multipart buffering"""
+    content_length = request.headers.get("content-length")
+    try:
+        result = await get_supabase_storage_service().upload_stream(
+            request.stream(),
+            file_name=file_name,
+            content_type=request.headers.get("content-type", "application/octet-stream"),
+            size=int(content_length) if content_length else None,
+            bucket_name=bucket_name,
+            folder_path=folder_path,
+            user_id=str(current_user.id)
+        )
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Upload failed: {str(e)}"
+        )
+
+
 @router.get("/files")
 async def list_files(
     bucket_name: Optional[str] = None,
@@ -59,6 +90,20 @@ async def list_files(
         )
 
 
+@router.post("/files/sign")
+async def sign_file_urls(
+    request: SignURLsRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Get signed URLs for many files in one call"""
+    urls = await get_supabase_storage_service().get_signed_urls(
+        file_paths=request.paths,
+        bucket_name=request.bucket_name,
+        expires_in=request.expires_in
+    )
+    return {"urls": urls}
+
+
 @router.get("/files/{file_path:path}")
 async def get_file_url(
     file_path: str,
@@ -66,14 +111,13 @@ async def get_file_url(
     expires_in: int = 3600,
     current_user: User = Depends(get_current_active_user)
 ):
-    """Get a signed URL for file access"""
+    """Get a signed URL for file access; expires_in in the response is the URL's remaining lifetime"""
     try:
-        url = await get_supabase_storage_service().get_file_url(
+        return await get_supabase_storage_service().get_signed_url(
             file_path=file_path,
             bucket_name=bucket_name,
             expires_in=expires_in
         )
-        return {"url": url, "expires_in": expires_in}
     except HTTPException:
         raise
     except Exception as e:
@@ -110,14 +154,16 @@ async def move_file(
     from_path: str = Form(...),
     to_path: str = Form(...),
     bucket_name: Optional[str] = Form(None),
+    destination_bucket: Optional[str] = Form(None),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Move a file within the same bucket"""
+    """Move a file within a bucket or to another bucket"""
     try:
         result = await get_supabase_storage_service().move_file(
             from_path=from_path,
             to_path=to_path,
-            bucket_name=bucket_name
+            bucket_name=bucket_name,
+            destination_bucket=destination_bucket
         )
         return result
     except HTTPException:
@@ -129,6 +175,62 @@ async def move_file(
         )
 
 
+@router.post("/copy")
+async def copy_file(
+    from_path: str = Form(...),
+    to_path: str = Form(...),
+    bucket_name: Optional[str] = Form(None),
+    destination_bucket: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Copy a file within a bucket or to another bucket"""
+    try:
+        result = await get_supabase_storage_service().copy_file(
+            from_path=from_path,
+            to_path=to_path,
+            bucket_name=bucket_name,
+            destination_bucket=destination_bucket
+        )
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to copy file: {str(e)}"
+        )
+
+
+@router.post("/move/batch")
+async def move_files_batch(
+    batch: BatchRelocationRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Move many files concurrently; each file reports its own result"""
+    results = await get_supabase_storage_service().relocate_files(
+        "move",
+        [item.dict() for item in batch.files],
+        bucket_name=batch.bucket_name,
+        destination_bucket=batch.destination_bucket
+    )
+    return {"results": results, "failed": sum(1 for result in results if not result["success"])}
+
+
+@router.post("/copy/batch")
+async def copy_files_batch(
+    batch: BatchRelocationRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Copy many files concurrently; each file reports its own result"""
+    results = await get_supabase_storage_service().relocate_files(
+        "copy",
+        [item.dict() for item in batch.files],
+        bucket_name=batch.bucket_name,
+        destination_bucket=batch.destination_bucket
+    )
+    return {"results": results, "failed": sum(1 for result in results if not result["success"])}
+
+
 @router.get("/buckets/{bucket_name}")
 async def get_bucket_info(
     bucket_name: str,
@@ -1,2 +1,3 @@
 from .user import *
-from .usage import * 
\ No newline at end of file
+from .usage import *
+from .storage import *
\ No newline at end of file
@@ -0,0 +1,42 @@
+from pydantic import BaseModel, validator
+from typing import Optional, List
+
+
+# Storage schemas
+class FileRelocation(BaseModel):
+    from_path: str
+    to_path: str
+
+
+class BatchRelocationRequest(BaseModel):
+    files: List[FileRelocation]
+    bucket_name: Optional[str] = None
+    destination_bucket: Optional[str] = None
+
+    @validator('files')
+    def validate_files(cls, v):
+        if not v:
+            raise ValueError('At least one file is required')
+        if len(v) > 1000:
+            raise ValueError('At most 1000 files can be relocated per request')
+        return v
+
+
+class SignURLsRequest(BaseModel):
+    paths: List[str]
+    bucket_name: Optional[str] = None
+    expires_in: int = 3600
+
+    @validator('paths')
+    def validate_paths(cls, v):
+        if not v:
+            raise ValueError('At least one path is required')
+        if len(v) > 1000:
+            raise ValueError('At most 1000 paths can be signed per request')
+        return v
+
+    @validator('expires_in')
+    def validate_expires_in(cls, v):
+        if v <= 0:
+            raise ValueError('expires_in must be positive')
+        return v
@@ -120,6 +120,29 @@ class BudgetStatus(BaseModel):
     alerts_enabled: bool
 
 
+class CacheStats(BaseModel):
+    total_requests: int
+    cacheable_requests: int
+    cache_hits: int
+    hit_ratio: float  # hits / cacheable requests
+    coalesced_requests: int  # served by another identical request's upstream call
+    saved_cost: float
+    saved_tokens: int
+    period_start: datetime
+    period_end: datetime
+
+
+class RetryStats(BaseModel):
+    total_requests: int
+    retried_requests: int
+    retry_attempts: int  # extra upstream calls beyond the first
+    retry_rate: float  # retried / total requests
+    hedged_requests: int
+    retry_wait_ms: int  # time spent backing off between attempts
+    period_start: datetime
+    period_end: datetime
+
+
 # Recommendation schemas
 class Recommendation(BaseModel):
     type: str  # cost_saving, performance, security, etc.
@@ -164,6 +187,8 @@ class ModelPricingUpdate(BaseModel):
     max_tokens: Optional[int] = None
     supports_streaming: Optional[bool] = None
     is_active: Optional[bool] = None
+    effective_date: Optional[datetime] = None
+    deprecated_date: Optional[datetime] = None
 
 
 class ModelPricing(ModelPricingBase):
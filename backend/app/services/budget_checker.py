@@ -1,67 +1,197 @@
-from datetime import datetime, timedelta
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
 from typing import Dict, Optional, List
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 
 from app.models.usage import UsageLog, BudgetSetting
 from app.models.user import User
 from app.services.email_service import EmailService
+from app.services.spend_counters import (
+    get_spend_counters, get_period_boundaries, sum_spend_from_database
+)
+from app.services.redis_spend_counters import get_redis_spend_counters
+from app.core.redis import RedisError
+
+# How long a user's active budget settings are reused before re-reading them
+BUDGET_SETTINGS_CACHE_TTL = float(os.getenv("BUDGET_SETTINGS_CACHE_TTL", "60"))
+
+# user_id -> (loaded_at, [BudgetLimit])
+_budget_settings_cache: Dict[object, tuple] = {}
+
+
+@dataclass(frozen=True)
+class BudgetLimit:
+    """Session-independent copy of an active BudgetSetting"""
+    period_type: str
+    limit_amount: float
+    alert_threshold: float
+    enable_alerts: bool
+    enable_auto_cutoff: bool
+
+    @classmethod
+    def from_model(cls, budget: BudgetSetting) -> "BudgetLimit":
+        return cls(
+            period_type=budget.period_type,
+            limit_amount=budget.limit_amount,
+            alert_threshold=budget.alert_threshold,
+            enable_alerts=budget.enable_alerts,
+            enable_auto_cutoff=budget.enable_auto_cutoff
+        )
+
+
+def invalidate_budget_settings(user_id=None):
+    """Forget cached budget settings for one user, or all users"""
+    if user_id is None:
+        _budget_settings_cache.clear()
+    else:
+        _budget_settings_cache.pop(user_id, None)
+
+
+async def invalidate_budget_state(user_id):
+    """Forget a user's cached budget settings and lift any published cutoff flag"""
+    invalidate_budget_settings(user_id)
+    
+    redis_counters = get_redis_spend_counters()
+    if redis_counters is not None:
+        try:
+            await redis_counters.clear_cutoff(user_id)
+        except RedisError as e:
+            print(f"Warning: Failed to clear budget cutoff flag in Redis: {e}")
+
+
+async def invalidate_spend(user_id):
+    """Drop a user's spend counters so the next check reseeds them from usage_logs, e.g. after a repricing"""
+    redis_counters = get_redis_spend_counters()
+    if redis_counters is None:
+        get_spend_counters().invalidate(user_id)
+    else:
+        try:
+            await redis_counters.reset(user_id)
+        except RedisError as e:
+            print(f"Warning: Failed to reset spend counters in Redis: {e}")
+    
+    await invalidate_budget_state(user_id)
+
+
+async def record_spend(user_id, cost: float, created_at: Optional[datetime] = None):
+    """Add a logged request's cost to the active spend counter backend"""
+    redis_counters = get_redis_spend_counters()
+    if redis_counters is None:
+        get_spend_counters().record(user_id, cost, created_at)
+        return
+    
+    if not cost:
+        return
+    
+    # Pass auto-cutoff limits along so crossing one publishes the cutoff flag
+    cached = _budget_settings_cache.get(user_id)
+    cutoff_limits = {
+        budget.period_type: budget.limit_amount
+        for budget in (cached[1] if cached else [])
+        if budget.enable_auto_cutoff
+    }
+    
+    try:
+        await redis_counters.record(user_id, cost, created_at, cutoff_limits)
+    except RedisError as e:
+        print(f"Warning: Failed to record spend in Redis: {e}")
 
 
 class BudgetChecker:
     """Check and enforce budget limits"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
         self.email_service = EmailService()
 
     def get_period_boundaries(self, period_type: str) -> tuple[datetime, datetime]:
         """Get start and end dates for the current period"""
-        now = datetime.utcnow()
-        
-        if period_type == "daily":
-            start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            end = start + timedelta(days=1)
-        elif period_type == "weekly":
-            # Start of week (Monday)
-            days_since_monday = now.weekday()
-            start = (now - timedelta(days=days_since_monday)).replace(hour=0, minute=0, second=0, microsecond=0)
-            end = start + timedelta(weeks=1)
-        elif period_type == "monthly":
-            start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            # Next month's first day
-            if now.month == 12:
-                end = start.replace(year=now.year + 1, month=1)
-            else:
-                end = start.replace(month=now.month + 1)
-        else:
-            raise ValueError(f"Unsupported period type: {period_type}")
-        
-        return start, end
+        return get_period_boundaries(period_type)
 
     async def get_current_spend(self, user_id: int, period_type: str) -> float:
         """Get current spending for the specified period"""
-        start_date, end_date = self.get_period_boundaries(period_type)
+        redis_counters = get_redis_spend_counters()
+        if redis_counters is not None:
+            try:
+                _, spends = await redis_counters.snapshot(user_id, [period_type])
+                if spends[period_type] is not None:
+                    return spends[period_type]
+                return await self._seed_redis_counter(redis_counters, user_id, period_type)
+            except RedisError as e:
+                print(f"Warning: Redis unavailable for budget counters, using SQL: {e}")
+                return await sum_spend_from_database(self.db, user_id, period_type)
         
-        total_cost = self.db.query(func.sum(UsageLog.cost)).filter(
-            and_(
-                UsageLog.user_id == user_id,
-                UsageLog.created_at >= start_date,
-                UsageLog.created_at < end_date
-            )
-        ).scalar()
+        spend_counters = get_spend_counters()
+        
+        current_spend = spend_counters.get(user_id, period_type)
+        if current_spend is None:
+            # Cache miss or a new period: seed the counter from the database once
+            current_spend = await spend_counters.load_from_database(self.db, user_id, period_type)
         
-        return total_cost or 0.0
+        return current_spend
 
-    async def get_user_budget_settings(self, user_id: int) -> List[BudgetSetting]:
+    async def _seed_redis_counter(self, redis_counters, user_id: int, period_type: str) -> float:
+        """Seed a shared counter from the database; another worker may win the race.
+
+        Only committed rows are summed: buffered usage from every worker is already in Redis.
+        """
+        committed = await sum_spend_from_database(self.db, user_id, period_type, include_pending=False)
+        return await redis_counters.seed(user_id, period_type, committed)
+
+    async def _get_spends_for_check(self, user_id: int, period_types: List[str]) -> Dict[str, float]:
+        """Current spend per period; with Redis this is one MGET that also reads the cutoff flag"""
+        redis_counters = get_redis_spend_counters()
+        if redis_counters is None:
+            return {
+                period_type: await self.get_current_spend(user_id, period_type)
+                for period_type in period_types
+            }
+        
+        try:
+            cutoff, spends = await redis_counters.snapshot(user_id, period_types)
+            
+            if cutoff is not None:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Budget limit exceeded for {cutoff['period_type']} period. "
+                           f"Spent ${cutoff['current_spend']:.2f} of ${cutoff['limit_amount']:.2f} limit."
+                )
+            
+            for period_type, spend in spends.items():
+                if spend is None:
+                    spends[period_type] = await self._seed_redis_counter(redis_counters, user_id, period_type)
+            
+            return spends
+        except RedisError as e:
+            print(f"Warning: Redis unavailable for budget counters, using SQL: {e}")
+            return {
+                period_type: await sum_spend_from_database(self.db, user_id, period_type)
+                for period_type in period_types
+            }
+
+    async def get_user_budget_settings(self, user_id: int) -> List[BudgetLimit]:
         """Get all active budget settings for a user"""
-        return self.db.query(BudgetSetting).filter(
-            and_(
-                BudgetSetting.user_id == user_id,
-                BudgetSetting.is_active == True
+        cached = _budget_settings_cache.get(user_id)
+        if cached and time.monotonic() - cached[0] < BUDGET_SETTINGS_CACHE_TTL:
+            return cached[1]
+        
+        result = await self.db.execute(
+            select(BudgetSetting).where(
+                and_(
+                    BudgetSetting.user_id == user_id,
+                    BudgetSetting.is_active == True
+                )
             )
-        ).all()
+        )
+        budget_settings = result.scalars().all()
+        
+        budget_limits = [BudgetLimit.from_model(budget) for budget in budget_settings]
+        _budget_settings_cache[user_id] = (time.monotonic(), budget_limits)
+        return budget_limits
 
     async def check_budget_limits(self, user_id: int) -> Dict[str, any]:
         """Check if user is within budget limits"""
@@ -71,9 +201,12 @@ class BudgetChecker:
             return {"status": "no_budget_set"}
         
         results = []
+        spends = await self._get_spends_for_check(
+            user_id, [budget.period_type for budget in budget_settings]
+        )
         
         for budget in budget_settings:
-            current_spend = await self.get_current_spend(user_id, budget.period_type)
+            current_spend = spends[budget.period_type]
             percentage_used = (current_spend / budget.limit_amount) * 100 if budget.limit_amount > 0 else 0
             
             budget_status = {
@@ -90,6 +223,7 @@ class BudgetChecker:
                 budget_status["status"] = "over_budget"
                 
                 if budget.enable_auto_cutoff:
+                    await self._publish_cutoff(user_id, budget, current_spend)
                     raise HTTPException(
                         status_code=429,
                         detail=f"Budget limit exceeded for {budget.period_type} period. "
@@ -114,9 +248,19 @@ class BudgetChecker:
         
         return {"status": "checked", "budgets": results}
 
+    async def _publish_cutoff(self, user_id: int, budget: BudgetLimit, current_spend: float):
+        """Let other workers reject the user's requests with a single GET"""
+        redis_counters = get_redis_spend_counters()
+        if redis_counters is None:
+            return
+        try:
+            await redis_counters.set_cutoff(user_id, budget.period_type, current_spend, budget.limit_amount)
+        except RedisError as e:
+            print(f"Warning: Failed to publish budget cutoff flag to Redis: {e}")
+
     async def _send_budget_alert(self, user_id: int, budget_status: Dict, alert_type: str):
         """Send budget alert email"""
-        user = self.db.query(User).filter(User.id == user_id).first()
+        user = await self.db.get(User, user_id)
         if not user:
             return
         
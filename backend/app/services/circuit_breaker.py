@@ -0,0 +1,183 @@
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+from app.core.metrics import increment_counter, set_gauge
+
+load_dotenv()
+
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+# Outcomes older than this many seconds drop out of the error and slow-call rates
+CIRCUIT_BREAKER_WINDOW = float(os.getenv("CIRCUIT_BREAKER_WINDOW", "60"))
+# Calls needed in the window before the breaker may trip
+CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "20"))
+CIRCUIT_BREAKER_ERROR_RATE = float(os.getenv("CIRCUIT_BREAKER_ERROR_RATE", "0.5"))
+# A call answering slower than this counts as slow; too many slow calls also trip the breaker
+CIRCUIT_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_BREAKER_SLOW_CALL_SECONDS", "60"))
+CIRCUIT_BREAKER_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_BREAKER_SLOW_CALL_RATE", "0.8"))
+# Seconds an open breaker fails fast before letting probe calls through
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "30"))
+# Probe calls allowed while half-open; all must succeed to close the breaker again
+CIRCUIT_BREAKER_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_CALLS", "3"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Gauge values for the state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Upstream answers that say the provider itself is unhealthy (429s are per-key rate limits)
+FAILURE_STATUS_CODES = {500, 502, 503, 504, 529}
+
+
+def is_failure_status(status_code: int) -> bool:
+    return status_code in FAILURE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one provider, driven by rolling error and slow-call rates"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        # Bumped on every half-open period so late probe results from an earlier one are ignored
+        self.generation = 0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        # (finished_at, failed, slow), oldest first
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+        self._publish()
+
+    def allow(self) -> Optional[int]:
+        """Admit a call or raise 503; returns the probe generation for half-open probe calls"""
+        if not CIRCUIT_BREAKER_ENABLED:
+            return None
+        if self.state == OPEN:
+            remaining = self.opened_at + CIRCUIT_BREAKER_OPEN_SECONDS - time.monotonic()
+            if remaining > 0:
+                self._reject(remaining)
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= CIRCUIT_BREAKER_HALF_OPEN_CALLS:
+                self._reject(1)
+            self._probes_in_flight += 1
+            return self.generation
+        return None
+
+    def record(self, probe: Optional[int], failed: bool, seconds: float = 0.0):
+        """Count a finished call; failed covers transport errors and FAILURE_STATUS_CODES"""
+        slow = seconds >= CIRCUIT_BREAKER_SLOW_CALL_SECONDS
+        increment_counter(f"circuit.{self.provider}.calls")
+        if failed:
+            increment_counter(f"circuit.{self.provider}.failures")
+        if slow:
+            increment_counter(f"circuit.{self.provider}.slow_calls")
+
+        if not CIRCUIT_BREAKER_ENABLED:
+            return
+        if probe is not None:
+            if probe != self.generation or self.state != HALF_OPEN:
+                return
+            self._probes_in_flight -= 1
+            if failed or slow:
+                self._transition(OPEN)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= CIRCUIT_BREAKER_HALF_OPEN_CALLS:
+                self._transition(CLOSED)
+            return
+
+        if self.state != CLOSED:
+            # Started before the breaker opened; says nothing new
+            return
+        now = time.monotonic()
+        self._outcomes.append((now, failed, slow))
+        self._prune(now)
+        calls, failures, slow_calls = self._rates()
+        if calls >= CIRCUIT_BREAKER_MIN_CALLS and (
+            failures / calls >= CIRCUIT_BREAKER_ERROR_RATE
+            or slow_calls / calls >= CIRCUIT_BREAKER_SLOW_CALL_RATE
+        ):
+            self._transition(OPEN)
+
+    def abandon(self, probe: Optional[int]):
+        """A call that was cancelled before it finished, e.g. a hedge loser or a client disconnect"""
+        if probe is not None and probe == self.generation and self.state == HALF_OPEN:
+            self._probes_in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune(time.monotonic())
+        calls, failures, slow_calls = self._rates()
+        stats = {
+            "state": self.state,
+            "calls": calls,
+            "error_rate": failures / calls if calls else 0.0,
+            "slow_call_rate": slow_calls / calls if calls else 0.0,
+            "trips": self.trips,
+            "rejected": self.rejected
+        }
+        if self.state == OPEN:
+            stats["retry_in_seconds"] = max(
+                round(self.opened_at + CIRCUIT_BREAKER_OPEN_SECONDS - time.monotonic(), 1), 0.0
+            )
+        return stats
+
+    def _reject(self, retry_after: float):
+        self.rejected += 1
+        increment_counter(f"circuit.{self.provider}.rejected")
+        raise HTTPException(
+            status_code=503,
+            detail=f"{self.provider} is failing; requests are paused while its circuit breaker is {self.state.replace('_', '-')}",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def _transition(self, state: str):
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            increment_counter(f"circuit.{self.provider}.trips")
+            print(f"Warning: Circuit breaker for {self.provider} opened")
+        elif state == HALF_OPEN:
+            self.generation += 1
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        else:
+            self._outcomes.clear()
+        self.state = state
+        self._publish()
+
+    def _publish(self):
+        set_gauge(f"circuit.{self.provider}.state", STATE_VALUES[self.state])
+
+    def _prune(self, now: float):
+        while self._outcomes and self._outcomes[0][0] < now - CIRCUIT_BREAKER_WINDOW:
+            self._outcomes.popleft()
+
+    def _rates(self) -> Tuple[int, int, int]:
+        calls = len(self._outcomes)
+        failures = sum(1 for _, failed, _ in self._outcomes if failed)
+        slow_calls = sum(1 for _, _, slow in self._outcomes if slow)
+        return calls, failures, slow_calls
+
+
+# Global instances - lazy initialization
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    breaker = _circuit_breakers.get(provider)
+    if breaker is None:
+        breaker = _circuit_breakers[provider] = CircuitBreaker(provider)
+    return breaker
+
+
+def get_circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    return {provider: breaker.stats() for provider, breaker in sorted(_circuit_breakers.items())}
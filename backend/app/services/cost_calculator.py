@@ -1,81 +1,184 @@
 import os
-from typing import Dict, Optional
-from sqlalchemy.orm import Session
+import time
+import bisect
+from datetime import date, datetime, timezone
+from typing import Dict, Optional, Tuple, List, Any
+from sqlalchemy import select, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.pricing import ModelPricing
+from app.models.usage import UsageLog
+from app.services.usage_rollup import invalidate_rollup_days
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+# Fallback pricing from environment variables, read once at import
+FALLBACK_PRICING = {
+    "openai": {
+        "gpt-4": {
+            "prompt": float(os.getenv("GPT_4_PRICE_PER_1K_PROMPT_TOKENS", "0.03")),
+            "completion": float(os.getenv("GPT_4_PRICE_PER_1K_COMPLETION_TOKENS", "0.06"))
+        },
+        "gpt-4-turbo": {
+            "prompt": 0.01,
+            "completion": 0.03
+        },
+        "gpt-3.5-turbo": {
+            "prompt": float(os.getenv("GPT_3_5_TURBO_PRICE_PER_1K_PROMPT_TOKENS", "0.0015")),
+            "completion": float(os.getenv("GPT_3_5_TURBO_PRICE_PER_1K_COMPLETION_TOKENS", "0.002"))
+        },
+        "gpt-3.5-turbo-16k": {
+            "prompt": 0.003,
+            "completion": 0.004
+        }
+    },
+    "anthropic": {
+        "claude-3-opus-20240229": {
+            "prompt": float(os.getenv("CLAUDE_3_OPUS_PRICE_PER_1K_PROMPT_TOKENS", "0.015")),
+            "completion": float(os.getenv("CLAUDE_3_OPUS_PRICE_PER_1K_COMPLETION_TOKENS", "0.075"))
+        },
+        "claude-3-sonnet-20240229": {
+            "prompt": 0.003,
+            "completion": 0.015
+        },
+        "claude-3-haiku-20240307": {
+            "prompt": 0.00025,
+            "completion": 0.00125
+        }
+    }
+}
+
+# Seconds before the process-wide pricing table is re-read from model_pricing
+PRICING_CACHE_TTL = float(os.getenv("PRICING_CACHE_TTL", "300"))
+
+# (provider, model_name) -> PricingVersions
+_pricing_table: Dict[Tuple[str, str], "PricingVersions"] = {}
+_pricing_loaded_at: Optional[float] = None
+
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Usage timestamps are naive UTC; normalize timezone-aware pricing dates to match"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class PricingVersions:
+    """Interval index over the pricing versions of one (provider, model).
+
+    Versions are sorted by the start of their window (effective_date, or the beginning
+    of time when unset). A version is in force from its start until its deprecated_date
+    or the next version's start, whichever comes first, so a lookup is one bisect.
+    """
+
+    def __init__(self):
+        self.starts: List[datetime] = []
+        self.versions: List[Dict[str, Any]] = []
+
+    def add(self, pricing: ModelPricing):
+        start = to_naive_utc(pricing.effective_date) or datetime.min
+        version = {
+            "prompt": pricing.prompt_price_per_1k_tokens,
+            "completion": pricing.completion_price_per_1k_tokens,
+            "effective_date": start,
+            "deprecated_date": to_naive_utc(pricing.deprecated_date)
+        }
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.versions.insert(index, version)
+
+    def at(self, when: datetime) -> Optional[Dict[str, float]]:
+        """Pricing in force at `when`, or None if no version covers it"""
+        when = to_naive_utc(when)
+        index = bisect.bisect_right(self.starts, when) - 1
+        if index < 0:
+            return None
+
+        version = self.versions[index]
+        if version["deprecated_date"] is not None and when >= version["deprecated_date"]:
+            return None
+
+        return {"prompt": version["prompt"], "completion": version["completion"]}
+
+    def history(self) -> List[Dict[str, Any]]:
+        """All versions, oldest first (effective_date is None for a version with no start)"""
+        return [
+            {
+                **version,
+                "effective_date": version["effective_date"] if version["effective_date"] != datetime.min else None
+            }
+            for version in self.versions
+        ]
+
+
+def invalidate_pricing_cache():
+    """Force the next pricing lookup to reload model_pricing"""
+    global _pricing_loaded_at
+    _pricing_loaded_at = None
+
+
+async def _load_pricing_table(db: AsyncSession) -> Dict[Tuple[str, str], PricingVersions]:
+    """Get the pricing index, reloading model_pricing once the TTL has passed"""
+    global _pricing_table, _pricing_loaded_at
+    
+    if _pricing_loaded_at is not None and time.monotonic() - _pricing_loaded_at < PRICING_CACHE_TTL:
+        return _pricing_table
+    
+    # Active rows plus retired versions that still describe a past pricing window
+    result = await db.execute(
+        select(ModelPricing).where(
+            or_(ModelPricing.is_active == True, ModelPricing.deprecated_date.isnot(None))
+        )
+    )
+    rows = result.scalars().all()
+    
+    pricing_table = {}
+    for pricing in rows:
+        pricing_table.setdefault((pricing.provider, pricing.model_name), PricingVersions()).add(pricing)
+    
+    _pricing_table = pricing_table
+    _pricing_loaded_at = time.monotonic()
+    return _pricing_table
+
+
 class CostCalculator:
     """Calculate costs for AI model usage"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        # Fallback pricing from environment variables
-        self.fallback_pricing = {
-            "openai": {
-                "gpt-4": {
-                    "prompt": float(os.getenv("GPT_4_PRICE_PER_1K_PROMPT_TOKENS", "0.03")),
-                    "completion": float(os.getenv("GPT_4_PRICE_PER_1K_COMPLETION_TOKENS", "0.06"))
-                },
-                "gpt-4-turbo": {
-                    "prompt": 0.01,
-                    "completion": 0.03
-                },
-                "gpt-3.5-turbo": {
-                    "prompt": float(os.getenv("GPT_3_5_TURBO_PRICE_PER_1K_PROMPT_TOKENS", "0.0015")),
-                    "completion": float(os.getenv("GPT_3_5_TURBO_PRICE_PER_1K_COMPLETION_TOKENS", "0.002"))
-                },
-                "gpt-3.5-turbo-16k": {
-                    "prompt": 0.003,
-                    "completion": 0.004
-                }
-            },
-            "anthropic": {
-                "claude-3-opus-20240229": {
-                    "prompt": float(os.getenv("CLAUDE_3_OPUS_PRICE_PER_1K_PROMPT_TOKENS", "0.015")),
-                    "completion": float(os.getenv("CLAUDE_3_OPUS_PRICE_PER_1K_COMPLETION_TOKENS", "0.075"))
-                },
-                "claude-3-sonnet-20240229": {
-                    "prompt": 0.003,
-                    "completion": 0.015
-                },
-                "claude-3-haiku-20240307": {
-                    "prompt": 0.00025,
-                    "completion": 0.00125
-                }
-            }
-        }
+        self.fallback_pricing = FALLBACK_PRICING
 
-    async def get_model_pricing(self, provider: str, model: str) -> Optional[Dict[str, float]]:
-        """Get pricing for a specific model from database or fallback"""
-        # First try to get from database
-        pricing = self.db.query(ModelPricing).filter(
-            ModelPricing.provider == provider,
-            ModelPricing.model_name == model,
-            ModelPricing.is_active == True
-        ).first()
+    async def get_model_pricing(
+        self, provider: str, model: str, at: Optional[datetime] = None
+    ) -> Optional[Dict[str, float]]:
+        """Get pricing for a model as of `at` (default now) from the cached pricing index or fallback"""
+        # First try the database pricing (cached process-wide)
+        versions = (await _load_pricing_table(self.db)).get((provider, model))
+        pricing = versions.at(at or datetime.utcnow()) if versions else None
         
         if pricing:
-            return {
-                "prompt": pricing.prompt_price_per_1k_tokens,
-                "completion": pricing.completion_price_per_1k_tokens
-            }
+            return pricing
         
         # Fallback to hardcoded pricing
         provider_pricing = self.fallback_pricing.get(provider, {})
         return provider_pricing.get(model)
 
+    async def get_pricing_history(self, provider: str, model: str) -> List[Dict[str, Any]]:
+        """Get every known pricing version for a model, oldest first"""
+        versions = (await _load_pricing_table(self.db)).get((provider, model))
+        return versions.history() if versions else []
+
     async def calculate_cost(
         self, 
         provider: str, 
         model: str, 
         prompt_tokens: int, 
-        completion_tokens: int
+        completion_tokens: int,
+        at: Optional[datetime] = None
     ) -> float:
-        """Calculate cost for API usage"""
-        pricing = await self.get_model_pricing(provider, model)
+        """Calculate cost for API usage at the price in force at `at` (default now)"""
+        pricing = await self.get_model_pricing(provider, model, at)
         
         if not pricing:
             # If no pricing found, return 0 and log a warning
@@ -89,6 +192,52 @@ class CostCalculator:
         total_cost = prompt_cost + completion_cost
         return round(total_cost, 6)  # Round to 6 decimal places
 
+    async def recalculate_usage_costs(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        user_id=None
+    ) -> Dict[Any, List[date]]:
+        """Reprice usage logs in a window at the prices in force when each request was made.
+
+        Returns the days whose costs changed, per user. Their rollups are dropped so they
+        are rebuilt on next read; callers still have to reset the users' budget state.
+        """
+        query = select(
+            UsageLog.id, UsageLog.user_id, UsageLog.provider, UsageLog.model,
+            UsageLog.prompt_tokens, UsageLog.completion_tokens,
+            UsageLog.cost, UsageLog.created_at
+        ).where(
+            UsageLog.created_at >= start_date,
+            UsageLog.created_at < end_date
+        )
+        if user_id is not None:
+            query = query.where(UsageLog.user_id == user_id)
+        
+        updates = []
+        changed_days: Dict[Any, set] = {}
+        for row in (await self.db.execute(query)).all():
+            # Leave rows alone when no price is known rather than zeroing them
+            if not await self.get_model_pricing(row.provider, row.model, row.created_at):
+                continue
+            
+            cost = await self.calculate_cost(
+                row.provider, row.model,
+                row.prompt_tokens or 0, row.completion_tokens or 0,
+                at=row.created_at
+            )
+            if cost != row.cost:
+                updates.append({"id": row.id, "cost": cost})
+                changed_days.setdefault(row.user_id, set()).add(row.created_at.date())
+        
+        if updates:
+            await self.db.execute(update(UsageLog), updates)
+            await self.db.commit()
+            # Repriced days have to be rolled up again
+            await invalidate_rollup_days(self.db, changed_days)
+        
+        return {user: sorted(days) for user, days in changed_days.items()}
+
     async def estimate_cost(
         self, 
         provider: str, 
@@ -111,12 +260,12 @@ class CostCalculator:
 
     async def get_model_list(self, provider: Optional[str] = None) -> Dict[str, Dict]:
         """Get list of available models and their pricing"""
-        query = self.db.query(ModelPricing).filter(ModelPricing.is_active == True)
+        query = select(ModelPricing).where(ModelPricing.is_active == True)
         
         if provider:
-            query = query.filter(ModelPricing.provider == provider)
+            query = query.where(ModelPricing.provider == provider)
         
-        db_models = query.all()
+        db_models = (await self.db.execute(query)).scalars().all()
         
         # Convert to dict format
         models = {}
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from app.core.database import SessionLocal, AsyncSessionLocal
+from app.services.usage_rollup import finalize_day
+
+load_dotenv()
+
+# Monthly partitions to keep created ahead of the current month
+PARTITIONS_AHEAD = int(os.getenv("USAGE_LOG_PARTITIONS_AHEAD", "3"))
+# Months of raw usage logs to keep; 0 keeps every partition
+RETENTION_MONTHS = int(os.getenv("USAGE_LOG_RETENTION_MONTHS", "0"))
+# "detach" leaves expired partitions as standalone tables for archiving, "drop" deletes them
+EXPIRY_ACTION = os.getenv("USAGE_LOG_PARTITION_EXPIRY", "detach")
+# How often the background job runs maintenance
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("USAGE_LOG_PARTITION_INTERVAL_SECONDS", "86400"))
+
+PARENT_TABLE = "usage_logs"
+PARTITION_NAME = re.compile(r"^usage_logs_y(\d{4})m(\d{2})$")
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(start: datetime, months: int) -> datetime:
+    index = start.year * 12 + (start.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PARENT_TABLE}_y{start.year:04d}m{start.month:02d}"
+
+
+def is_partitioned(db: Session) -> bool:
+    """True on PostgreSQL once the partitioning migration has run; SQLite never is"""
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"
+    ), {"table": PARENT_TABLE}).scalar() is not None
+
+
+def list_partitions(db: Session) -> Dict[str, datetime]:
+    """Monthly partitions attached to usage_logs, name -> month start (the default partition is skipped)"""
+    rows = db.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": PARENT_TABLE}).scalars()
+
+    partitions = {}
+    for name in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+def create_future_partitions(db: Session, now: Optional[datetime] = None) -> List[str]:
+    """Create this month's partition and the next PARTITIONS_AHEAD ones if they are missing"""
+    current = month_start(now or datetime.utcnow())
+    existing = list_partitions(db)
+
+    created = []
+    for offset in range(PARTITIONS_AHEAD + 1):
+        start = add_months(current, offset)
+        name = partition_name(start)
+        if name in existing:
+            continue
+
+        try:
+            db.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} "
+                f"FOR VALUES FROM ('{start.isoformat()}+00') TO ('{add_months(start, 1).isoformat()}+00')"
+            ))
+            db.commit()
+            created.append(name)
+        except Exception as e:
+            # Usually rows for this month already landed in the default partition
+            db.rollback()
+            print(f"Warning: Failed to create partition {name}: {e}")
+
+    return created
+
+
+def expired_partitions(db: Session, now: Optional[datetime] = None) -> Dict[str, datetime]:
+    """Partitions that ended more than RETENTION_MONTHS ago, oldest first"""
+    if RETENTION_MONTHS <= 0:
+        return {}
+
+    cutoff = add_months(month_start(now or datetime.utcnow()), -RETENTION_MONTHS)
+    return {
+        name: start
+        for name, start in sorted(list_partitions(db).items(), key=lambda item: item[1])
+        if add_months(start, 1) <= cutoff
+    }
+
+
+def expire_partitions(db: Session, names: List[str]) -> List[str]:
+    """Detach or drop the given partitions"""
+    expired = []
+    for name in names:
+        db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+        if EXPIRY_ACTION == "drop":
+            db.execute(text(f"DROP TABLE {name}"))
+        db.commit()
+        expired.append(name)
+
+    return expired
+
+
+async def finalize_partition_days(start: datetime):
+    """Roll up every day in a partition's month, so its summaries outlive the raw rows"""
+    end = add_months(start, 1)
+    async with AsyncSessionLocal() as db:
+        day = start
+        while day < end:
+            await finalize_day(db, day.date())
+            day += timedelta(days=1)
+
+
+def _prepare_maintenance(now: Optional[datetime]) -> Optional[Tuple[List[str], Dict[str, datetime]]]:
+    db = SessionLocal()
+    try:
+        if not is_partitioned(db):
+            return None
+        return create_future_partitions(db, now), expired_partitions(db, now)
+    finally:
+        db.close()
+
+
+def _expire(names: List[str]) -> List[str]:
+    db = SessionLocal()
+    try:
+        return expire_partitions(db, names)
+    finally:
+        db.close()
+
+
+async def run_partition_maintenance(now: Optional[datetime] = None) -> Dict[str, List[str]]:
+    """Create upcoming partitions and expire old ones once their days are rolled up; a no-op
+    unless usage_logs is partitioned"""
+    prepared = await asyncio.to_thread(_prepare_maintenance, now)
+    if prepared is None:
+        return {"created": [], "expired": []}
+    created, expiring = prepared
+
+    finalized = []
+    for name, start in expiring.items():
+        try:
+            await finalize_partition_days(start)
+            finalized.append(name)
+        except Exception as e:
+            # Without its rollups the month would vanish from analytics, so keep the raw rows
+            print(f"Warning: Keeping partition {name}; rolling up its days failed: {e}")
+
+    expired = await asyncio.to_thread(_expire, finalized) if finalized else []
+    return {"created": created, "expired": expired}
+
+
+async def run_partition_job():
+    """Background loop that keeps partitions ahead of the calendar"""
+    while True:
+        try:
+            await run_partition_maintenance()
+        except Exception as e:
+            print(f"Warning: Usage log partition maintenance failed: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
@@ -0,0 +1,80 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Seconds a decrypted provider key is reused before api_keys is read again; other workers
+# pick up key changes after at most this long
+PROVIDER_KEY_CACHE_TTL = float(os.getenv("PROVIDER_KEY_CACHE_TTL", "30"))
+PROVIDER_KEY_CACHE_SIZE = int(os.getenv("PROVIDER_KEY_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class ProviderCredential:
+    """A user's resolved provider key: the api_keys row id and the decrypted secret"""
+    id: object
+    api_key: str
+
+
+class ProviderKeyCache:
+    """Size-bounded TTL cache of decrypted provider keys per (user_id, provider).
+
+    Secrets are held in bytearrays that are zeroed when an entry expires, is evicted or is
+    invalidated. Callers get their own str copy, which Python cannot wipe.
+    """
+
+    def __init__(self, ttl: float = PROVIDER_KEY_CACHE_TTL, max_size: int = PROVIDER_KEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # (user_id, provider) -> (expires_at, api_key_id, secret), least recently used first
+        self._entries: "OrderedDict[Tuple[object, str], Tuple[float, object, bytearray]]" = OrderedDict()
+
+    def get(self, user_id, provider: str) -> Optional[ProviderCredential]:
+        key = (user_id, provider)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[0]:
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return ProviderCredential(id=entry[1], api_key=entry[2].decode())
+
+    def put(self, user_id, provider: str, api_key_id, api_key: str) -> ProviderCredential:
+        key = (user_id, provider)
+        self._evict(key)
+        self._entries[key] = (time.monotonic() + self.ttl, api_key_id, bytearray(api_key.encode()))
+        while len(self._entries) > self.max_size:
+            self._evict(next(iter(self._entries)))
+        return ProviderCredential(id=api_key_id, api_key=api_key)
+
+    def invalidate(self, user_id=None, provider: Optional[str] = None):
+        """Drop one user's key for a provider, all of a user's keys, or everything"""
+        for key in list(self._entries):
+            if user_id is not None and key[0] != user_id:
+                continue
+            if provider is not None and key[1] != provider:
+                continue
+            self._evict(key)
+
+    def _evict(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        secret = entry[2]
+        for index in range(len(secret)):
+            secret[index] = 0
+
+
+# Global instance - lazy initialization
+_provider_key_cache = None
+
+def get_provider_key_cache() -> ProviderKeyCache:
+    global _provider_key_cache
+    if _provider_key_cache is None:
+        _provider_key_cache = ProviderKeyCache()
+    return _provider_key_cache
@@ -0,0 +1,252 @@
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from app.core.redis import RedisError, get_redis_client, redis_key
+from app.services.spend_counters import PERIOD_TYPES, get_period_boundaries
+
+load_dotenv()
+
+# "memory" keeps counters per process; "redis" shares them across workers
+BUDGET_COUNTER_BACKEND = os.getenv("BUDGET_COUNTER_BACKEND", "memory")
+# The committed part of a counter expires after this many seconds and is reseeded from SQL,
+# which bounds any drift between Redis and usage_logs
+BUDGET_COUNTER_RECONCILE_SECONDS = int(os.getenv("BUDGET_COUNTER_RECONCILE_SECONDS", "300"))
+# After a Redis error, budget checks go straight to SQL for this long instead of timing out
+BUDGET_REDIS_BACKOFF_SECONDS = float(os.getenv("BUDGET_REDIS_BACKOFF_SECONDS", "5"))
+
+# Spend is stored as integer micro-dollars so increments are exact
+MICRO_DOLLARS = 1_000_000
+
+# Keep period counters a day past the period end for late writes
+COUNTER_TTL_MARGIN_SECONDS = 86400
+
+# A period's spend is committed + pending:
+#   committed - SUM(cost) in usage_logs, seeded with SET NX and moved forward on every flush
+#   pending   - cost recorded by any worker but not yet flushed to usage_logs
+# so usage buffered by other workers is counted even before it reaches SQL.
+
+# Add the cost to every period's pending counter and publish the cutoff flag when a seeded
+# period crosses an auto-cutoff limit.
+# KEYS: (committed, pending) per period, then the cutoff flag key
+# ARGV: cost, then per period: limit (-1 for none), flag ttl ms, period type, counter ttl s
+RECORD_SPEND_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local flag_key = KEYS[#KEYS]
+for i = 1, (#KEYS - 1) / 2 do
+    local base = 1 + (i - 1) * 4
+    local pending = redis.call('INCRBY', KEYS[2 * i], cost)
+    redis.call('EXPIRE', KEYS[2 * i], ARGV[base + 4])
+    local committed = redis.call('GET', KEYS[2 * i - 1])
+    if committed then
+        local total = tonumber(committed) + pending
+        local limit = tonumber(ARGV[base + 1])
+        if limit >= 0 and total >= limit then
+            redis.call('SET', flag_key, ARGV[base + 3] .. ':' .. total .. ':' .. limit, 'PX', ARGV[base + 2])
+        end
+    end
+end
+return 1
+"""
+
+# Move flushed cost from pending to committed. Pending never goes below zero, so cost whose
+# record step was missed (Redis was down) errs towards counting spend twice, not never.
+# KEYS: (committed, pending) per counter
+# ARGV: amount per counter
+COMMIT_SPEND_SCRIPT = """
+for i = 1, #KEYS / 2 do
+    local amount = tonumber(ARGV[i])
+    local pending = tonumber(redis.call('GET', KEYS[2 * i]) or '0')
+    local settled = math.min(amount, math.max(pending, 0))
+    if settled > 0 then
+        redis.call('DECRBY', KEYS[2 * i], settled)
+    end
+    if redis.call('EXISTS', KEYS[2 * i - 1]) == 1 then
+        redis.call('INCRBY', KEYS[2 * i - 1], amount)
+    end
+end
+return 1
+"""
+
+
+def to_micro_dollars(amount: float) -> int:
+    return int(round((amount or 0.0) * MICRO_DOLLARS))
+
+
+def from_micro_dollars(amount) -> float:
+    return int(amount) / MICRO_DOLLARS
+
+
+def counter_ttl(period_type: str, when: Optional[datetime] = None) -> int:
+    _, end = get_period_boundaries(period_type, when)
+    return max(int((end - datetime.utcnow()).total_seconds()), 0) + COUNTER_TTL_MARGIN_SECONDS
+
+
+class RedisSpendCounters:
+    """Per-period spend totals and auto-cutoff flags shared by all workers through Redis"""
+
+    def __init__(self, client):
+        self.client = client
+        self._record_script = client.register_script(RECORD_SPEND_SCRIPT)
+        self._commit_script = client.register_script(COMMIT_SPEND_SCRIPT)
+        # Monotonic time before which Redis is assumed down
+        self._retry_at = 0.0
+
+    @asynccontextmanager
+    async def _guard(self):
+        """Fail fast while backing off from a recent Redis error"""
+        if time.monotonic() < self._retry_at:
+            raise RedisError("Redis marked unavailable after a recent error")
+        try:
+            yield
+        except RedisError:
+            self._retry_at = time.monotonic() + BUDGET_REDIS_BACKOFF_SECONDS
+            raise
+
+    def spend_keys(self, user_id, period_type: str, now: Optional[datetime] = None) -> Tuple[str, str]:
+        """(committed, pending) keys for the period containing now"""
+        start, _ = get_period_boundaries(period_type, now)
+        period = start.strftime("%Y%m%d")
+        return (
+            redis_key("spend", user_id, period_type, period),
+            redis_key("spend_pending", user_id, period_type, period)
+        )
+
+    def cutoff_key(self, user_id) -> str:
+        return redis_key("budget_cutoff", user_id)
+
+    async def snapshot(
+        self, user_id, period_types: List[str]
+    ) -> Tuple[Optional[Dict[str, float]], Dict[str, Optional[float]]]:
+        """Read the cutoff flag and the period totals in one round-trip.
+
+        Returns (cutoff, spends) where cutoff is None unless the user is cut off and a
+        spend is None when its committed counter has not been seeded (or has expired).
+        """
+        keys = [self.cutoff_key(user_id)]
+        for period_type in period_types:
+            keys += self.spend_keys(user_id, period_type)
+        async with self._guard():
+            values = await self.client.mget(keys)
+
+        cutoff = None
+        if values[0]:
+            period_type, current_spend, limit_amount = values[0].split(":")
+            cutoff = {
+                "period_type": period_type,
+                "current_spend": from_micro_dollars(current_spend),
+                "limit_amount": from_micro_dollars(limit_amount)
+            }
+
+        spends = {}
+        for index, period_type in enumerate(period_types):
+            committed, pending = values[1 + 2 * index], values[2 + 2 * index]
+            spends[period_type] = (
+                from_micro_dollars(int(committed) + int(pending or 0)) if committed is not None else None
+            )
+        return cutoff, spends
+
+    async def seed(self, user_id, period_type: str, committed: float) -> float:
+        """Seed the committed counter from SQL unless another worker already has; returns the total"""
+        committed_key, pending_key = self.spend_keys(user_id, period_type)
+        ttl = min(BUDGET_COUNTER_RECONCILE_SECONDS, counter_ttl(period_type))
+
+        async with self._guard():
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.set(committed_key, to_micro_dollars(committed), nx=True, ex=ttl)
+                pipe.get(committed_key)
+                pipe.get(pending_key)
+                _, stored, pending = await pipe.execute()
+
+        return from_micro_dollars(int(stored) + int(pending or 0))
+
+    async def record(
+        self,
+        user_id,
+        cost: float,
+        created_at: Optional[datetime] = None,
+        cutoff_limits: Optional[Dict[str, float]] = None
+    ):
+        """Add a logged cost to the user's pending spend for every period.
+
+        cutoff_limits maps period_type -> limit for budgets with auto-cutoff enabled;
+        crossing one publishes the user's cutoff flag until the period ends.
+        """
+        created_at = created_at or datetime.utcnow()
+        cutoff_limits = cutoff_limits or {}
+
+        keys = []
+        args = [to_micro_dollars(cost)]
+        for period_type in PERIOD_TYPES:
+            _, end = get_period_boundaries(period_type, created_at)
+            keys += self.spend_keys(user_id, period_type, created_at)
+            limit = cutoff_limits.get(period_type)
+            args += [
+                to_micro_dollars(limit) if limit is not None else -1,
+                max(int((end - datetime.utcnow()).total_seconds() * 1000), 1),
+                period_type,
+                counter_ttl(period_type, created_at)
+            ]
+        keys.append(self.cutoff_key(user_id))
+
+        async with self._guard():
+            await self._record_script(keys=keys, args=args)
+
+    async def commit(self, records: Iterable[Dict[str, Any]]):
+        """Move flushed usage rows' cost from pending to committed (called after each flush)"""
+        amounts: Dict[Tuple[str, str], int] = {}
+        for record in records:
+            cost = to_micro_dollars(record.get("cost"))
+            if not cost:
+                continue
+            for period_type in PERIOD_TYPES:
+                keys = self.spend_keys(record["user_id"], period_type, record["created_at"])
+                amounts[keys] = amounts.get(keys, 0) + cost
+        if not amounts:
+            return
+
+        keys = [key for pair in amounts for key in pair]
+        async with self._guard():
+            await self._commit_script(keys=keys, args=list(amounts.values()))
+
+    async def reset(self, user_id):
+        """Drop the committed counters so the next check reseeds them from SQL"""
+        keys = [self.spend_keys(user_id, period_type)[0] for period_type in PERIOD_TYPES]
+        async with self._guard():
+            await self.client.delete(*keys)
+
+    async def set_cutoff(self, user_id, period_type: str, current_spend: float, limit_amount: float):
+        """Publish the cutoff flag after a check found the user over an auto-cutoff budget"""
+        _, end = get_period_boundaries(period_type)
+        value = f"{period_type}:{to_micro_dollars(current_spend)}:{to_micro_dollars(limit_amount)}"
+        async with self._guard():
+            await self.client.set(
+                self.cutoff_key(user_id),
+                value,
+                px=max(int((end - datetime.utcnow()).total_seconds() * 1000), 1)
+            )
+
+    async def clear_cutoff(self, user_id):
+        """Remove the cutoff flag, e.g. after the user's budget settings change"""
+        async with self._guard():
+            await self.client.delete(self.cutoff_key(user_id))
+
+
+_redis_spend_counters = None
+
+def get_redis_spend_counters() -> Optional[RedisSpendCounters]:
+    """Get the Redis counter backend, or None when budgets use process-local counters"""
+    global _redis_spend_counters
+    if BUDGET_COUNTER_BACKEND != "redis":
+        return None
+
+    client = get_redis_client()
+    if client is None:
+        return None
+
+    if _redis_spend_counters is None or _redis_spend_counters.client is not client:
+        _redis_spend_counters = RedisSpendCounters(client)
+    return _redis_spend_counters
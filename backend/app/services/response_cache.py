@@ -0,0 +1,215 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional, Tuple
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from app.core.redis import RedisError, get_redis_client, redis_key
+from app.models.usage import UsageLog
+
+load_dotenv()
+
+# Off unless enabled; only deterministic requests (temperature 0, embeddings) are ever cached
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# Total response bytes held in memory; least recently used entries are evicted past this
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Larger responses are never cached
+RESPONSE_CACHE_MAX_BODY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BODY_BYTES", str(1024 * 1024)))
+# Share cached responses across workers through Redis (needs REDIS_URL)
+RESPONSE_CACHE_REDIS = os.getenv("RESPONSE_CACHE_REDIS", "false").lower() == "true"
+
+# Per-request control: "skip" neither reads nor writes the cache, "refresh" skips the read only
+CACHE_CONTROL_HEADER = "x-modev-cache"
+
+# Body fields that don't change what the provider returns
+IGNORED_BODY_FIELDS = {"user", "metadata"}
+# Request headers that do (API version, beta features, billing organization and project)
+RESPONSE_AFFECTING_HEADERS = ("anthropic-version", "anthropic-beta", "openai-organization", "openai-project")
+
+
+@dataclass
+class CachedResponse:
+    """A provider response plus the usage needed to price what a hit saved"""
+    content: bytes
+    status_code: int
+    media_type: Optional[str]
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["content"] = base64.b64encode(self.content).decode()
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, value: str) -> "CachedResponse":
+        data = json.loads(value)
+        data["content"] = base64.b64decode(data["content"])
+        return cls(**data)
+
+
+def is_deterministic(path: str, request_data: Dict[str, Any]) -> bool:
+    """Embeddings always are; generations only when they pin temperature to 0"""
+    if path.rstrip("/").endswith("embeddings"):
+        return True
+    return request_data.get("temperature") == 0 and request_data.get("stream") is not True
+
+
+def cache_mode(headers: Mapping[str, str]) -> Tuple[bool, bool]:
+    """(read, write) for a request, honouring X-Modev-Cache and Cache-Control opt-outs"""
+    control = headers.get(CACHE_CONTROL_HEADER, "").lower()
+    cache_control = headers.get("cache-control", "").lower()
+    if control == "skip" or "no-store" in cache_control:
+        return False, False
+    if control == "refresh" or "no-cache" in cache_control:
+        return False, True
+    return True, True
+
+
+def response_cache_key(
+    user_id,
+    provider: str,
+    method: str,
+    path: str,
+    query: Mapping[str, str],
+    headers: Mapping[str, str],
+    request_data: Dict[str, Any]
+) -> str:
+    """Canonical hash of (provider, method, path, query, response-affecting headers, normalized
+    JSON body), scoped to the user; headers are the ones forwarded upstream"""
+    forwarded = {key.lower(): value for key, value in headers.items()}
+    canonical = json.dumps(
+        {
+            "provider": provider,
+            "method": method.upper(),
+            "path": path.strip("/"),
+            "query": sorted(query.items()),
+            "headers": {name: forwarded[name] for name in RESPONSE_AFFECTING_HEADERS if name in forwarded},
+            "body": {key: value for key, value in request_data.items() if key not in IGNORED_BODY_FIELDS}
+        },
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return f"{user_id}:{hashlib.sha256(canonical.encode()).hexdigest()}"
+
+
+class ResponseCache:
+    """Entry- and byte-bounded in-memory LRU of provider responses, backed by Redis when enabled"""
+
+    def __init__(
+        self,
+        ttl: int = RESPONSE_CACHE_TTL,
+        max_size: int = RESPONSE_CACHE_SIZE,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        # Sum of the cached response bodies
+        self.bytes = 0
+        # key -> (expires_at, CachedResponse), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, CachedResponse]]" = OrderedDict()
+
+    async def get(self, key: str) -> Tuple[Optional[CachedResponse], Optional[str]]:
+        """The cached response and the tier it came from ("memory" or "redis"), or (None, None)"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.monotonic() < entry[0]:
+                self._entries.move_to_end(key)
+                return entry[1], "memory"
+            self._forget(key)
+
+        client = get_redis_client() if RESPONSE_CACHE_REDIS else None
+        if client is None:
+            return None, None
+        try:
+            value = await client.get(redis_key("response_cache", key))
+        except RedisError as e:
+            print(f"Warning: Response cache read from Redis failed: {e}")
+            return None, None
+        if value is None:
+            return None, None
+
+        cached = CachedResponse.from_json(value)
+        self._remember(key, cached)
+        return cached, "redis"
+
+    async def put(self, key: str, cached: CachedResponse):
+        if len(cached.content) > min(RESPONSE_CACHE_MAX_BODY_BYTES, self.max_bytes):
+            return
+        self._remember(key, cached)
+
+        client = get_redis_client() if RESPONSE_CACHE_REDIS else None
+        if client is None:
+            return
+        try:
+            await client.set(redis_key("response_cache", key), cached.to_json(), ex=self.ttl)
+        except RedisError as e:
+            print(f"Warning: Response cache write to Redis failed: {e}")
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def _remember(self, key: str, cached: CachedResponse):
+        self._forget(key)
+        self._entries[key] = (time.monotonic() + self.ttl, cached)
+        self.bytes += len(cached.content)
+        while len(self._entries) > self.max_size or self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= len(evicted.content)
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[1].content)
+
+
+async def get_cache_stats(db: AsyncSession, user_id, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Hits, coalesced requests and savings from usage_logs.extra_data for one user"""
+    cached = UsageLog.extra_data["cached"].as_boolean()
+    row = (await db.execute(
+        select(
+            func.count(UsageLog.id),
+            func.count(cached),
+            func.count(case((cached == True, 1))),
+            func.count(case((UsageLog.extra_data["coalesced"].as_boolean() == True, 1))),
+            func.sum(UsageLog.extra_data["saved_cost"].as_float()),
+            func.sum(UsageLog.extra_data["saved_tokens"].as_integer())
+        ).where(
+            UsageLog.user_id == user_id,
+            UsageLog.created_at >= start,
+            UsageLog.created_at < end
+        )
+    )).one()
+
+    total_requests, cacheable_requests, cache_hits, coalesced_requests, saved_cost, saved_tokens = row
+    return {
+        "total_requests": total_requests,
+        "cacheable_requests": cacheable_requests,
+        "cache_hits": cache_hits,
+        "coalesced_requests": coalesced_requests,
+        "hit_ratio": cache_hits / cacheable_requests if cacheable_requests else 0.0,
+        "saved_cost": float(saved_cost or 0.0),
+        "saved_tokens": int(saved_tokens or 0)
+    }
+
+
+# Global instance - lazy initialization
+_response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -0,0 +1,49 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Share one upstream call between identical deterministic requests that are in flight at once
+REQUEST_COALESCING_ENABLED = os.getenv("PROXY_COALESCE_REQUESTS", "true").lower() == "true"
+
+
+class SingleFlight:
+    """Runs one call per key at a time; callers arriving while it runs wait for the same result.
+
+    The call runs as its own task, so a caller that disconnects doesn't cancel it for the rest.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(result, shared); shared is True for callers that joined a call already in flight"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), shared
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved in case every caller went away before it was raised
+        if not task.cancelled():
+            task.exception()
+
+
+# Global instance - lazy initialization
+_request_coalescer = None
+
+def get_request_coalescer() -> SingleFlight:
+    global _request_coalescer
+    if _request_coalescer is None:
+        _request_coalescer = SingleFlight()
+    return _request_coalescer
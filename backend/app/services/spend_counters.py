@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple, Any
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.usage import UsageLog
+
+PERIOD_TYPES = ("daily", "weekly", "monthly")
+
+
+def get_period_boundaries(period_type: str, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """Get start and end dates for the period containing `now` (defaults to the current time)"""
+    now = now or datetime.utcnow()
+
+    if period_type == "daily":
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=1)
+    elif period_type == "weekly":
+        # Start of week (Monday)
+        days_since_monday = now.weekday()
+        start = (now - timedelta(days=days_since_monday)).replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(weeks=1)
+    elif period_type == "monthly":
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        # Next month's first day
+        if now.month == 12:
+            end = start.replace(year=now.year + 1, month=1)
+        else:
+            end = start.replace(month=now.month + 1)
+    else:
+        raise ValueError(f"Unsupported period type: {period_type}")
+
+    return start, end
+
+
+async def sum_spend_from_database(db: AsyncSession, user_id, period_type: str, include_pending: bool = True) -> float:
+    """Current period spend from usage_logs plus (optionally) usage still waiting in the write-behind queue"""
+    from app.services.usage_logger import get_usage_log_queue
+
+    start, end = get_period_boundaries(period_type)
+
+    total_cost = await db.scalar(
+        select(func.sum(UsageLog.cost)).where(
+            and_(
+                UsageLog.user_id == user_id,
+                UsageLog.created_at >= start,
+                UsageLog.created_at < end
+            )
+        )
+    ) or 0.0
+
+    if not include_pending:
+        return total_cost
+
+    total_cost += sum(
+        record.get("cost") or 0.0
+        for record in get_usage_log_queue().pending_records()
+        if record.get("user_id") == user_id and start <= record["created_at"] < end
+    )
+
+    return total_cost
+
+
+class SpendCounters:
+    """Running spend totals per (user, period_type, period_start), kept in process memory"""
+
+    def __init__(self):
+        # (user_id, period_type) -> [period_start, amount]; only the current period is kept,
+        # so a newer period_start replaces the old entry (rollover)
+        self._totals: Dict[Tuple[Any, str], list] = {}
+
+    def get(self, user_id, period_type: str, now: Optional[datetime] = None) -> Optional[float]:
+        """Current period spend, or None on a miss (never seeded or the period has rolled over)"""
+        start, _ = get_period_boundaries(period_type, now)
+        entry = self._totals.get((user_id, period_type))
+        if entry is None or entry[0] != start:
+            return None
+        return entry[1]
+
+    def seed(self, user_id, period_type: str, period_start: datetime, amount: float):
+        """Set the total for a period from an authoritative source"""
+        self._totals[(user_id, period_type)] = [period_start, amount]
+
+    def record(self, user_id, cost: float, created_at: Optional[datetime] = None):
+        """Add a logged request's cost to every seeded period counter for the user"""
+        created_at = created_at or datetime.utcnow()
+
+        for period_type in PERIOD_TYPES:
+            entry = self._totals.get((user_id, period_type))
+            if entry is None:
+                # Not tracked yet; the first read seeds it from the database
+                continue
+
+            start, _ = get_period_boundaries(period_type, created_at)
+            if start == entry[0]:
+                entry[1] += cost
+            elif start > entry[0]:
+                # First request of a new period
+                self._totals[(user_id, period_type)] = [start, cost]
+
+    def invalidate(self, user_id=None):
+        """Drop counters for one user, or all of them"""
+        if user_id is None:
+            self._totals.clear()
+            return
+        for period_type in PERIOD_TYPES:
+            self._totals.pop((user_id, period_type), None)
+
+    async def load_from_database(self, db: AsyncSession, user_id, period_type: str) -> float:
+        """Seed one counter from the database (see sum_spend_from_database)"""
+        start, _ = get_period_boundaries(period_type)
+        total_cost = await sum_spend_from_database(db, user_id, period_type)
+        self.seed(user_id, period_type, start, total_cost)
+        return total_cost
+
+    async def rebuild(self, db: AsyncSession, user_ids=None):
+        """Reseed counters in bulk, one GROUP BY per period type (called on app startup)"""
+        for period_type in PERIOD_TYPES:
+            start, end = get_period_boundaries(period_type)
+
+            query = select(UsageLog.user_id, func.sum(UsageLog.cost)).where(
+                UsageLog.created_at >= start,
+                UsageLog.created_at < end
+            )
+            if user_ids is not None:
+                query = query.where(UsageLog.user_id.in_(user_ids))
+
+            result = await db.execute(query.group_by(UsageLog.user_id))
+            totals = dict(result.all())
+
+            for user_id in (user_ids if user_ids is not None else totals.keys()):
+                self.seed(user_id, period_type, start, totals.get(user_id) or 0.0)
+
+
+# Global instance - lazy initialization
+_spend_counters = None
+
+def get_spend_counters() -> SpendCounters:
+    global _spend_counters
+    if _spend_counters is None:
+        _spend_counters = SpendCounters()
+    return _spend_counters
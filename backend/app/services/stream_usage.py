@@ -0,0 +1,76 @@
+import json
+from typing import Optional
+
+
+class StreamUsageTracker:
+    """Collect token usage from a server-sent event stream as chunks pass through"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.model: Optional[str] = None
+        self._buffer = b""
+
+    def feed(self, chunk: bytes):
+        """Consume a raw chunk, parsing every complete line it finishes"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            self._parse_line(line.strip())
+
+    def close(self):
+        """Parse whatever is left in the buffer once the stream has ended"""
+        if self._buffer:
+            self._parse_line(self._buffer.strip())
+            self._buffer = b""
+
+    def _parse_line(self, line: bytes):
+        """Parse a single SSE line, ignoring everything but JSON data payloads"""
+        if not line.startswith(b"data:"):
+            return
+
+        payload = line[len(b"data:"):].strip()
+        if not payload or payload == b"[DONE]":
+            return
+
+        try:
+            event = json.loads(payload)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return
+
+        if not isinstance(event, dict):
+            return
+
+        if self.provider == "openai":
+            self._handle_openai_event(event)
+        elif self.provider == "anthropic":
+            self._handle_anthropic_event(event)
+
+    def _handle_openai_event(self, event: dict):
+        """OpenAI sends a usage block on the final chunk when include_usage is set"""
+        if event.get("model"):
+            self.model = event["model"]
+
+        usage = event.get("usage")
+        if usage:
+            self.prompt_tokens = usage.get("prompt_tokens", 0) or 0
+            self.completion_tokens = usage.get("completion_tokens", 0) or 0
+
+    def _handle_anthropic_event(self, event: dict):
+        """Anthropic reports input tokens on message_start and running output tokens on message_delta"""
+        event_type = event.get("type")
+
+        if event_type == "message_start":
+            message = event.get("message", {})
+            if message.get("model"):
+                self.model = message["model"]
+            usage = message.get("usage", {})
+            self.prompt_tokens = usage.get("input_tokens", 0) or 0
+            self.completion_tokens = usage.get("output_tokens", 0) or 0
+        elif event_type == "message_delta":
+            usage = event.get("usage", {})
+            if usage.get("input_tokens"):
+                self.prompt_tokens = usage["input_tokens"]
+            if "output_tokens" in usage:
+                self.completion_tokens = usage.get("output_tokens", 0) or 0
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+import httpx
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from app.core.metrics import LatencyRecorder, get_latency_recorder
+from app.models.usage import UsageLog
+
+load_dotenv()
+
+# Total tries per upstream call, including the first
+UPSTREAM_RETRY_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_RETRY_MAX_ATTEMPTS", "3"))
+# Full-jitter exponential backoff: attempt n waits up to min(MAX_DELAY, BASE_DELAY * 2^(n-1)) seconds
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.5"))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "8"))
+# A provider asking for a longer wait than this gets its error passed straight to the caller
+UPSTREAM_RETRY_MAX_WAIT = float(os.getenv("UPSTREAM_RETRY_MAX_WAIT", "30"))
+
+# Hedged requests: off unless enabled, and then only for requests that send X-Modev-Hedge
+UPSTREAM_HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "false").lower() == "true"
+# Upstream latency samples needed before the p95 is trusted as the hedge delay
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "50"))
+
+HEDGE_HEADER = "x-modev-hedge"
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# The provider turned the request away without running it, so any request can be retried
+REJECTED_STATUS_CODES = {429, 503, 529}
+# The request may have run; only retried when repeating it is harmless
+FAILED_STATUS_CODES = {408, 500, 502, 504}
+
+# Rate-limit families reported by OpenAI (x-ratelimit-*) and Anthropic (anthropic-ratelimit-*)
+RATE_LIMITS = ("requests", "tokens", "input-tokens", "output-tokens")
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def upstream_latency_recorder(provider: str) -> LatencyRecorder:
+    """Latency of individual upstream calls, whose p95 is the hedge delay"""
+    return get_latency_recorder(f"upstream.request.{provider}")
+
+
+def hedge_requested(headers: Mapping[str, str]) -> bool:
+    return UPSTREAM_HEDGE_ENABLED and headers.get(HEDGE_HEADER, "").lower() in ("1", "true", "on")
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Seconds in an OpenAI reset value such as "20ms", "1s" or "6m0s\""""
+    parts = _DURATION_PART.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _seconds_until(timestamp: str) -> Optional[float]:
+    try:
+        moment = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """How long the provider asked us to wait, from retry-after(-ms) or an exhausted rate limit's reset"""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+            except (TypeError, ValueError):
+                pass
+
+    waits = []
+    for limit in RATE_LIMITS:
+        if headers.get(f"x-ratelimit-remaining-{limit}") == "0":
+            waits.append(parse_duration(headers.get(f"x-ratelimit-reset-{limit}", "")))
+        if headers.get(f"anthropic-ratelimit-{limit}-remaining") == "0":
+            waits.append(_seconds_until(headers.get(f"anthropic-ratelimit-{limit}-reset", "")))
+    waits = [wait for wait in waits if wait is not None]
+    return max(waits) if waits else None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, or the provider's requested wait plus a little jitter"""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, UPSTREAM_RETRY_BASE_DELAY)
+    return random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def is_retryable_response(response: httpx.Response, repeatable: bool) -> bool:
+    if response.status_code == 429:
+        # An exhausted quota won't come back by waiting
+        try:
+            error = json.loads(response.content).get("error") or {}
+            if isinstance(error, dict) and "insufficient_quota" in (error.get("code"), error.get("type")):
+                return False
+        except (ValueError, AttributeError, httpx.ResponseNotRead):
+            pass
+        return True
+    if response.status_code in REJECTED_STATUS_CODES:
+        return True
+    return repeatable and response.status_code in FAILED_STATUS_CODES
+
+
+def is_retryable_error(error: httpx.TransportError, repeatable: bool) -> bool:
+    # Never reached the provider
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    # A read timeout already spent the whole read timeout; repeating it multiplies the caller's wait
+    if isinstance(error, httpx.TimeoutException):
+        return False
+    return repeatable and isinstance(error, (httpx.NetworkError, httpx.RemoteProtocolError))
+
+
+def _settled(task: asyncio.Task, repeatable: bool) -> bool:
+    """A hedge attempt that finished with an answer worth returning"""
+    if not task.done() or task.cancelled() or task.exception() is not None:
+        return False
+    return not is_retryable_response(task.result()[0], repeatable)
+
+
+async def _send_hedged(
+    send: Callable[[], Awaitable[Tuple[httpx.Response, Any]]],
+    delay: float,
+    repeatable: bool,
+    on_discard: Optional[Callable[[Optional[Tuple[httpx.Response, Any]]], Awaitable[None]]] = None
+) -> Tuple[Tuple[httpx.Response, Any], bool, bool]:
+    """Start a second attempt if the first hasn't answered within delay; (result, hedged, hedge_won).
+
+    The attempt that loses is passed to on_discard: its result if it finished, None if it was
+    cancelled while possibly still running upstream.
+    """
+    tasks = [asyncio.ensure_future(send())]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=delay)
+        if pending:
+            tasks.append(asyncio.ensure_future(send()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(_settled(task, repeatable) for task in done):
+                    break
+        winner = next((task for task in tasks if _settled(task, repeatable)), None)
+        if winner is None:
+            # Neither gave a final answer: prefer a response the retry loop can inspect over an error
+            answered = [task for task in tasks if not task.cancelled() and task.exception() is None]
+            winner = answered[0] if answered else tasks[0]
+        result = winner.result()
+    except BaseException:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Mark the other attempt's exception retrieved
+                task.exception()
+        raise
+    
+    losers = [task for task in tasks if task is not winner]
+    cancelled = [task for task in losers if not task.done()]
+    for task in cancelled:
+        task.cancel()
+    # Let cancelled attempts release their scheduler slots before moving on
+    await asyncio.gather(*cancelled, return_exceptions=True)
+    for task in losers:
+        if not task.cancelled() and task.exception() is not None:
+            # Never produced a response, so nothing was billed
+            continue
+        loser = None if task.cancelled() else task.result()
+        if on_discard is not None:
+            await on_discard(loser)
+        elif loser is not None:
+            await loser[0].aclose()
+    return result, len(tasks) > 1, winner is not tasks[0]
+
+
+async def send_with_retries(
+    send: Callable[[], Awaitable[Tuple[httpx.Response, Any]]],
+    provider: str,
+    repeatable: bool,
+    hedge: bool = False,
+    on_discard: Optional[Callable[[Optional[Tuple[httpx.Response, Any]]], Awaitable[None]]] = None
+) -> Tuple[Tuple[httpx.Response, Any], List[Dict[str, Any]]]:
+    """Call send() until it gives a final answer; returns its (response, ...) result and a record per attempt.
+
+    Requests the provider rejected (429/503/529) or that never reached it are always retried;
+    5xx responses and dropped connections only when the request is repeatable (idempotent
+    or deterministic). The last response is returned as-is once attempts run out. Only
+    repeatable requests are hedged, and the losing hedge attempt goes to on_discard.
+    """
+    attempts: List[Dict[str, Any]] = []
+    for number in range(1, UPSTREAM_RETRY_MAX_ATTEMPTS + 1):
+        record: Dict[str, Any] = {"attempt": number}
+        started = time.monotonic()
+        try:
+            # Sending a request twice is only safe when running it twice is harmless
+            hedge_delay = _hedge_delay(provider) if hedge and repeatable else None
+            if hedge_delay is not None:
+                result, hedged, hedge_won = await _send_hedged(send, hedge_delay, repeatable, on_discard)
+                if hedged:
+                    record.update({"hedged": True, "hedge_won": hedge_won})
+            else:
+                result = await send()
+        except httpx.TransportError as e:
+            record.update({"error": type(e).__name__, "latency_ms": int((time.monotonic() - started) * 1000)})
+            attempts.append(record)
+            if number == UPSTREAM_RETRY_MAX_ATTEMPTS or not is_retryable_error(e, repeatable):
+                raise
+            delay = backoff_delay(number)
+        else:
+            response = result[0]
+            record.update({"status": response.status_code, "latency_ms": int((time.monotonic() - started) * 1000)})
+            attempts.append(record)
+            if number == UPSTREAM_RETRY_MAX_ATTEMPTS or not is_retryable_response(response, repeatable):
+                return result, attempts
+            retry_after = retry_after_seconds(response.headers)
+            if retry_after is not None and retry_after > UPSTREAM_RETRY_MAX_WAIT:
+                return result, attempts
+            delay = backoff_delay(number, retry_after)
+            await response.aclose()
+
+        record["delay_ms"] = int(delay * 1000)
+        await asyncio.sleep(delay)
+
+
+def _hedge_delay(provider: str) -> Optional[float]:
+    snapshot = upstream_latency_recorder(provider).snapshot()
+    if snapshot["count"] < UPSTREAM_HEDGE_MIN_SAMPLES:
+        return None
+    return snapshot["p95_ms"] / 1000
+
+
+def retry_summary(attempts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """extra_data fields for a call that needed more than one plain attempt"""
+    if len(attempts) == 1 and not attempts[0].get("hedged"):
+        return {}
+    return {
+        "attempts": attempts,
+        "retries": len(attempts) - 1,
+        "retry_wait_ms": sum(attempt.get("delay_ms", 0) for attempt in attempts),
+        "hedged": any(attempt.get("hedged") for attempt in attempts)
+    }
+
+
+async def get_retry_stats(db: AsyncSession, user_id, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Retries, hedged requests and time spent backing off, from usage_logs.extra_data for one user"""
+    retries = UsageLog.extra_data["retries"].as_integer()
+    row = (await db.execute(
+        select(
+            func.count(UsageLog.id),
+            func.count(case((retries > 0, 1))),
+            func.sum(retries),
+            func.count(case((UsageLog.extra_data["hedged"].as_boolean() == True, 1))),
+            func.sum(UsageLog.extra_data["retry_wait_ms"].as_integer())
+        ).where(
+            UsageLog.user_id == user_id,
+            UsageLog.created_at >= start,
+            UsageLog.created_at < end
+        )
+    )).one()
+
+    total_requests, retried_requests, retry_attempts, hedged_requests, retry_wait_ms = row
+    return {
+        "total_requests": total_requests,
+        "retried_requests": retried_requests,
+        "retry_attempts": int(retry_attempts or 0),
+        "retry_rate": retried_requests / total_requests if total_requests else 0.0,
+        "hedged_requests": hedged_requests,
+        "retry_wait_ms": int(retry_wait_ms or 0)
+    }
@@ -0,0 +1,282 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+from app.core.metrics import get_latency_recorder, get_latency_snapshots
+
+load_dotenv()
+
+# Longest a request waits for an upstream slot before it is shed
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "30"))
+# Requests waiting per (api key, provider) before new ones are rejected with 429
+UPSTREAM_QUEUE_SIZE = int(os.getenv("UPSTREAM_QUEUE_SIZE", "256"))
+
+# Optional per-request cap on queueing, in milliseconds (never above UPSTREAM_QUEUE_TIMEOUT)
+QUEUE_DEADLINE_HEADER = "x-modev-max-queue-ms"
+
+
+def estimate_request_tokens(body: bytes, request_data: Dict[str, Any]) -> int:
+    """Rough token cost of a request for the TPM bucket: ~4 bytes per prompt token plus the output cap"""
+    completion_cap = request_data.get("max_tokens") or request_data.get("max_completion_tokens") or 0
+    if not isinstance(completion_cap, int):
+        completion_cap = 0
+    return len(body or b"") // 4 + completion_cap
+
+
+def queue_deadline(headers) -> float:
+    """Monotonic time after which a request still waiting for a slot is shed"""
+    timeout = UPSTREAM_QUEUE_TIMEOUT
+    requested = headers.get(QUEUE_DEADLINE_HEADER)
+    if requested:
+        try:
+            timeout = min(timeout, max(float(requested) / 1000, 0.0))
+        except ValueError:
+            pass
+    return time.monotonic() + timeout
+
+
+class TokenBucket:
+    """Refills continuously up to a per-minute capacity"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (requests larger than the bucket wait for a full one)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Charge (or refund, if negative) the difference between an estimate and actual usage"""
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class _Waiter:
+    def __init__(self, user_id, tokens: int, deadline: float):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class Ticket:
+    """A granted upstream slot; release it when the response is done"""
+
+    def __init__(self, lane: "Lane", tokens: int):
+        self.lane = lane
+        self.tokens = tokens
+        self.wait_ms = 0
+        self.released = False
+
+    def settle(self, actual_tokens: int):
+        """Correct the TPM bucket once the response reports real usage (0 refunds the estimate)"""
+        if self.lane.token_bucket is not None:
+            self.lane.token_bucket.adjust(actual_tokens - self.tokens)
+        self.tokens = actual_tokens
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.lane.in_flight -= 1
+            self.lane.dispatch()
+
+
+class Lane:
+    """Concurrency cap, RPM/TPM buckets and a round-robin-per-user queue for one (api key, provider)"""
+
+    def __init__(self, provider: str, max_concurrency: int, rpm_limit: int, tpm_limit: int):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.request_bucket = TokenBucket(rpm_limit) if rpm_limit else None
+        self.token_bucket = TokenBucket(tpm_limit) if tpm_limit else None
+        self.in_flight = 0
+        self.queued = 0
+        # user_id -> that user's waiters; users are served in turn, oldest first
+        self._queues: "OrderedDict[Any, Deque[_Waiter]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def wait_time(self, tokens: int) -> float:
+        """Seconds until the rate limits allow one more request of this size"""
+        wait = 0.0
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.wait_time(1))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.wait_time(tokens))
+        return wait
+
+    def can_start_now(self) -> bool:
+        return self.queued == 0 and self.in_flight < self.max_concurrency
+
+    def start(self, tokens: int) -> Ticket:
+        self.in_flight += 1
+        if self.request_bucket is not None:
+            self.request_bucket.take(1)
+        if self.token_bucket is not None:
+            self.token_bucket.take(tokens)
+        return Ticket(self, tokens)
+
+    def enqueue(self, waiter: _Waiter):
+        self._queues.setdefault(waiter.user_id, deque()).append(waiter)
+        self.queued += 1
+        self.dispatch()
+
+    def remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self.queued -= 1
+        if not queue:
+            del self._queues[waiter.user_id]
+
+    def dispatch(self):
+        """Start queued requests while slots and rate budget allow, rotating between users"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queues and self.in_flight < self.max_concurrency:
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            wait = self.wait_time(waiter.tokens)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self.dispatch)
+                return
+
+            queue.popleft()
+            self.queued -= 1
+            # This user goes to the back of the line
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            waiter.future.set_result(self.start(waiter.tokens))
+
+
+class UpstreamScheduler:
+    """Gatekeeper in front of the upstream clients, one lane per (api key, provider)"""
+
+    def __init__(self, queue_size: int = UPSTREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lanes: Dict[Tuple[Any, str], Lane] = {}
+        # provider -> {"queue_full": n, "deadline": n}
+        self._shed: Dict[str, Dict[str, int]] = {}
+
+    def lane(self, api_key_id, provider: str, provider_config: Dict[str, Any]) -> Lane:
+        key = (api_key_id, provider)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = Lane(
+                provider,
+                provider_config.get("max_concurrency", 16),
+                provider_config.get("rpm_limit", 0),
+                provider_config.get("tpm_limit", 0)
+            )
+        return lane
+
+    async def acquire(
+        self,
+        api_key_id,
+        provider: str,
+        provider_config: Dict[str, Any],
+        user_id,
+        tokens: int,
+        deadline: float
+    ) -> Ticket:
+        """Wait for a slot in the lane; raises 429 when the queue is full, 503 past the deadline"""
+        lane = self.lane(api_key_id, provider, provider_config)
+        wait_recorder = get_latency_recorder(f"upstream.queue_wait.{provider}")
+
+        if lane.can_start_now() and lane.wait_time(tokens) == 0:
+            wait_recorder.record(0.0)
+            return lane.start(tokens)
+
+        if lane.queued >= self.queue_size:
+            self._count_shed(provider, "queue_full")
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many queued requests for {provider}; retry shortly",
+                headers={"Retry-After": str(max(1, math.ceil(lane.wait_time(tokens))))}
+            )
+
+        # Shed now rather than queue a request the rate limits can't admit before its deadline
+        if time.monotonic() + lane.wait_time(tokens) > deadline:
+            self._count_shed(provider, "deadline")
+            raise HTTPException(
+                status_code=503,
+                detail=f"{provider} rate limit can't admit this request before its queue deadline",
+                headers={"Retry-After": str(max(1, math.ceil(lane.wait_time(tokens))))}
+            )
+
+        waiter = _Waiter(user_id, tokens, deadline)
+        lane.enqueue(waiter)
+        try:
+            ticket = await asyncio.wait_for(asyncio.shield(waiter.future), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            lane.remove(waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the deadline passed; give the slot back
+                waiter.future.result().release()
+            self._count_shed(provider, "deadline")
+            raise HTTPException(status_code=503, detail=f"Timed out waiting for a {provider} upstream slot")
+        except asyncio.CancelledError:
+            # The caller went away while queued
+            lane.remove(waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                waiter.future.result().release()
+            else:
+                waiter.future.cancel()
+            raise
+
+        waited = time.monotonic() - waiter.enqueued_at
+        wait_recorder.record(waited)
+        ticket.wait_ms = int(waited * 1000)
+        return ticket
+
+    def _count_shed(self, provider: str, reason: str):
+        counts = self._shed.setdefault(provider, {"queue_full": 0, "deadline": 0})
+        counts[reason] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, in-flight requests, shed counts and queue wait percentiles per provider"""
+        providers: Dict[str, Dict[str, Any]] = {}
+        for lane in self._lanes.values():
+            entry = providers.setdefault(lane.provider, {"lanes": 0, "in_flight": 0, "queued": 0})
+            entry["lanes"] += 1
+            entry["in_flight"] += lane.in_flight
+            entry["queued"] += lane.queued
+        for provider, counts in self._shed.items():
+            providers.setdefault(provider, {"lanes": 0, "in_flight": 0, "queued": 0})["shed"] = dict(counts)
+        return {
+            "providers": providers,
+            "queue_wait": get_latency_snapshots("upstream.queue_wait.")
+        }
+
+
+# Global instance - lazy initialization
+_upstream_scheduler = None
+
+def get_upstream_scheduler() -> UpstreamScheduler:
+    global _upstream_scheduler
+    if _upstream_scheduler is None:
+        _upstream_scheduler = UpstreamScheduler()
+    return _upstream_scheduler
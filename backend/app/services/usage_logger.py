@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import insert, update, bindparam, or_
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from dotenv import load_dotenv
+
+from app.core.database import SessionLocal
+from app.core.redis import RedisError
+from app.models.usage import UsageLog
+from app.models.user import APIKey
+from app.services.redis_spend_counters import get_redis_spend_counters
+
+load_dotenv()
+
+# Flush once this many records are buffered...
+BATCH_SIZE = int(os.getenv("USAGE_LOG_BATCH_SIZE", "100"))
+# ...or once the oldest buffered record is this old
+FLUSH_INTERVAL_MS = int(os.getenv("USAGE_LOG_FLUSH_INTERVAL_MS", "500"))
+# Above this many buffered records, writers wait for a flush instead of growing the buffer
+MAX_PENDING = int(os.getenv("USAGE_LOG_MAX_PENDING", "10000"))
+# Flushes a record survives while the database is unreachable before it is dead-lettered
+MAX_RETRIES = int(os.getenv("USAGE_LOG_MAX_RETRIES", "5"))
+# Rows the database rejects (or that run out of retries) are appended here as JSON lines
+DEAD_LETTER_PATH = os.getenv("USAGE_LOG_DEAD_LETTER_PATH", "")
+
+
+def is_transient(error: Exception) -> bool:
+    """Connection-level failures that say nothing about the rows being written"""
+    return isinstance(error, (OperationalError, InterfaceError)) or (
+        isinstance(error, DBAPIError) and error.connection_invalidated
+    )
+
+
+class UsageLogQueue:
+    """Write-behind buffer that inserts usage logs in batches off the request path"""
+
+    def __init__(
+        self,
+        batch_size: int = BATCH_SIZE,
+        flush_interval_ms: int = FLUSH_INTERVAL_MS,
+        max_pending: int = MAX_PENDING
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+
+        self._records: List[Dict[str, Any]] = []
+        # Coalesced last-used timestamps, one per API key
+        self._last_used: Dict[Any, datetime] = {}
+        # Records handed to a flush that has not committed yet
+        self._in_flight: List[Dict[str, Any]] = []
+        # id(record) -> failed flushes, for records carried over after a transient failure
+        self._attempts: Dict[int, int] = {}
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.stats = {"enqueued": 0, "flushed": 0, "batches": 0, "failed_batches": 0, "dead_lettered": 0}
+
+    def start(self):
+        """Start the background flush loop on the running event loop"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def enqueue(self, record: Dict[str, Any]):
+        """Buffer a usage log row (column name -> value) for the next batch"""
+        self.start()
+
+        record.setdefault("created_at", datetime.utcnow())
+        self._records.append(record)
+        self.stats["enqueued"] += 1
+
+        api_key_id = record.get("api_key_id")
+        if api_key_id is not None:
+            previous = self._last_used.get(api_key_id)
+            if previous is None or record["created_at"] > previous:
+                self._last_used[api_key_id] = record["created_at"]
+
+        if len(self._records) >= self.batch_size:
+            self._wakeup.set()
+
+        # Apply backpressure rather than buffering without bound
+        if len(self._records) >= self.max_pending:
+            await self.flush()
+            # Still full means the database is down; shed the oldest rows rather than grow
+            overflow = len(self._records) - self.max_pending + 1
+            if overflow > 0:
+                shed, self._records = self._records[:overflow], self._records[overflow:]
+                self._dead_letter(shed, "usage log buffer full")
+
+    def pending_records(self) -> List[Dict[str, Any]]:
+        """Records accepted but not yet committed to the database"""
+        return self._in_flight + self._records
+
+    async def flush(self) -> bool:
+        """Write everything buffered so far; False if the database was unreachable.
+
+        Never raises: rows the database rejects are isolated and dead-lettered, and a
+        transient failure re-buffers the batch for at most MAX_RETRIES flushes.
+        """
+        async with self._flush_lock:
+            if not self._records and not self._last_used:
+                return True
+
+            records, self._records = self._records, []
+            last_used, self._last_used = self._last_used, {}
+            self._in_flight = records
+
+            try:
+                written, rejected = await asyncio.to_thread(self._write_batch, records, last_used)
+            except Exception as e:
+                print(f"Warning: Failed to flush {len(records)} usage logs: {e}")
+                self.stats["failed_batches"] += 1
+                self._requeue(records, last_used, str(e))
+                return False
+            finally:
+                self._in_flight = []
+
+            for record in records:
+                self._attempts.pop(id(record), None)
+            self.stats["flushed"] += written
+            self.stats["batches"] += 1
+            for record, error in rejected:
+                self._dead_letter([record], error)
+
+            rejected_ids = {id(record) for record, _ in rejected}
+            await self._commit_spend([record for record in records if id(record) not in rejected_ids])
+            return True
+
+    @staticmethod
+    async def _commit_spend(records: List[Dict[str, Any]]):
+        """Tell the shared spend counters these rows are now in usage_logs"""
+        redis_counters = get_redis_spend_counters()
+        if redis_counters is None or not records:
+            return
+        try:
+            await redis_counters.commit(records)
+        except RedisError as e:
+            # The rows stay counted as pending too; the next reseed from SQL corrects it
+            print(f"Warning: Failed to commit flushed spend to Redis: {e}")
+
+    async def drain(self):
+        """Stop the flush loop and write out every remaining record (called on app shutdown)"""
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        if self._flush_lock is not None:
+            if not await self.flush() and self._records:
+                self._dead_letter(self._records, "database unreachable at shutdown")
+                self._records = []
+
+    async def _run(self):
+        """Flush every batch_size records or flush_interval seconds, whichever comes first"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if not await self.flush():
+                # Already logged and re-buffered; back off until the next interval
+                await asyncio.sleep(self.flush_interval)
+
+    def _requeue(self, records: List[Dict[str, Any]], last_used: Dict[Any, datetime], error: str):
+        """Put a failed batch back in front of newer records, dead-lettering any out of retries"""
+        retry = []
+        for record in records:
+            attempts = self._attempts.get(id(record), 0) + 1
+            if attempts > MAX_RETRIES:
+                self._attempts.pop(id(record), None)
+                self._dead_letter([record], f"gave up after {MAX_RETRIES} retries: {error}")
+            else:
+                self._attempts[id(record)] = attempts
+                retry.append(record)
+        self._records = retry + self._records
+        for api_key_id, used_at in last_used.items():
+            if api_key_id not in self._last_used or used_at > self._last_used[api_key_id]:
+                self._last_used[api_key_id] = used_at
+
+    def _dead_letter(self, records: List[Dict[str, Any]], error: str):
+        """Record rows that will never be written, so they can be replayed by hand"""
+        if not records:
+            return
+        self.stats["dead_lettered"] += len(records)
+        for record in records:
+            self._attempts.pop(id(record), None)
+        print(f"Warning: Dropped {len(records)} usage logs ({error})")
+        if not DEAD_LETTER_PATH:
+            return
+        try:
+            with open(DEAD_LETTER_PATH, "a") as dead_letters:
+                for record in records:
+                    dead_letters.write(json.dumps({"error": error, "record": record}, default=str) + "\n")
+        except OSError as e:
+            print(f"Warning: Failed to write usage log dead letters: {e}")
+
+    @classmethod
+    def _write_batch(
+        cls,
+        records: List[Dict[str, Any]],
+        last_used: Dict[Any, datetime]
+    ) -> Tuple[int, List[Tuple[Dict[str, Any], str]]]:
+        """Multi-row insert of the batch plus one coalesced last_used_at update per key.
+
+        Returns (rows written, [(rejected row, error)]). A batch the database rejects is
+        bisected until the offending rows are isolated; transient errors propagate.
+        """
+        rejected: List[Tuple[Dict[str, Any], str]] = []
+        written = cls._insert_isolating(records, rejected) if records else 0
+        if last_used:
+            try:
+                cls._touch_api_keys(last_used)
+            except Exception as e:
+                if is_transient(e):
+                    raise
+                # A bookkeeping timestamp isn't worth holding the logs back for
+                print(f"Warning: Failed to update API key last_used_at: {e}")
+        return written, rejected
+
+    @classmethod
+    def _insert_isolating(cls, records: List[Dict[str, Any]], rejected: List[Tuple[Dict[str, Any], str]]) -> int:
+        db = SessionLocal()
+        try:
+            db.execute(insert(UsageLog), records)
+            db.commit()
+            return len(records)
+        except Exception as e:
+            db.rollback()
+            if is_transient(e):
+                raise
+            if len(records) == 1:
+                rejected.append((records[0], str(e).splitlines()[0]))
+                return 0
+        finally:
+            db.close()
+
+        middle = len(records) // 2
+        return (
+            cls._insert_isolating(records[:middle], rejected)
+            + cls._insert_isolating(records[middle:], rejected)
+        )
+
+    @staticmethod
+    def _touch_api_keys(last_used: Dict[Any, datetime]):
+        db = SessionLocal()
+        try:
+            api_keys = APIKey.__table__
+            db.execute(
+                update(api_keys)
+                .where(api_keys.c.id == bindparam("key_id"))
+                .where(or_(
+                    api_keys.c.last_used_at.is_(None),
+                    api_keys.c.last_used_at < bindparam("used_at")
+                ))
+                .values(last_used_at=bindparam("used_at")),
+                [
+                    {"key_id": api_key_id, "used_at": used_at}
+                    for api_key_id, used_at in last_used.items()
+                ]
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+# Global instance - lazy initialization
+_usage_log_queue = None
+
+def get_usage_log_queue() -> UsageLogQueue:
+    global _usage_log_queue
+    if _usage_log_queue is None:
+        _usage_log_queue = UsageLogQueue()
+    return _usage_log_queue
@@ -0,0 +1,367 @@
+import asyncio
+import os
+import uuid
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional, Iterable, Any
+from sqlalchemy import select, delete, func, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from app.core.database import AsyncSessionLocal
+from app.models.usage import UsageLog, DailyUsageSummary
+
+load_dotenv()
+
+# A day is only finalized this long after midnight, so usage still sitting in the
+# write-behind queue when the day ends is included
+ROLLUP_GRACE_SECONDS = int(os.getenv("USAGE_ROLLUP_GRACE_SECONDS", "300"))
+# How often the background job checks for a newly closed day
+ROLLUP_INTERVAL_SECONDS = int(os.getenv("USAGE_ROLLUP_INTERVAL_SECONDS", "3600"))
+
+# Summaries per upsert statement, well under PostgreSQL's bind parameter limit
+ROLLUP_WRITE_BATCH_SIZE = 1000
+
+# One (date, provider, model) aggregate, whether it came from a rollup or a live query
+UsageGroup = namedtuple("UsageGroup", ["date", "provider", "model", "requests", "tokens", "cost"])
+# Per-day totals for trend charts
+DailyStats = namedtuple("DailyStats", ["date", "requests", "tokens", "cost", "avg_latency"])
+
+
+def day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day)
+
+
+def live_window_start(now: Optional[datetime] = None) -> datetime:
+    """Start of the span that is still queried live; every day before it is final"""
+    now = now or datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if (now - today).total_seconds() < ROLLUP_GRACE_SECONDS:
+        return today - timedelta(days=1)
+    return today
+
+
+def _as_date(value) -> date:
+    """func.date() returns a date on PostgreSQL and a string on SQLite"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+async def _aggregate_usage(
+    db: AsyncSession, start: datetime, end: datetime, user_ids: Optional[Iterable] = None
+):
+    """Group usage_logs in [start, end) by user, day, provider and model"""
+    day = func.date(UsageLog.created_at)
+    query = select(
+        UsageLog.user_id,
+        day.label("date"),
+        UsageLog.provider,
+        UsageLog.model,
+        func.count(UsageLog.id).label("requests"),
+        func.coalesce(func.sum(UsageLog.total_tokens), 0).label("tokens"),
+        func.coalesce(func.sum(UsageLog.cost), 0.0).label("cost"),
+        func.sum(UsageLog.latency_ms).label("latency_total"),
+        func.count(UsageLog.latency_ms).label("latency_count"),
+        func.sum(case((UsageLog.status_code >= 400, 1), else_=0)).label("errors")
+    ).where(
+        UsageLog.created_at >= start,
+        UsageLog.created_at < end
+    )
+    if user_ids is not None:
+        query = query.where(UsageLog.user_id.in_(list(user_ids)))
+
+    result = await db.execute(query.group_by(UsageLog.user_id, day, UsageLog.provider, UsageLog.model))
+    return result.all()
+
+
+async def _write_rollups(
+    db: AsyncSession, user_ids: Iterable, days: Iterable[date], groups
+) -> List[DailyUsageSummary]:
+    """Upsert the summaries for every (user, day) pair; pairs without usage get zero rows"""
+    user_ids = list(user_ids)
+    days = list(days)
+    if not user_ids or not days:
+        return []
+
+    summaries: Dict[tuple, Dict[str, Any]] = {
+        (user_id, day): {
+            "total_requests": 0,
+            "total_tokens": 0,
+            "total_cost": 0.0,
+            "provider_breakdown": {},
+            "model_breakdown": {},
+            "latency_total": 0.0,
+            "latency_count": 0,
+            "error_count": 0
+        }
+        for user_id in user_ids for day in days
+    }
+
+    for group in groups:
+        summary = summaries.get((group.user_id, _as_date(group.date)))
+        if summary is None:
+            continue
+
+        tokens = int(group.tokens or 0)
+        cost = float(group.cost or 0.0)
+
+        summary["total_requests"] += group.requests
+        summary["total_tokens"] += tokens
+        summary["total_cost"] += cost
+        summary["latency_total"] += float(group.latency_total or 0.0)
+        summary["latency_count"] += group.latency_count or 0
+        summary["error_count"] += group.errors or 0
+
+        provider_stats = summary["provider_breakdown"].setdefault(
+            group.provider, {"requests": 0, "tokens": 0, "cost": 0.0}
+        )
+        provider_stats["requests"] += group.requests
+        provider_stats["tokens"] += tokens
+        provider_stats["cost"] += cost
+
+        summary["model_breakdown"][f"{group.provider}:{group.model}"] = {
+            "provider": group.provider,
+            "model": group.model,
+            "requests": group.requests,
+            "tokens": tokens,
+            "cost": cost
+        }
+
+    values = [
+        {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "date": day_start(day),
+            "total_requests": summary["total_requests"],
+            "total_tokens": summary["total_tokens"],
+            "total_cost": summary["total_cost"],
+            "provider_breakdown": summary["provider_breakdown"],
+            "model_breakdown": summary["model_breakdown"],
+            "avg_latency_ms": (
+                summary["latency_total"] / summary["latency_count"]
+                if summary["latency_count"] else None
+            ),
+            "error_count": summary["error_count"]
+        }
+        for (user_id, day), summary in summaries.items()
+    ]
+
+    # Upsert on (user_id, date) so concurrent rollups of the same day can't race each other
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    rows = []
+    for offset in range(0, len(values), ROLLUP_WRITE_BATCH_SIZE):
+        statement = dialect_insert(DailyUsageSummary).values(values[offset:offset + ROLLUP_WRITE_BATCH_SIZE])
+        statement = statement.on_conflict_do_update(
+            index_elements=["user_id", "date"],
+            set_={
+                **{
+                    column: statement.excluded[column]
+                    for column in values[0] if column not in ("id", "user_id", "date")
+                },
+                "updated_at": func.now()
+            }
+        ).returning(DailyUsageSummary)
+        result = await db.scalars(statement, execution_options={"populate_existing": True})
+        rows.extend(result.all())
+
+    await db.commit()
+    return rows
+
+
+async def finalize_day(db: AsyncSession, day: date) -> int:
+    """Roll up a closed day for every user with usage on it; returns the number of summaries written"""
+    start = day_start(day)
+    groups = await _aggregate_usage(db, start, start + timedelta(days=1))
+    user_ids = {group.user_id for group in groups}
+    return len(await _write_rollups(db, user_ids, [day], groups))
+
+
+_last_finalized_day: Optional[date] = None
+
+
+async def finalize_closed_days(now: Optional[datetime] = None) -> int:
+    """Finalize the most recently closed day once per process; reads roll up anything missed"""
+    global _last_finalized_day
+    closed_day = (live_window_start(now) - timedelta(days=1)).date()
+    if _last_finalized_day == closed_day:
+        return 0
+
+    async with AsyncSessionLocal() as db:
+        written = await finalize_day(db, closed_day)
+
+    _last_finalized_day = closed_day
+    return written
+
+
+async def run_rollup_job():
+    """Background loop that finalizes each day shortly after it closes"""
+    while True:
+        try:
+            await finalize_closed_days()
+        except Exception as e:
+            print(f"Warning: Failed to finalize daily usage rollups: {e}")
+        await asyncio.sleep(ROLLUP_INTERVAL_SECONDS)
+
+
+async def invalidate_rollup_days(db: AsyncSession, days_by_user: Dict[Any, Iterable[date]]):
+    """Drop the summaries for specific (user, day) pairs, e.g. after those days' costs changed"""
+    for user_id, days in days_by_user.items():
+        days = [day_start(day) for day in set(days)]
+        if not days:
+            continue
+        await db.execute(
+            delete(DailyUsageSummary).where(
+                DailyUsageSummary.user_id == user_id,
+                DailyUsageSummary.date.in_(days)
+            )
+        )
+    await db.commit()
+
+
+async def get_daily_summaries(
+    db: AsyncSession, user_id, start_day: date, end_day: date
+) -> List[DailyUsageSummary]:
+    """Summaries for each closed day in [start_day, end_day), rolling up any that are missing"""
+    if start_day >= end_day:
+        return []
+
+    result = await db.execute(
+        select(DailyUsageSummary).where(
+            DailyUsageSummary.user_id == user_id,
+            DailyUsageSummary.date >= day_start(start_day),
+            DailyUsageSummary.date < day_start(end_day)
+        )
+    )
+    existing = result.scalars().all()
+
+    by_day = {}
+    for summary in existing:
+        by_day[_as_date(summary.date)] = summary
+
+    all_days = [start_day + timedelta(days=offset) for offset in range((end_day - start_day).days)]
+    missing = [day for day in all_days if day not in by_day]
+
+    if missing:
+        groups = await _aggregate_usage(
+            db, day_start(missing[0]), day_start(missing[-1]) + timedelta(days=1), [user_id]
+        )
+        for summary in await _write_rollups(db, [user_id], missing, groups):
+            by_day[_as_date(summary.date)] = summary
+
+    return [by_day[day] for day in all_days]
+
+
+def usage_groups_from_summaries(summaries: List[DailyUsageSummary]) -> List[UsageGroup]:
+    """Expand each summary's model breakdown back into (date, provider, model) groups"""
+    groups = []
+    for summary in summaries:
+        summary_day = _as_date(summary.date)
+        for stats in (summary.model_breakdown or {}).values():
+            groups.append(UsageGroup(
+                date=summary_day,
+                provider=stats["provider"],
+                model=stats["model"],
+                requests=stats["requests"],
+                tokens=stats["tokens"],
+                cost=stats["cost"]
+            ))
+    return groups
+
+
+async def live_usage_groups(db: AsyncSession, user_id, start: datetime, end: datetime) -> List[UsageGroup]:
+    """(date, provider, model) groups for the still-open part of the window"""
+    day = func.date(UsageLog.created_at)
+    result = await db.execute(select(
+        day.label("date"),
+        UsageLog.provider,
+        UsageLog.model,
+        func.count(UsageLog.id).label("requests"),
+        func.coalesce(func.sum(UsageLog.total_tokens), 0).label("tokens"),
+        func.coalesce(func.sum(UsageLog.cost), 0.0).label("cost")
+    ).where(
+        UsageLog.user_id == user_id,
+        UsageLog.created_at >= start,
+        UsageLog.created_at <= end
+    ).group_by(
+        day, UsageLog.provider, UsageLog.model
+    ))
+
+    return [
+        UsageGroup(_as_date(row.date), row.provider, row.model, row.requests, row.tokens, row.cost)
+        for row in result.all()
+    ]
+
+
+async def get_usage_groups(db: AsyncSession, user_id, start: datetime, end: datetime) -> List[UsageGroup]:
+    """Usage groups for [start, end]: rollups for closed days plus a live query for the rest"""
+    live_start = max(live_window_start(end), start)
+    summaries = await get_daily_summaries(db, user_id, start.date(), live_start.date())
+    return usage_groups_from_summaries(summaries) + await live_usage_groups(db, user_id, live_start, end)
+
+
+async def get_daily_stats(db: AsyncSession, user_id, start: datetime, end: datetime) -> List[DailyStats]:
+    """Per-day totals for [start, end], skipping days without usage"""
+    live_start = max(live_window_start(end), start)
+
+    stats = [
+        DailyStats(
+            _as_date(summary.date),
+            int(summary.total_requests),
+            int(summary.total_tokens or 0),
+            summary.total_cost,
+            summary.avg_latency_ms
+        )
+        for summary in await get_daily_summaries(db, user_id, start.date(), live_start.date())
+        if summary.total_requests
+    ]
+
+    day = func.date(UsageLog.created_at)
+    result = await db.execute(select(
+        day.label("date"),
+        func.count(UsageLog.id).label("requests"),
+        func.sum(UsageLog.total_tokens).label("tokens"),
+        func.sum(UsageLog.cost).label("cost"),
+        func.avg(UsageLog.latency_ms).label("avg_latency")
+    ).where(
+        UsageLog.user_id == user_id,
+        UsageLog.created_at >= live_start,
+        UsageLog.created_at <= end
+    ).group_by(day).order_by(day))
+
+    stats += [
+        DailyStats(_as_date(row.date), row.requests, row.tokens, row.cost, row.avg_latency)
+        for row in result.all()
+    ]
+    return stats
+
+
+async def get_usage_totals(db: AsyncSession, user_id, start: Optional[datetime], end: datetime) -> Dict[str, float]:
+    """Request, token and cost totals for [start, end]; start=None means all time"""
+    if start is None:
+        # Rollups outlive the raw logs once old partitions expire, so look at both
+        first_days = [
+            _as_date(first)
+            for first in (
+                await db.scalar(
+                    select(func.min(DailyUsageSummary.date)).where(DailyUsageSummary.user_id == user_id)
+                ),
+                await db.scalar(
+                    select(func.min(UsageLog.created_at)).where(UsageLog.user_id == user_id)
+                )
+            )
+            if first is not None
+        ]
+        if not first_days:
+            return {"requests": 0, "tokens": 0, "cost": 0.0}
+        start = day_start(min(first_days))
+
+    groups = await get_usage_groups(db, user_id, start, end)
+    return {
+        "requests": sum(group.requests for group in groups),
+        "tokens": sum(group.tokens or 0 for group in groups),
+        "cost": sum(float(group.cost or 0.0) for group in groups)
+    }
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Capture before/after query plans for the hot usage_logs and api_keys queries.
+
+Usage (from backend/, against a database migrated to 7c2e4a9f1b3d):
+    python benchmarks/explain_usage_queries.py [--user-id UUID] [--no-analyze] [--drop-indexes]
+
+On PostgreSQL the "before" plans are taken with SET LOCAL enable_indexscan,
+enable_indexonlyscan and enable_bitmapscan off. That takes no locks, but it hides every
+index, so "before" is the plan without any index rather than without the composite ones.
+
+--drop-indexes instead drops the composite indexes inside a transaction and rolls it back.
+Nothing is changed, but DROP INDEX holds an ACCESS EXCLUSIVE lock on usage_logs and api_keys
+until the rollback, which blocks every read and write of those tables. Only use it on a
+database nothing else is using. SQLite always uses this mode.
+
+Run VACUUM ANALYZE first on PostgreSQL; index-only scans depend on an up-to-date
+visibility map.
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import text
+
+from app.core.database import engine
+
+COMPOSITE_INDEXES = [
+    "ix_usage_logs_user_id_created_at",
+    "ix_api_keys_user_id_provider_is_active",
+]
+
+QUERIES = {
+    "budget spend (BudgetChecker.get_current_spend)": """
+        SELECT sum(cost) FROM usage_logs
+        WHERE user_id = :user_id AND created_at >= :start AND created_at < :end
+    """,
+    "usage summary (/analytics/usage-summary)": """
+        SELECT date(created_at), provider, model, count(*), sum(total_tokens), sum(cost)
+        FROM usage_logs
+        WHERE user_id = :user_id AND created_at >= :start AND created_at <= :end
+        GROUP BY date(created_at), provider, model
+    """,
+    "usage trends (/analytics/usage-trends)": """
+        SELECT date(created_at), count(*), sum(total_tokens), sum(cost), avg(latency_ms)
+        FROM usage_logs
+        WHERE user_id = :user_id AND created_at >= :start AND created_at <= :end
+        GROUP BY date(created_at)
+    """,
+    "provider key lookup (proxy)": """
+        SELECT id, encrypted_key FROM api_keys
+        WHERE user_id = :user_id AND provider = :provider AND is_active = true
+    """,
+}
+
+
+def explain_prefix(dialect: str, analyze: bool) -> str:
+    if dialect == "postgresql":
+        return "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+    return "EXPLAIN QUERY PLAN "
+
+
+def capture_plans(conn, dialect: str, params: dict, analyze: bool) -> dict:
+    prefix = explain_prefix(dialect, analyze)
+    plans = {}
+    for name, sql in QUERIES.items():
+        rows = conn.execute(text(prefix + sql), params).fetchall()
+        plans[name] = "\n".join(" | ".join(str(column) for column in row) for row in rows)
+    return plans
+
+
+def busiest_user_id(conn):
+    return conn.execute(text(
+        "SELECT user_id FROM usage_logs GROUP BY user_id ORDER BY count(*) DESC LIMIT 1"
+    )).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user-id", help="User to query as (defaults to the busiest user)")
+    parser.add_argument("--provider", default="openai")
+    parser.add_argument("--days", type=int, default=30, help="Width of the created_at window")
+    parser.add_argument("--no-analyze", action="store_true", help="Plan only; do not execute")
+    parser.add_argument(
+        "--drop-indexes", action="store_true",
+        help="Drop the composite indexes in a rolled-back transaction (locks the tables; PostgreSQL)"
+    )
+    args = parser.parse_args()
+
+    dialect = engine.dialect.name
+    analyze = not args.no_analyze
+    drop_indexes = args.drop_indexes or dialect != "postgresql"
+
+    with engine.connect() as conn:
+        user_id = args.user_id or busiest_user_id(conn)
+        conn.rollback()
+        if user_id is None:
+            print("usage_logs is empty; load some data first")
+            return
+
+        end = datetime.utcnow()
+        params = {
+            "user_id": user_id,
+            "provider": args.provider,
+            "start": end - timedelta(days=args.days),
+            "end": end,
+        }
+
+        trans = conn.begin()
+        try:
+            if drop_indexes:
+                # Rolled back below. pysqlite does not open a transaction for DDL, so SQLite
+                # needs an explicit savepoint
+                if dialect == "sqlite":
+                    conn.exec_driver_sql("SAVEPOINT explain_before")
+                for index_name in COMPOSITE_INDEXES:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+            else:
+                # Planner settings scoped to this transaction; no locks beyond the reads
+                for setting in ("enable_indexscan", "enable_indexonlyscan", "enable_bitmapscan"):
+                    conn.execute(text(f"SET LOCAL {setting} = off"))
+            before = capture_plans(conn, dialect, params, analyze)
+        finally:
+            if drop_indexes and dialect == "sqlite":
+                conn.exec_driver_sql("ROLLBACK TO explain_before")
+                conn.exec_driver_sql("RELEASE explain_before")
+            trans.rollback()
+
+        after = capture_plans(conn, dialect, params, analyze)
+
+    print(f"dialect={dialect} user_id={user_id} window={args.days}d\n")
+    for name in QUERIES:
+        print(f"=== {name}")
+        print("--- before")
+        print(before[name])
+        print("--- after")
+        print(after[name])
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import asyncio
+import uuid
+
+import httpx
+from starlette.requests import Request
+
+from app.core.auth import Principal
+from app.routers import proxy
+from app.services.provider_key_cache import ProviderCredential
+
+
+class StalledStream(httpx.AsyncByteStream):
+    """Sends the first SSE event and then waits, like a model still generating"""
+
+    def __init__(self):
+        self.closed = False
+
+    async def __aiter__(self):
+        yield b'data: {"id": "1", "model": "gpt-4", "choices": [{"delta": {"content": "Hi"}}]}\n\n'
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+def make_request():
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/proxy/openai/chat/completions",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+    }
+    return Request(scope)
+
+
+def test_client_disconnect_mid_stream_still_logs_usage(monkeypatch, async_session_factory):
+    upstream = StalledStream()
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(
+            200, headers={"content-type": "text/event-stream"}, stream=upstream
+        ))
+    )
+    logged = []
+
+    async def record_usage(**kwargs):
+        logged.append(kwargs)
+
+    monkeypatch.setattr(proxy, "get_upstream_client", lambda provider, config: client)
+    monkeypatch.setattr(proxy, "AsyncSessionLocal", async_session_factory)
+    monkeypatch.setattr(proxy, "log_usage", record_usage)
+
+    async def scenario():
+        response = await proxy.stream_from_provider(
+            make_request(), "openai", "chat/completions",
+            Principal(id=uuid.uuid4(), email="a@example.com", is_active=True, plan="free"),
+            ProviderCredential(id=uuid.uuid4(), api_key="sk-test"),
+            None, "https://api.openai.com/v1/chat/completions", {}, b"{}",
+            "gpt-4", 2, 10, True
+        )
+
+        sent_body = asyncio.Event()
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                sent_body.set()
+
+        async def receive():
+            # The client goes away once it has seen the first chunk
+            await sent_body.wait()
+            return {"type": "http.disconnect"}
+
+        await response({"type": "http", "asgi": {"spec_version": "2.3"}}, receive, send)
+        # Billing finishes in the background after the response is torn down
+        for _ in range(100):
+            if logged:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+
+    assert len(logged) == 1
+    assert logged[0]["status_code"] == 200
+    assert logged[0]["model"] == "gpt-4"
+    assert upstream.closed
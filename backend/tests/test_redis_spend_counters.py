@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis needs it to run the Lua scripts
+
+from app.services import redis_spend_counters as module
+from app.services.redis_spend_counters import RedisSpendCounters, to_micro_dollars
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def make_counters():
+    return RedisSpendCounters(fakeredis.aioredis.FakeRedis(decode_responses=True))
+
+
+def test_seed_keeps_the_first_value():
+    async def scenario():
+        counters = await make_counters()
+        assert await counters.seed("u1", "daily", 1.5) == 1.5
+        # Another worker seeding a different SQL sum loses the race
+        assert await counters.seed("u1", "daily", 9.0) == 1.5
+        _, spends = await counters.snapshot("u1", ["daily", "weekly"])
+        assert spends == {"daily": 1.5, "weekly": None}
+
+    run(scenario())
+
+
+def test_record_before_seed_is_still_counted():
+    async def scenario():
+        counters = await make_counters()
+        # Buffered on some worker before anyone seeded the counter
+        await counters.record("u1", 0.25)
+        assert await counters.seed("u1", "daily", 1.0) == 1.25
+        await counters.record("u1", 0.5)
+        _, spends = await counters.snapshot("u1", ["daily"])
+        assert spends["daily"] == 1.75
+
+    run(scenario())
+
+
+def test_commit_moves_flushed_cost_from_pending_to_committed():
+    async def scenario():
+        counters = await make_counters()
+        await counters.seed("u1", "daily", 1.0)
+        now = datetime.utcnow()
+        await counters.record("u1", 0.5, now)
+        await counters.commit([{"user_id": "u1", "cost": 0.5, "created_at": now}])
+
+        committed_key, pending_key = counters.spend_keys("u1", "daily")
+        assert int(await counters.client.get(committed_key)) == to_micro_dollars(1.5)
+        assert int(await counters.client.get(pending_key)) == 0
+        _, spends = await counters.snapshot("u1", ["daily"])
+        assert spends["daily"] == 1.5
+
+        # A row whose record step was missed never drives pending negative
+        await counters.commit([{"user_id": "u1", "cost": 2.0, "created_at": now}])
+        assert int(await counters.client.get(pending_key)) == 0
+        _, spends = await counters.snapshot("u1", ["daily"])
+        assert spends["daily"] == 3.5
+
+    run(scenario())
+
+
+def test_crossing_an_auto_cutoff_limit_publishes_the_flag():
+    async def scenario():
+        counters = await make_counters()
+        await counters.seed("u1", "daily", 9.0)
+        await counters.record("u1", 0.5, cutoff_limits={"daily": 10.0})
+        cutoff, _ = await counters.snapshot("u1", ["daily"])
+        assert cutoff is None
+
+        await counters.record("u1", 0.75, cutoff_limits={"daily": 10.0})
+        cutoff, spends = await counters.snapshot("u1", ["daily"])
+        assert cutoff == {"period_type": "daily", "current_spend": 10.25, "limit_amount": 10.0}
+        assert spends["daily"] == 10.25
+
+        await counters.clear_cutoff("u1")
+        cutoff, _ = await counters.snapshot("u1", ["daily"])
+        assert cutoff is None
+
+    run(scenario())
+
+
+def test_counters_expire():
+    async def scenario():
+        counters = await make_counters()
+        await counters.seed("u1", "monthly", 1.0)
+        await counters.record("u1", 0.5)
+        await counters.set_cutoff("u1", "daily", 2.0, 1.0)
+
+        committed_key, pending_key = counters.spend_keys("u1", "monthly")
+        # The committed part is reseeded from SQL every reconcile interval
+        assert 0 < await counters.client.ttl(committed_key) <= module.BUDGET_COUNTER_RECONCILE_SECONDS
+        # Pending spend and the cutoff flag last until the period is over
+        _, end = module.get_period_boundaries("monthly")
+        remaining = (end - datetime.utcnow()).total_seconds()
+        assert remaining < await counters.client.ttl(pending_key) <= remaining + module.COUNTER_TTL_MARGIN_SECONDS + 1
+        assert 0 < await counters.client.pttl(counters.cutoff_key("u1")) <= timedelta(days=1).total_seconds() * 1000
+
+        # Once the committed part has expired the period reads as unseeded
+        await counters.client.delete(committed_key)
+        _, spends = await counters.snapshot("u1", ["monthly"])
+        assert spends["monthly"] is None
+        assert await counters.seed("u1", "monthly", 1.0) == 1.5
+
+    run(scenario())
+
+
+def test_redis_errors_back_off(monkeypatch):
+    async def scenario():
+        counters = await make_counters()
+        calls = []
+
+        async def broken_mget(keys):
+            calls.append(keys)
+            raise module.RedisError("connection refused")
+
+        monkeypatch.setattr(counters.client, "mget", broken_mget)
+        with pytest.raises(module.RedisError):
+            await counters.snapshot("u1", ["daily"])
+        # Fails fast without touching Redis until the backoff has passed
+        with pytest.raises(module.RedisError):
+            await counters.snapshot("u1", ["daily"])
+        assert len(calls) == 1
+
+        counters._retry_at = 0.0
+        with pytest.raises(module.RedisError):
+            await counters.snapshot("u1", ["daily"])
+        assert len(calls) == 2
+
+    run(scenario())
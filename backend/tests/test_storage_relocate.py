@@ -0,0 +1,160 @@
+import asyncio
+import json
+import time
+
+import httpx
+from supabase import create_client
+
+from app.core import storage_uploads, supabase_storage
+from app.core.signed_url_cache import get_signed_url_cache
+from app.core.supabase_storage import SupabaseStorageService
+
+# Any JWT-shaped string passes the SDK's key check
+ANON_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.signature"
+
+
+class StorageServer:
+    """In-memory Storage API: objects per bucket, server-side move/copy, plain and TUS uploads"""
+
+    def __init__(self, objects):
+        self.objects = {bucket: dict(files) for bucket, files in objects.items()}
+        self.requests = []
+        self.in_flight = 0
+        self.peak = 0
+        self.uploads = {}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.removeprefix("/storage/v1")
+        self.requests.append((request.method, path))
+
+        if request.method == "POST" and path in ("/object/move", "/object/copy"):
+            body = json.loads(request.content)
+            files = self.objects.setdefault(body["bucketId"], {})
+            if body["sourceKey"] not in files:
+                return httpx.Response(404, json={"statusCode": "404", "error": "not_found", "message": "Object not found"})
+            data = files.pop(body["sourceKey"]) if path == "/object/move" else files[body["sourceKey"]]
+            files[body["destinationKey"]] = data
+            return httpx.Response(200, json={"message": "Successfully moved"})
+
+        if request.method == "POST" and path == "/upload/resumable":
+            self.uploads["upload-1"] = bytearray()
+            metadata = dict(pair.split(" ") for pair in request.headers["Upload-Metadata"].split(","))
+            self.uploads["target"] = metadata
+            return httpx.Response(201, headers={"Location": "/storage/v1/upload/resumable/upload-1"})
+        if request.method == "PATCH":
+            self.uploads["upload-1"].extend(request.content)
+            return httpx.Response(204, headers={"Upload-Offset": str(len(self.uploads["upload-1"]))})
+
+        bucket, _, key = path.removeprefix("/object/").partition("/")
+        if request.method == "GET":
+            data = self.objects.get(bucket, {}).get(key)
+            if data is None:
+                return httpx.Response(404)
+            return httpx.Response(200, content=data, headers={"Content-Type": "text/plain"})
+        if request.method == "POST":
+            self.objects.setdefault(bucket, {})[key] = self._file_part(request)
+            return httpx.Response(200, json={"Key": f"{bucket}/{key}"})
+        if request.method == "DELETE":
+            for prefix in json.loads(request.content)["prefixes"]:
+                self.objects.get(bucket, {}).pop(prefix, None)
+            return httpx.Response(200, json=[])
+        return httpx.Response(405)
+
+    @staticmethod
+    def _file_part(request: httpx.Request) -> bytes:
+        # The SDK sends plain uploads as multipart/form-data with a single "file" part
+        boundary = request.headers["Content-Type"].split("boundary=")[1].encode()
+        part = request.content.split(b"--" + boundary)[1]
+        return part.split(b"\r\n\r\n", 1)[1].removesuffix(b"\r\n")
+
+
+def make_service(server: StorageServer, monkeypatch) -> SupabaseStorageService:
+    transport = httpx.MockTransport(server)
+    client = create_client("http://supabase.test", ANON_KEY)
+    client.storage.session._transport = transport
+
+    # Cross-bucket copies stream through their own AsyncClient
+    async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        supabase_storage.httpx, "AsyncClient",
+        lambda **kwargs: async_client(transport=transport, **kwargs)
+    )
+
+    service = SupabaseStorageService.__new__(SupabaseStorageService)
+    service.client = client
+    service.default_bucket = "files"
+    return service
+
+
+def test_batch_move_within_a_bucket_runs_server_side(monkeypatch):
+    server = StorageServer({"files": {"a.txt": b"A", "b.txt": b"B"}})
+    service = make_service(server, monkeypatch)
+    get_signed_url_cache().put("files", "a.txt", 3600, "http://signed/a", time.time())
+
+    results = asyncio.run(service.relocate_files("move", [
+        {"from_path": "a.txt", "to_path": "archive/a.txt"},
+        {"from_path": "missing.txt", "to_path": "archive/missing.txt"},
+        {"from_path": "b.txt", "to_path": "archive/b.txt"}
+    ]))
+
+    # One missing object doesn't fail the rest of the batch
+    assert [result["success"] for result in results] == [True, False, True]
+    assert "error" in results[1]
+    assert server.objects["files"] == {"archive/a.txt": b"A", "archive/b.txt": b"B"}
+    # Moved without any bytes leaving the server
+    assert all(method == "POST" and path == "/object/move" for method, path in server.requests)
+    assert get_signed_url_cache().get("files", "a.txt", 3600) is None
+
+
+def test_batch_copy_across_buckets_streams_the_bytes(monkeypatch):
+    server = StorageServer({"files": {"small.txt": b"tiny", "large.txt": b"0123456789"}, "backup": {}})
+    service = make_service(server, monkeypatch)
+    # Force the resumable path for objects over 4 bytes
+    monkeypatch.setattr(supabase_storage, "UPLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(storage_uploads, "UPLOAD_CHUNK_SIZE", 4)
+
+    results = asyncio.run(service.relocate_files("copy", [
+        {"from_path": "small.txt", "to_path": "small.txt"},
+        {"from_path": "large.txt", "to_path": "large.txt"}
+    ], destination_bucket="backup"))
+
+    assert all(result["success"] for result in results)
+    assert server.objects["backup"] == {"small.txt": b"tiny"}
+    assert bytes(server.uploads["upload-1"]) == b"0123456789"
+    # Copies leave the source in place
+    assert set(server.objects["files"]) == {"small.txt", "large.txt"}
+
+
+def test_move_across_buckets_removes_the_source(monkeypatch):
+    server = StorageServer({"files": {"a.txt": b"A"}, "backup": {}})
+    service = make_service(server, monkeypatch)
+
+    asyncio.run(service.move_file("a.txt", "a.txt", destination_bucket="backup"))
+
+    assert server.objects == {"files": {}, "backup": {"a.txt": b"A"}}
+
+
+def test_batch_concurrency_is_bounded(monkeypatch):
+    monkeypatch.setattr(supabase_storage, "STORAGE_BATCH_CONCURRENCY", 2)
+    server = StorageServer({"files": {f"{n}.txt": b"x" for n in range(6)}})
+    service = make_service(server, monkeypatch)
+    running = peak = 0
+    relocate = service._relocate
+
+    async def counted(*args):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            await asyncio.sleep(0.01)
+            return await relocate(*args)
+        finally:
+            running -= 1
+
+    monkeypatch.setattr(service, "_relocate", counted)
+    results = asyncio.run(service.relocate_files("copy", [
+        {"from_path": f"{n}.txt", "to_path": f"copy/{n}.txt"} for n in range(6)
+    ]))
+
+    assert all(result["success"] for result in results)
+    assert peak == 2
@@ -0,0 +1,121 @@
+import asyncio
+import base64
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.core import storage_uploads
+from app.core.storage_uploads import ResumableUpload, iter_upload_chunks
+
+
+class TusServer:
+    """Minimal Supabase resumable-upload endpoint that can drop a PATCH part-way through"""
+
+    def __init__(self, fail_patches: int = 0):
+        self.fail_patches = fail_patches
+        self.metadata = {}
+        self.length = None
+        self.data = bytearray()
+        self.deleted = False
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        assert request.headers["Tus-Resumable"] == storage_uploads.TUS_VERSION
+        if request.method == "POST":
+            self.length = int(request.headers["Upload-Length"])
+            for pair in request.headers["Upload-Metadata"].split(","):
+                key, value = pair.split(" ")
+                self.metadata[key] = base64.b64decode(value).decode()
+            return httpx.Response(201, headers={"Location": "/storage/v1/upload/resumable/upload-1"})
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={"Upload-Offset": str(len(self.data))})
+        if request.method == "DELETE":
+            self.deleted = True
+            return httpx.Response(204)
+
+        assert request.url.path == "/storage/v1/upload/resumable/upload-1"
+        if int(request.headers["Upload-Offset"]) != len(self.data):
+            return httpx.Response(409)
+        body = request.read()
+        if self.fail_patches:
+            # Half the body arrives before the connection drops
+            self.fail_patches -= 1
+            self.data.extend(body[:len(body) // 2])
+            raise httpx.ReadError("connection reset", request=request)
+        self.data.extend(body)
+        return httpx.Response(204, headers={"Upload-Offset": str(len(self.data))})
+
+
+async def upload(server: TusServer, chunks, size: int) -> ResumableUpload:
+    async with httpx.AsyncClient(transport=httpx.MockTransport(server)) as client:
+        resumable = ResumableUpload(client, "files", "user/report.csv", "text/csv", size)
+        await resumable.create()
+        for chunk in chunks:
+            await resumable.send(chunk)
+        return resumable
+
+
+def test_resumable_upload_sends_every_chunk():
+    server = TusServer()
+    resumable = asyncio.run(upload(server, [b"a" * 10, b"b" * 10, b"c" * 5], 25))
+    assert server.metadata == {"bucketName": "files", "objectName": "user/report.csv", "contentType": "text/csv"}
+    assert server.length == 25
+    assert bytes(server.data) == b"a" * 10 + b"b" * 10 + b"c" * 5
+    assert resumable.offset == 25
+    assert resumable.url.endswith("/storage/v1/upload/resumable/upload-1")
+
+
+def test_failed_chunk_resumes_from_the_server_offset():
+    server = TusServer(fail_patches=2)
+    resumable = asyncio.run(upload(server, [b"0123456789", b"abcdefghij"], 20))
+    # Only the unacknowledged tail was re-sent, so nothing is duplicated
+    assert bytes(server.data) == b"0123456789abcdefghij"
+    assert resumable.offset == 20
+
+
+def test_chunk_gives_up_after_retries(monkeypatch):
+    monkeypatch.setattr(storage_uploads, "UPLOAD_CHUNK_RETRIES", 1)
+    server = TusServer(fail_patches=5)
+    with pytest.raises(httpx.ReadError):
+        asyncio.run(upload(server, [b"0123456789"], 10))
+
+
+def test_abort_deletes_the_partial_upload():
+    server = TusServer()
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(server)) as client:
+            resumable = ResumableUpload(client, "files", "user/report.csv", "text/csv", 10)
+            await resumable.abort()
+            assert not server.deleted
+            await resumable.create()
+            await resumable.abort()
+
+    asyncio.run(scenario())
+    assert server.deleted
+
+
+async def collect(chunks, max_bytes, size=None):
+    async def source():
+        for chunk in chunks:
+            yield chunk
+    return [chunk async for chunk in iter_upload_chunks(source(), max_bytes, size)]
+
+
+def test_upload_chunks_are_resliced(monkeypatch):
+    monkeypatch.setattr(storage_uploads, "UPLOAD_CHUNK_SIZE", 4)
+    assert asyncio.run(collect([b"abc", b"defgh", b"ij"], 100)) == [b"abcd", b"efgh", b"ij"]
+    assert asyncio.run(collect([], 100)) == [b""]
+
+
+def test_upload_chunks_enforce_limits(monkeypatch):
+    monkeypatch.setattr(storage_uploads, "UPLOAD_CHUNK_SIZE", 4)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(collect([b"abc"], 100, size=200))
+    assert error.value.status_code == 413
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(collect([b"abcdef", b"ghijkl"], 10))
+    assert error.value.status_code == 413
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(collect([b"abc"], 100, size=5))
+    assert error.value.status_code == 400
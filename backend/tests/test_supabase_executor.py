@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+from app.core import supabase_executor
+from app.core.supabase_executor import get_supabase_call_stats, run_supabase_call
+
+
+def storage_api(request: httpx.Request) -> httpx.Response:
+    """Stands in for the Supabase REST API behind a blocking SDK call"""
+    if request.url.path == "/storage/v1/bucket/missing":
+        return httpx.Response(404, json={"error": "Bucket not found"})
+    return httpx.Response(200, json={"name": request.url.path.rsplit("/", 1)[-1]})
+
+
+def blocking_get(path: str) -> dict:
+    with httpx.Client(base_url="http://supabase.test", transport=httpx.MockTransport(storage_api)) as client:
+        response = client.get(path)
+        response.raise_for_status()
+        return {**response.json(), "thread": threading.current_thread().name}
+
+
+def test_runs_the_call_on_the_executor():
+    result = asyncio.run(run_supabase_call("test.get", blocking_get, "/storage/v1/bucket/avatars"))
+    assert result["name"] == "avatars"
+    assert result["thread"].startswith("supabase")
+
+    stats = get_supabase_call_stats()
+    assert stats["latency"]["supabase.test.get"]["count"] >= 1
+    assert "test.get" not in stats["in_flight"]
+
+
+def test_errors_reach_the_caller_and_release_the_slot():
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run_supabase_call("test.error", blocking_get, "/storage/v1/bucket/missing"))
+    assert "test.error" not in get_supabase_call_stats()["in_flight"]
+
+
+def test_concurrency_is_bounded_per_operation(monkeypatch):
+    monkeypatch.setattr(supabase_executor, "SUPABASE_OPERATION_CONCURRENCY", 2)
+    lock = threading.Lock()
+    running = peak = 0
+
+    def slow_get(path: str) -> dict:
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        try:
+            threading.Event().wait(0.05)
+            return blocking_get(path)
+        finally:
+            with lock:
+                running -= 1
+
+    async def scenario():
+        return await asyncio.gather(*(
+            run_supabase_call("test.bounded", slow_get, f"/storage/v1/bucket/b{n}") for n in range(6)
+        ))
+
+    results = asyncio.run(scenario())
+    assert [result["name"] for result in results] == [f"b{n}" for n in range(6)]
+    assert peak == 2
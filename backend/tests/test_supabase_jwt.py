@@ -0,0 +1,121 @@
+import asyncio
+import base64
+import json
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.core import supabase_auth
+from app.core.auth import get_cached_principal, get_principal_from_token
+from app.core.supabase_auth import SupabaseJWTVerifier, mint_access_token
+from app.models.user import User
+
+SECRET = "test-jwt-secret"
+USER_ID = "6f1c2a4e-8d0b-4f5e-9a7c-3b2d1e0f9a8b"
+
+
+def verify(token, secret=SECRET):
+    return asyncio.run(SupabaseJWTVerifier(jwt_secret=secret, offline=True).verify(token))
+
+
+def test_valid_token():
+    claims = verify(mint_access_token(USER_ID, "user@example.com", jwt_secret=SECRET))
+    assert claims["sub"] == USER_ID
+    assert claims["email"] == "user@example.com"
+    assert claims["aud"] == supabase_auth.SUPABASE_JWT_AUDIENCE
+
+
+def test_expired_token():
+    token = mint_access_token(USER_ID, "user@example.com", expires_delta=timedelta(minutes=-1), jwt_secret=SECRET)
+    assert verify(token) is None
+
+
+def test_wrong_audience(monkeypatch):
+    monkeypatch.setattr(supabase_auth, "SUPABASE_JWT_AUDIENCE", "anon")
+    token = mint_access_token(USER_ID, "user@example.com", jwt_secret=SECRET)
+    monkeypatch.undo()
+    assert verify(token) is None
+
+
+def test_bad_signature():
+    token = mint_access_token(USER_ID, "user@example.com", jwt_secret="some-other-secret")
+    assert verify(token) is None
+
+    header, payload, signature = mint_access_token(USER_ID, "user@example.com", jwt_secret=SECRET).split(".")
+    tampered = signature[:-2] + ("AA" if signature[-2:] != "AA" else "BB")
+    assert verify(".".join([header, payload, tampered])) is None
+
+
+def test_unverifiable_tokens():
+    # No secret configured, an unsupported algorithm, and garbage
+    assert verify(mint_access_token(USER_ID, "user@example.com", jwt_secret=SECRET), secret=None) is None
+    unsigned = ".".join(
+        base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+        for part in ({"alg": "none", "typ": "JWT"}, {"sub": USER_ID})
+    ) + "."
+    assert verify(unsigned) is None
+    assert verify("not-a-jwt") is None
+
+
+def test_hs256_tokens_need_a_remote_check_only_without_a_secret():
+    token = mint_access_token(USER_ID, "user@example.com", jwt_secret=SECRET)
+    assert SupabaseJWTVerifier(jwt_secret=None, offline=False).needs_remote_check(token)
+    assert not SupabaseJWTVerifier(jwt_secret=SECRET, offline=False).needs_remote_check(token)
+    assert not SupabaseJWTVerifier(jwt_secret=None, offline=True).needs_remote_check(token)
+    assert not SupabaseJWTVerifier(jwt_secret=None, offline=False).needs_remote_check("not-a-jwt")
+
+
+def test_offline_mode_without_a_secret_refuses_to_start(monkeypatch):
+    monkeypatch.setattr(supabase_auth, "SUPABASE_JWT_SECRET", None)
+    monkeypatch.setattr(supabase_auth, "SUPABASE_AUTH_OFFLINE", True)
+    with pytest.raises(RuntimeError):
+        supabase_auth.check_jwt_config()
+
+    monkeypatch.setattr(supabase_auth, "SUPABASE_AUTH_OFFLINE", False)
+    supabase_auth.check_jwt_config()
+
+
+def test_supabase_tokens_resolve_to_principals(monkeypatch, async_session_factory):
+    service = supabase_auth.SupabaseAuthService()
+    service.verifier = SupabaseJWTVerifier(jwt_secret=SECRET, offline=True)
+    monkeypatch.setattr(supabase_auth, "get_supabase_auth_service", lambda: service)
+    monkeypatch.setattr(supabase_auth, "AsyncSessionLocal", async_session_factory)
+
+    async def scenario():
+        async with async_session_factory() as db:
+            db.add(User(id=uuid.UUID(USER_ID), email="user@example.com", hashed_password=""))
+            await db.commit()
+            # Not signed with JWT_SECRET_KEY, so it is handed to SupabaseAuthService
+            token = mint_access_token(USER_ID, "user@example.com", jwt_secret=SECRET)
+            principal = await get_principal_from_token(token, db)
+            assert principal.id == uuid.UUID(USER_ID)
+            assert principal.email == "user@example.com"
+            assert get_cached_principal(token) == principal
+
+            forged = mint_access_token(USER_ID, "user@example.com", jwt_secret="some-other-secret")
+            assert await get_principal_from_token(forged, db) is None
+
+    asyncio.run(scenario())
+
+
+def test_without_a_secret_hs256_tokens_are_checked_with_supabase(monkeypatch):
+    service = supabase_auth.SupabaseAuthService()
+    service.verifier = SupabaseJWTVerifier(jwt_secret=None, offline=False)
+    service._auth_client = SimpleNamespace(auth=SimpleNamespace(get_user=None))
+    checked = []
+
+    async def fake_call(operation, func, token):
+        checked.append(operation)
+        return SimpleNamespace(user=SimpleNamespace(id=USER_ID)) if token == good else None
+
+    monkeypatch.setattr(supabase_auth, "run_supabase_call", fake_call)
+    good = mint_access_token(USER_ID, "user@example.com", jwt_secret=SECRET)
+    bad = mint_access_token(USER_ID, "user@example.com", jwt_secret="revoked")
+
+    claims = asyncio.run(service._get_claims(good))
+    assert claims["sub"] == USER_ID
+    assert claims["exp"] is not None
+    assert asyncio.run(service._get_claims(bad)) is None
+    assert checked == ["auth.get_user", "auth.get_user"]
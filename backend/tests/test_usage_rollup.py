@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+
+from app.models.user import User, APIKey
+from app.models.usage import UsageLog, DailyUsageSummary
+from app.services.usage_rollup import finalize_day, get_usage_totals
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def add_user_with_usage(db, days_ago, cost):
+    user = User(email="rollup@example.com", hashed_password="x")
+    db.add(user)
+    await db.flush()
+    api_key = APIKey(name="key", provider="openai", encrypted_key="x", user_id=user.id)
+    db.add(api_key)
+    await db.flush()
+
+    used_at = datetime.utcnow() - timedelta(days=days_ago)
+    db.add(UsageLog(
+        user_id=user.id, api_key_id=api_key.id, provider="openai", model="gpt-4",
+        endpoint="/chat/completions", total_tokens=100, cost=cost, latency_ms=120,
+        status_code=200, created_at=used_at
+    ))
+    await db.commit()
+    return user.id, used_at.date()
+
+
+def test_all_time_totals_survive_expired_raw_logs(async_session_factory):
+    async def scenario():
+        async with async_session_factory() as db:
+            user_id, day = await add_user_with_usage(db, days_ago=40, cost=2.5)
+            await finalize_day(db, day)
+            before = await get_usage_totals(db, user_id, None, datetime.utcnow())
+
+            # What partition maintenance leaves behind once the month has expired
+            await db.execute(delete(UsageLog).where(UsageLog.user_id == user_id))
+            await db.commit()
+            after = await get_usage_totals(db, user_id, None, datetime.utcnow())
+
+            assert before == {"requests": 1, "tokens": 100, "cost": 2.5}
+            assert after == before
+            assert await db.scalar(select(func.count(DailyUsageSummary.id))) >= 1
+
+    run(scenario())
+
+
+def test_all_time_totals_are_zero_without_usage(async_session_factory):
+    async def scenario():
+        async with async_session_factory() as db:
+            user = User(email="idle@example.com", hashed_password="x")
+            db.add(user)
+            await db.commit()
+            totals = await get_usage_totals(db, user.id, None, datetime.utcnow())
+            assert totals == {"requests": 0, "tokens": 0, "cost": 0.0}
+
+    run(scenario())